@@ -29,6 +29,7 @@ import argparse
 import glob
 # own imports
 import act.sub
+import act.writers
 
 _FACTORED_EXT = f'.factored{act.sub.JSON_EXT}'
 _FNAME_COMMON_FACTORS = f'common{act.sub.JSON_EXT}'
@@ -59,8 +60,9 @@ any two characters.
 _A_OUTDIR_N = '--outdir'
 _A_OUTDIR_H = f"""Path to a directory for output. If absent, {_A_INFILE_N} must
 be a file (not a glob pattern), and all output files are written to infile's 
-directory. If present (1) the directory is deleted and then re-created (2) the 
-directory structure of the input files is mirrored under outdir (3) output 
+directory. If present (1) the directory is replaced when the output is 
+complete, written to a new directory next to it (2) the directory structure 
+of the input files is mirrored under outdir (3) output 
 files are written to the mirrored directory corresponding to the input 
 directory. Example: outdir=/D infile=["a.json","./x/b.json"] result:
 /D/{_FNAME_COMMON_FACTORS},
@@ -169,7 +171,6 @@ def _output_paths(in_paths, source_dir, target_dir):
                     act.sub.OUT_PREFIX + fname_base + act.sub.MERGELIST_EXT))
     else:
         common_factors = os.path.join(target_dir, _FNAME_COMMON_FACTORS)
-        act.sub.create_or_empty_dir(target_dir)
         msd = act.sub.MirrorSubdirs(target_dir, in_paths)
         for p in in_paths:
             p = msd.gen_file_path(p)
@@ -207,8 +208,9 @@ def factor(source_path, target_dir=None, file_not_glob=True):
             relative to this file's directory.
 
         target_dir: A directory for the output. If None, output is in same
-            directory as source_path. If not None, the directory is deleted
-            then re-created, mirroring input file directory structure.
+            directory as source_path. If not None, the output is written to a
+            new directory, mirroring input file directory structure, that 
+            replaces target_dir when complete. See act.writers.StagingDir.
             
         file_not_glob: TODO re-work this function's doc string for glob 
             patterns.
@@ -239,6 +241,23 @@ def factor(source_path, target_dir=None, file_not_glob=True):
                 all_paths.append(act.sub.canonical(p))
         source_dir = None
     p2flat = _load_and_flatten(all_paths)
+    if target_dir is None:
+        return _write_factored(p2flat, source_path, source_dir, None)
+    staging = act.writers.StagingDir(target_dir)
+    try:
+        result = _write_factored(p2flat, source_path, source_dir,
+                                 staging.path)
+        staging.commit()
+    except BaseException:
+        staging.discard()
+        raise
+    return (staging.target_path(result[0]),
+            [staging.target_path(p) for p in result[1]],
+            [staging.target_path(p) for p in result[2]])
+
+
+def _write_factored(p2flat, source_path, source_dir, target_dir):
+    """Writes output of factor(), see _output_paths() for directories."""
     common_factors, factored_files, merge_files = _output_paths(
         list(p2flat.keys()), source_dir, target_dir)
     common_flatkeys = _intersection(p2flat)
@@ -289,6 +308,7 @@ def _parse_args():
                    _A_OUTDIR_N,
                    help=_A_OUTDIR_H,
                    type=lambda x: act.sub.dwok(x, _A_OUTDIR_N[2:], p))
+    act.sub.add_fsync_arg(p)
     act.sub.add_log_arg(p)
     pa = p.parse_args()
     assert file_not_glob is not None
@@ -303,8 +323,11 @@ def _main():
     act.sub.set_up_logging(act.sub.LOGGING_LEVEL_NAME2VALUE[args.log_level],
                            args.console)
     logger.info('file_not_glob=%s', file_not_glob)
+    act.sub.use_fsync(args.fsync)
     factor(args.infile, args.outdir, file_not_glob)
+    act.sub.sync_dirs()
 
 
 if __name__ == '__main__':
+    act.writers.use_detached_removals(True)
     _main()
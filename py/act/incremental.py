@@ -0,0 +1,338 @@
+"""Records a mergeall.py run keeps in its output directory, for a later run to
+merge again only what changed. See mergeall.py options --symbol_usage,
+--symbols_changed and --incremental.
+"""
+import logging
+import os.path
+# own imports
+import act.mergetree
+import act.sub
+import act.symbols
+
+# Name of json file in output directory with the symbols used by each output.
+SYMBOL_USAGE_FNAME = os.path.normcase('mergeall.symbol_usage.json')
+# Name of json file in output directory with the inputs of each merge list.
+DEPENDENCIES_FNAME = os.path.normcase('mergeall.dependencies.json')
+
+logger = logging.getLogger(__name__)
+
+
+class Error(act.sub.Error):
+    """Exceptions raised in this module are of this class."""
+
+
+class SymbolUsage:
+    """Symbols used by the outputs of each merge list.
+
+    Saved in the output directory, for a later run to regenerate only the 
+    outputs affected by changes to symbol definition files.
+    """
+
+    _VERSION = 1
+
+    def __init__(self, msd):
+        self._msd = msd
+        self._path = os.path.join(msd.out_dir(), SYMBOL_USAGE_FNAME)
+        # Merge list path relative to input dir -> record. See add().
+        self._previous = {}
+        self._current = {}
+        # Canonical paths of outputs written in this run.
+        self._written = set()
+
+    def load(self):
+        """Reads usage saved by a previous run. Returns False if there is none.
+        """
+        if not os.path.isfile(self._path):
+            return False
+        j = act.sub.read_json(self._path)
+        if not isinstance(j, dict) or j.get('version') != self._VERSION:
+            raise Error(f'Unknown format of {self._path}.')
+        self._previous = j['mergelists']
+        return True
+
+    def is_current(self, in_path, symbol_args):
+        """True if outputs of merge list in_path need no regeneration.
+
+        symbol_args includes the options of what is written, so outputs
+        written with other options are not current.
+
+        If True, the merge list's record is carried over to this run.
+        """
+        rel = self._msd.rel_path(in_path)
+        rec = self._previous.get(rel)
+        result = False
+        if rec is None:
+            logger.info('Merge list is new: %s.', in_path)
+        elif rec['args'] != list(symbol_args):
+            logger.info('Merge list options changed: %s.', in_path)
+        elif any(p in self._written for p in self._out_paths(rec)):
+            logger.info('Outputs overwritten this run: %s.', in_path)
+        elif not all(
+                os.path.isfile(c)
+                for p in self._out_paths(rec)
+                for c in [p] + act.sub.companion_paths(p)):
+            logger.info('Outputs missing: %s.', in_path)
+        elif rec['symbols'] and not self._same_symbols(rec):
+            logger.info('Symbols used changed: %s.', in_path)
+        else:
+            logger.info('Symbols used unchanged: %s.', in_path)
+            self._current[rel] = rec
+            result = True
+        return result
+
+    def _out_paths(self, rec):
+        return [
+            act.sub.canonical(os.path.join(self._msd.out_dir(), p))
+            for p in rec['outputs']
+        ]
+
+    @staticmethod
+    def _same_symbols(rec):
+        try:
+            index = act.symbols.SymbolIndex.get(rec['symbols'])
+            if (sorted(index.set_names) != rec['set_names'] or
+                    _scope_as_json(index) != rec['scope']):
+                return False
+            for u in rec['outputs'].values():
+                if u is not None:
+                    sym2val = index.resolve(u['set'])
+                    for k, v in u['used'].items():
+                        if sym2val.get(k) != v:
+                            return False
+                    for k in u['missing']:
+                        if k in sym2val:
+                            return False
+        except (act.sub.Error, OSError):
+            logger.exception('Symbols of %s not usable.', rec['symbols'])
+            return False
+        return True
+
+    def add(self, in_path, symbol_args, usage):
+        """Records usage of merge list in_path, see act.mergejson.MergeOptions.
+        """
+        symbols = None
+        outputs = {}
+        for p, u in sorted(usage.items()):
+            self._written.add(act.sub.canonical(p))
+            rp = os.path.relpath(p, self._msd.out_dir())
+            outputs[rp] = None
+            if u is not None:
+                symbols = u['symbols']
+                outputs[rp] = {k: u[k] for k in ['set', 'used', 'missing']}
+        index = act.symbols.SymbolIndex.get(symbols) if symbols else None
+        self._current[self._msd.rel_path(in_path)] = {
+            'args': list(symbol_args),
+            'symbols': symbols,
+            'set_names': sorted(index.set_names) if index else None,
+            'scope': _scope_as_json(index) if index else None,
+            'outputs': outputs
+        }
+
+    def discard(self, in_path):
+        """Forgets what add() recorded for merge list in_path."""
+        self._current.pop(self._msd.rel_path(in_path), None)
+
+    def outputs(self, in_path):
+        """Returns canonical paths of outputs recorded for merge list."""
+        return self._out_paths(self._current[self._msd.rel_path(in_path)])
+
+    def save(self):
+        """Writes what add() recorded, and what is carried over."""
+        symbols = {}
+        for rec in self._current.values():
+            for rp, u in rec['outputs'].items():
+                if u is not None:
+                    s2o = symbols.setdefault(rec['symbols'], {})
+                    for k in list(u['used']) + u['missing']:
+                        s2o.setdefault(k, []).append(rp)
+        for s2o in symbols.values():
+            for outputs in s2o.values():
+                outputs.sort()
+        act.sub.write_as_json(
+            {
+                'version': self._VERSION,
+                'mergelists': self._current,
+                'symbols': symbols
+            }, self._path)
+
+
+def _scope_as_json(index):
+    return index.scope.as_json() if index.scope else None
+
+
+class Dependencies:
+    """Inputs and outputs of each merge list.
+
+    Saved in the output directory, for a later run to merge again only the
+    merge lists whose inputs or options changed. An input is recorded with
+    its modification time, size and digest: it is unchanged if the first two
+    are, else if the digest is.
+    """
+
+    _VERSION = 1
+
+    def __init__(self, msd, in_dir):
+        self._msd = msd
+        self._in_dir = act.sub.canonical(in_dir)
+        self._path = os.path.join(msd.out_dir(), DEPENDENCIES_FNAME)
+        # Merge list path relative to input dir -> record. See add().
+        self._previous = {}
+        self._current = {}
+        # Input path -> [mtime_ns, size, digest], see _signature().
+        self._signatures = {}
+
+    def load(self):
+        """Reads dependencies saved by a previous run, if any."""
+        if not os.path.isfile(self._path):
+            logger.info('No %s, merge all.', self._path)
+            return
+        j = act.sub.read_json(self._path)
+        if not isinstance(j, dict) or j.get('version') != self._VERSION:
+            logger.warning('Unknown format of %s, merge all.', self._path)
+            return
+        self._previous = j['mergelists']
+
+    def stale(self, merge_lists, options, after):
+        """Returns set of indices of merge_lists (see act.mergetree.walk()) to
+        merge again.
+
+        Args:
+            options: Function of symbol args returning the options recorded.
+            after: For each of merge_lists, the set of indices of the earlier
+                ones that may write one of its outputs.
+        """
+        rels = [self._msd.rel_path(p) for p, _, _ in merge_lists]
+        current = set(rels)
+        # Output -> merge list that wrote it last in the previous run.
+        owner = {}
+        for rel, rec in self._previous.items():
+            for rp in rec['outputs']:
+                owner[rp] = rel
+        changed = {
+            rel for rel, (p, symbol_args, _) in zip(rels, merge_lists)
+            if not self._is_current(p, options(symbol_args))
+        }
+        result = set()
+        for i, rel in enumerate(rels):
+            if rel in changed:
+                result.add(i)
+            elif any(owner[rp] not in current or owner[rp] in changed
+                     for rp in self._previous[rel]['outputs']
+                     if owner[rp] != rel):
+                logger.info('Outputs overwritten by a merge list gone or '
+                            'merged again: %s.', merge_lists[i][0])
+                result.add(i)
+            elif after[i] & result:
+                logger.info('Outputs may be overwritten by a merge list merged '
+                            'again: %s.', merge_lists[i][0])
+                result.add(i)
+        return result
+
+    def _is_current(self, in_path, options):
+        rec = self._previous.get(self._msd.rel_path(in_path))
+        result = False
+        if rec is None:
+            logger.info('Merge list is new: %s.', in_path)
+        elif rec['options'] != options:
+            logger.info('Merge list options changed: %s.', in_path)
+        elif not all(
+                os.path.isfile(c)
+                for p in self._out_paths(rec)
+                for c in [p] + act.sub.companion_paths(p)):
+            logger.info('Outputs missing: %s.', in_path)
+        elif not all(
+                self._is_unchanged(p, s) for p, s in rec['inputs'].items()):
+            logger.info('Inputs changed: %s.', in_path)
+        else:
+            logger.debug('Inputs unchanged: %s.', in_path)
+            result = True
+        return result
+
+    def _is_unchanged(self, path, signature):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if [st.st_mtime_ns, st.st_size] == signature[:2]:
+            self._signatures[path] = signature
+            return True
+        return self._signature(path)[2] == signature[2]
+
+    def _signature(self, path):
+        result = self._signatures.get(path)
+        if result is None:
+            st = os.stat(path)
+            result = [
+                st.st_mtime_ns, st.st_size,
+                act.sub.file_digest(path).hex()
+            ]
+            self._signatures[path] = result
+        return result
+
+    def inputs(self, in_path):
+        """Returns inputs (see act.mergetree.inputs()) of merge list in_path
+        with their signatures, None if not readable.
+
+        Call before merging, so a file changed while merging is changed for
+        the next run too.
+        """
+        try:
+            return {
+                p: self._signature(p)
+                for p in act.mergetree.inputs(in_path, self._in_dir)
+            }
+        except (act.sub.Error, OSError):
+            logger.exception('Inputs of %s not readable.', in_path)
+            return None
+
+    def add(self, in_path, options, inputs, written):
+        """Records inputs and outputs written of merge list in_path."""
+        self._current[self._msd.rel_path(in_path)] = {
+            'options': options,
+            'inputs': inputs,
+            'outputs': sorted(
+                os.path.relpath(p, self._msd.out_dir()) for p in written)
+        }
+
+    def carry_over(self, in_path):
+        """Records for merge list in_path what the previous run recorded.
+
+        Returns:
+            Canonical paths of its outputs.
+        """
+        rel = self._msd.rel_path(in_path)
+        self._current[rel] = self._previous[rel]
+        return self._out_paths(self._current[rel])
+
+    def discard(self, in_path):
+        """Forgets what add() recorded for merge list in_path."""
+        self._current.pop(self._msd.rel_path(in_path), None)
+
+    def _out_paths(self, rec):
+        return [
+            act.sub.canonical(os.path.join(self._msd.out_dir(), p))
+            for p in rec['outputs']
+        ]
+
+    def save(self):
+        """Writes what add() and carry_over() recorded."""
+        act.sub.write_as_json(
+            {
+                'version': self._VERSION,
+                'mergelists': self._current
+            }, self._path)
+
+    @classmethod
+    def input_paths(cls, out_dir):
+        """Returns inputs saved in out_dir, empty if none or unreadable."""
+        try:
+            j = act.sub.read_json(os.path.join(out_dir, DEPENDENCIES_FNAME),
+                                  logging.DEBUG)
+            if j.get('version') == cls._VERSION:
+                return {
+                    p for rec in j['mergelists'].values()
+                    for p in rec['inputs']
+                }
+        except (act.sub.Error, OSError, AttributeError):
+            pass
+        return set()
@@ -0,0 +1,213 @@
+"""Json text: written indented, fast, and where the values are in it.
+
+Imports no other act module, so any of them can use it.
+"""
+import itertools
+import json
+import re
+import threading
+
+# Number of pieces of json text collected before a write to file.
+_DUMP_CHUNK = 4096
+# Python types json encodes as objects or arrays.
+_CONTAINERS = (dict, list, tuple)
+_INF = float('inf')
+# Per nesting level: newline and indentation, and ensure_ascii -> C encoder of
+# objects and arrays with no objects and arrays in them. Grown under lock, as
+# json may be written by several threads, see act.writers.BackgroundWriter.
+_dump_newlines = ['\n']
+_dump_flat_encoders = {True: [None], False: [None]}
+_dump_lock = threading.Lock()
+
+
+def dump_indented(o, fp, ensure_ascii=True):
+    """Same as json.dump(o, fp, indent=4, ensure_ascii=ensure_ascii), faster.
+
+    json.dump() with indent does not use the C encoder, and calls fp.write()
+    for every small piece of text. Here objects and arrays with only
+    primitive values are encoded by the C encoder (when available), and text
+    is written in chunks of many pieces.
+    """
+    enc_str = (json.encoder.encode_basestring_ascii
+               if ensure_ascii else json.encoder.encode_basestring)
+    newlines = _dump_newlines
+    flat_encoders = _dump_flat_encoders[ensure_ascii]
+    c_make_encoder = json.encoder.c_make_encoder
+    parts = []
+    append = parts.append
+
+    def newline(level):
+        if len(newlines) <= level or len(flat_encoders) <= level:
+            with _dump_lock:
+                while len(newlines) <= level:
+                    newlines.append('\n' + '    ' * len(newlines))
+                while c_make_encoder and len(flat_encoders) <= level:
+                    flat_encoders.append(
+                        c_make_encoder(None, _not_serializable, enc_str, None,
+                                       ': ', ',' + newlines[len(flat_encoders)],
+                                       False, False, True))
+        return newlines[level]
+
+    def flat(items):
+        return c_make_encoder is not None and not any(
+            map(isinstance, items, itertools.repeat(_CONTAINERS)))
+
+    def encode_flat(o, level, brackets):
+        s = ''.join(flat_encoders[level](o, 0))
+        append(brackets[0] + newlines[level] + s[1:-1] + newlines[level - 1] +
+               brackets[1])
+
+    def encode(o, level):
+        t = type(o)
+        if t is str:
+            append(enc_str(o))
+        elif o is None:
+            append('null')
+        elif o is True:
+            append('true')
+        elif o is False:
+            append('false')
+        elif isinstance(o, int):
+            append(int.__repr__(o))
+        elif isinstance(o, float):
+            append(_float_str(o))
+        elif isinstance(o, dict):
+            if not o:
+                append('{}')
+                return
+            level += 1
+            separator = ',' + newline(level)
+            if t is dict and flat(o.values()):
+                encode_flat(o, level, '{}')
+            else:
+                append('{' + newlines[level])
+                first = True
+                for k, v in o.items():
+                    if first:
+                        first = False
+                    else:
+                        append(separator)
+                    append(enc_str(_key_str(k)))
+                    append(': ')
+                    encode(v, level)
+                append(newlines[level - 1] + '}')
+        elif isinstance(o, (list, tuple)):
+            if not o:
+                append('[]')
+                return
+            level += 1
+            separator = ',' + newline(level)
+            if t is list and flat(o):
+                encode_flat(o, level, '[]')
+            else:
+                append('[' + newlines[level])
+                first = True
+                for v in o:
+                    if first:
+                        first = False
+                    else:
+                        append(separator)
+                    encode(v, level)
+                append(newlines[level - 1] + ']')
+        else:
+            _not_serializable(o)
+        if len(parts) > _DUMP_CHUNK:
+            fp.write(''.join(parts))
+            parts.clear()
+
+    encode(o, 0)
+    fp.write(''.join(parts))
+
+
+def _not_serializable(o):
+    raise TypeError(f'Object of type {type(o).__name__} '
+                    'is not JSON serializable')
+
+
+def _float_str(o):
+    if o != o:  # pylint: disable=comparison-with-itself
+        return 'NaN'
+    if o == _INF:
+        return 'Infinity'
+    if o == -_INF:
+        return '-Infinity'
+    return float.__repr__(o)
+
+
+def _key_str(k):
+    """Returns object key k as json.dump() does."""
+    if isinstance(k, str):
+        return k
+    if isinstance(k, float):
+        return _float_str(k)
+    if k is True:
+        return 'true'
+    if k is False:
+        return 'false'
+    if k is None:
+        return 'null'
+    if isinstance(k, int):
+        return int.__repr__(k)
+    raise TypeError(
+        f'keys must be str, int, float, bool or None, not {type(k).__name__}')
+
+
+def json_pointer(tokens):
+    """Returns RFC 6901 JSON pointer for keys and array indices in tokens."""
+    return ''.join(
+        '/' + str(t).replace('~', '~0').replace('/', '~1') for t in tokens)
+
+
+# Json whitespace.
+_WS = re.compile(r'[ \t\n\r]*')
+_json_decoder = json.JSONDecoder()
+
+
+def value_spans(s, depth):
+    """Returns {JSON pointer: [byte offset, byte length]} of values in s.
+
+    Values are those down to depth levels in json text s, in document order.
+    Deeper values are decoded by the json module, not walked through.
+    """
+    spans = {}
+
+    def skip(i):
+        return _WS.match(s, i).end()
+
+    def walk(i, tokens):
+        pointer = json_pointer(tokens)
+        spans[pointer] = None
+        if len(tokens) < depth and s[i] in '{[':
+            close = '}' if s[i] == '{' else ']'
+            j = skip(i + 1)
+            n = 0
+            while s[j] != close:
+                if close == '}':
+                    key, j = json.decoder.scanstring(s, j + 1)
+                    j = skip(skip(j) + 1)
+                else:
+                    key = n
+                j = skip(walk(j, tokens + [key]))
+                n += 1
+                if s[j] == ',':
+                    j = skip(j + 1)
+            end = j + 1
+        else:
+            end = _json_decoder.raw_decode(s, i)[1]
+        spans[pointer] = (i, end)
+        return end
+
+    walk(skip(0), [])
+    if s.isascii():
+        return {p: [i, end - i] for p, (i, end) in spans.items()}
+    # Character to byte offsets.
+    byte_offset = {}
+    b = c = 0
+    for i in sorted({i for span in spans.values() for i in span}):
+        b += len(s[c:i].encode('utf-8'))
+        c = i
+        byte_offset[i] = b
+    return {
+        p: [byte_offset[i], byte_offset[end] - byte_offset[i]
+           ] for p, (i, end) in spans.items()
+    }
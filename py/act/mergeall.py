@@ -3,15 +3,19 @@ import logging
 import os
 import os.path
 import argparse
+import concurrent.futures
+import heapq
 import sys
+import threading
+import time
 # own imports
 import act.sub
+import act.incremental
 import act.mergejson
+import act.mergetree
+import act.symbols
+import act.writers
 
-# Name of json file used to override mode4symbols in dir sub-tree.
-_MODE4SYMBOLS_FNAME = os.path.normcase('mergeall.args.json')
-# Name of json file used to exclude files just that directory.
-_EXCLUDE_FNAME = os.path.normcase('mergeall.exclude.json')
 # Text with _A prefix for command line Args
 _A_DESCRIPTION = (
     f'Apply mergejson.py to each *{act.sub.MERGELIST_EXT} and '
@@ -19,14 +23,17 @@ _A_DESCRIPTION = (
     '(to know what mergejson.py does, read its command line help).'
     '\n\n'
     'Specific file names in a directory are ignored if listed in a per-directory '
-    f'exclusion list file named {_EXCLUDE_FNAME}.'
+    f'exclusion list file named {act.mergetree.EXCLUDE_FNAME}.'
     '\n\n'
     'The command line arguments for symbol processing can be overridden for a '
     'directory D and all it\'s sub-directories (until overridden again in a '
-    f'sub-directory) with values from a file in D named {_MODE4SYMBOLS_FNAME}. '
+    'sub-directory) with values from a file in D named '
+    f'{act.mergetree.MODE4SYMBOLS_FNAME}. '
     'For example, such a file might contain {"--mode4symbols":"NAMED", '
-    '"--symset":"INDIA"} or  {"--mode4symbols":"ERROR"}. The short single dash '
-    'forms of the command line argument are not recognized here.')
+    '"--symset":"INDIA"} or  {"--mode4symbols":"ERROR"} or '
+    '{"--mode4symbols":"DIR", "--symset":"DE,FR,U*", "--no_globals":true}. '
+    'The short single dash forms of the command line argument are not '
+    'recognized here.')
 _A_INDIR_N = 'indir'
 _A_INDIR_H = ('The directory and all its sub-directories under which to merge '
               'matching files.')
@@ -36,12 +43,99 @@ _A_OUTDIR_H = f"""Output directory under which one *{act.sub.OUT_MERGED_EXT} tar
 file is written for each *{act.sub.MERGELIST_EXT} source file found.
 The target file is written in a sub-directory mirroring the source file's
 location. Default is {_A_OUTDIR_D}. BEWARE: If <outdir> exists, all its 
-contents are deleted and then regenerated. 
+contents are deleted and then regenerated. Outputs are written to a new 
+directory next to <outdir>, which replaces it when all are written.
 """
-# Indices for tuples yielded by os.walk()
-_OW_DIRPATH = 0
-_OW_DIRNAMES = 1
-_OW_FILENAMES = 2
+_A_SYMBOL_USAGE_N = '--symbol_usage'
+_A_SYMBOL_USAGE_H = (
+    f'Write {act.incremental.SYMBOL_USAGE_FNAME} in the output directory. It '
+    'records for each merge list its outputs and the symbols each output '
+    'used, and for each symbol the outputs that used it.')
+_A_WRITERS_N = '--writers'
+_A_WRITERS_D = 0
+_A_WRITERS_H = (
+    'Number of threads writing output files in the background while merging '
+    f'continues. Default is {_A_WRITERS_D}: each output is written before the '
+    'next merge. Outputs are the same for any number.')
+_A_JOBS_H = (
+    'Number of processes merging merge lists in parallel, largest first. '
+    'Merge lists that may write the same output, like one in DIR mode and '
+    'one in a sub-directory named after a symbol set, are merged one after '
+    'the other, in the order of a serial run. Outputs and errors are the '
+    'same for any number.')
+_A_WRITE_BUDGET_N = '--write_budget'
+_A_WRITE_BUDGET_D = 256
+_A_WRITE_BUDGET_H = (
+    f'With {_A_WRITERS_N}, merging waits while the outputs waiting to be '
+    'written take more than this many MiB, as estimated from the sizes of '
+    f'the files merged. Default is {_A_WRITE_BUDGET_D}.')
+_A_ARCHIVE_N = '--archive'
+_A_ARCHIVE_H = (
+    'Write all outputs as members of this archive file, instead of files '
+    'under the output directory, which is neither emptied nor written to. '
+    'Member names are the output file paths relative to the output '
+    'directory. The format is given by the file name extension, one of '
+    f'{", ".join(act.sub.ARCHIVE_EXTS)}. A .jsonl archive has one line per '
+    'output, a json object with "path" and "json" attributes. A path '
+    'written more than once is in the archive more than once, the last one '
+    'wins. Outputs written before a merge list fails in DIR mode stay in the '
+    'archive.')
+_A_KEEP_UNCHANGED_N = '--keep_unchanged'
+_A_KEEP_UNCHANGED_H = (
+    'Do not empty the output directory first. Output files with the same '
+    'content as before are not rewritten, so their modification time does '
+    'not change. Files the run does not generate are deleted at the end.')
+_A_SYMBOLS_CHANGED_N = '--symbols_changed'
+_A_SYMBOLS_CHANGED_H = (
+    'Regenerate only the outputs affected by changes to symbol definition '
+    'files since the run that wrote '
+    f'{act.incremental.SYMBOL_USAGE_FNAME} in the output directory. An output '
+    'is affected if a symbol it used changed value, a symbol undefined for it '
+    'became defined, or the symbol sets or interpolation scope of its symbol '
+    f'definition file changed. New merge lists are merged. Implies '
+    f'{_A_SYMBOL_USAGE_N} and {_A_KEEP_UNCHANGED_N}. Use only if nothing but '
+    'symbol definition files changed.')
+_A_INCREMENTAL_N = '--incremental'
+_A_INCREMENTAL_H = (
+    'Merge again only the merge lists whose inputs or options changed since '
+    f'the run that wrote {act.incremental.DEPENDENCIES_FNAME} in the output '
+    'directory, and those whose outputs they may overwrite. The inputs of a '
+    'merge list are its file, the files and merge lists in it, its symbol '
+    f'definition file, the {act.mergetree.MODE4SYMBOLS_FNAME} files of its '
+    'directory and the directories above, and the '
+    f'{act.mergetree.EXCLUDE_FNAME} file of its directory. Outputs of '
+    'merge lists gone are deleted. Outputs are the same as merging all. '
+    f'Implies {_A_KEEP_UNCHANGED_N}.')
+_A_WATCH_N = '--watch'
+_A_WATCH_H = (
+    'After merging, keep running and merge again each time files under the '
+    'input directory, or files outside it that merge lists use, change. '
+    'Changes are found by comparing file modification times, sizes and '
+    f'inode numbers. Each run is as with {_A_INCREMENTAL_N}, which this '
+    'implies. Stop with Ctrl-C.')
+_A_POLL_N = '--poll'
+_A_POLL_D = 1.0
+_A_POLL_H = (f'With {_A_WATCH_N}, seconds between looks for changes. '
+             f'Default is {_A_POLL_D}.')
+_A_DEBOUNCE_N = '--debounce'
+_A_DEBOUNCE_D = 0.5
+_A_DEBOUNCE_H = (
+    f'With {_A_WATCH_N}, once a change is found, wait until no file changed '
+    f'for this many seconds before merging. Default is {_A_DEBOUNCE_D}.')
+_A_DEPGRAPH_N = '--depgraph'
+_A_DEPGRAPH_H = (
+    'Write to FILE a json object whose "mergelists" array has, in merge '
+    'order, an object per merge list with its path as "mergelist", its '
+    'output path as "target", and as "inputs" the paths of the files its '
+    'outputs depend on: the merge list, the merge lists in it and the files '
+    'they list, symbol definition file included, the '
+    f'{act.mergetree.MODE4SYMBOLS_FNAME} files that apply, and the '
+    f'{act.mergetree.EXCLUDE_FNAME} file of its directory. In '
+    f'{act.sub.M4S_DIR} mode, the outputs per symbol set are in '
+    'sub-directories of the directory of "target".')
+_A_DEPS_ONLY_N = '--deps_only'
+_A_DEPS_ONLY_H = (f'Write the {_A_DEPGRAPH_N} FILE only, do not merge. The '
+                  'output directory is neither emptied nor written to.')
 
 logger = logging.getLogger(__name__)
 
@@ -73,195 +167,794 @@ def _parse_args(argv):
                    help=_A_OUTDIR_H,
                    default=_A_OUTDIR_D,
                    type=lambda x: if_exists_isdir(x, _A_INDIR_N, p))
-    act.sub.add_symset_args(p)
-    act.sub.add_log_arg(p)
+    p.add_argument(_A_ARCHIVE_N, metavar='FILE', help=_A_ARCHIVE_H)
+    p.add_argument(_A_KEEP_UNCHANGED_N,
+                   help=_A_KEEP_UNCHANGED_H,
+                   action='store_true')
+    act.sub.add_manifest_arg(
+        p, 'Paths are relative to the output directory. Files deleted by '
+        f'{_A_KEEP_UNCHANGED_N} or by replacing the output directory are '
+        '"removed". Outputs written to a new directory are compared with the '
+        'ones they replace.')
+    p.add_argument(_A_SYMBOL_USAGE_N,
+                   help=_A_SYMBOL_USAGE_H,
+                   action='store_true')
+    p.add_argument(_A_SYMBOLS_CHANGED_N,
+                   help=_A_SYMBOLS_CHANGED_H,
+                   action='store_true')
+    p.add_argument(_A_INCREMENTAL_N,
+                   help=_A_INCREMENTAL_H,
+                   action='store_true')
+    p.add_argument(_A_DEPGRAPH_N, metavar='FILE', help=_A_DEPGRAPH_H)
+    p.add_argument(_A_DEPS_ONLY_N, help=_A_DEPS_ONLY_H, action='store_true')
+    p.add_argument(_A_WATCH_N, help=_A_WATCH_H, action='store_true')
+    p.add_argument(_A_POLL_N,
+                   metavar='SECONDS',
+                   help=_A_POLL_H,
+                   default=_A_POLL_D,
+                   type=lambda x: act.sub.posfloat(x, _A_POLL_N, p))
+    p.add_argument(_A_DEBOUNCE_N,
+                   metavar='SECONDS',
+                   help=_A_DEBOUNCE_H,
+                   default=_A_DEBOUNCE_D,
+                   type=lambda x: act.sub.posfloat(x, _A_DEBOUNCE_N, p))
+    p.add_argument(_A_WRITERS_N,
+                   help=_A_WRITERS_H,
+                   default=_A_WRITERS_D,
+                   type=int)
+    act.sub.add_jobs_arg(p, _A_JOBS_H)
+    p.add_argument(_A_WRITE_BUDGET_N,
+                   help=_A_WRITE_BUDGET_H,
+                   default=_A_WRITE_BUDGET_D,
+                   type=lambda x: act.sub.posint(x, _A_WRITE_BUDGET_N, p))
+    act.sub.add_merge_args(p)
+    act.sub.add_output_args(p)
     pa = p.parse_args(argv)
-    err_msg = act.sub.check_symset_options(pa.mode4symbols, pa.symset)
-    if err_msg:
-        p.error(err_msg)
+    if pa.writers < 0:
+        p.error(f'Argument {_A_WRITERS_N} invalid. Negative: {pa.writers}.')
+    if pa.jobs > 1:
+        _reject(p, act.sub.A_JOBS_N,
+                [(_A_WRITERS_N, pa.writers), (_A_ARCHIVE_N, pa.archive),
+                 (_A_SYMBOLS_CHANGED_N, pa.symbols_changed)])
+    if pa.archive:
+        if not pa.archive.lower().endswith(act.sub.ARCHIVE_EXTS):
+            p.error(f'Argument {_A_ARCHIVE_N} invalid. File name must end with '
+                    f'one of {act.sub.ARCHIVE_EXTS}: "{pa.archive}".')
+        _reject(p, _A_ARCHIVE_N,
+                [(_A_WRITERS_N, pa.writers),
+                 (_A_KEEP_UNCHANGED_N, pa.keep_unchanged),
+                 (_A_SYMBOL_USAGE_N, pa.symbol_usage),
+                 (_A_SYMBOLS_CHANGED_N, pa.symbols_changed),
+                 (_A_WATCH_N, pa.watch), (_A_INCREMENTAL_N, pa.incremental),
+                 (act.sub.A_SIDECAR_N, pa.sidecar),
+                 (act.sub.A_INDEX_N, pa.index), (act.sub.A_STORE_N, pa.store)])
+    if pa.deps_only and not pa.depgraph:
+        p.error(f'Argument {_A_DEPS_ONLY_N} requires {_A_DEPGRAPH_N}.')
+    if pa.deps_only and pa.watch:
+        p.error(f'Argument {_A_WATCH_N} not allowed with {_A_DEPS_ONLY_N}.')
+    if pa.watch:
+        _reject(p, _A_WATCH_N, [(_A_SYMBOL_USAGE_N, pa.symbol_usage),
+                                (_A_SYMBOLS_CHANGED_N, pa.symbols_changed)])
+        pa.incremental = True
+    if pa.incremental:
+        _reject(p, _A_INCREMENTAL_N,
+                [(_A_SYMBOL_USAGE_N, pa.symbol_usage),
+                 (_A_SYMBOLS_CHANGED_N, pa.symbols_changed)])
+    act.sub.check_merge_args(pa, p)
     if pa.outdir == _A_OUTDIR_D:
         h, t = os.path.split(pa.indir)
         pa.outdir = os.path.join(h, act.sub.OUT_PREFIX + t)
+    if pa.store and _is_in(pa.store, pa.outdir):
+        p.error(f'Argument {act.sub.A_STORE_N} invalid. Directory in '
+                f'output directory {pa.outdir}: "{pa.store}".')
     return pa
 
 
-def _make_mirror_subdirs_obj(source_dir, target_dir):
-    in_files = []
-    for t in os.walk(source_dir):
-        for f in sorted(t[_OW_FILENAMES]):
-            cp = act.sub.canonical(os.path.join(t[_OW_DIRPATH], f))
-            if act.sub.is_mergelist(cp):
-                in_files.append(cp)
-    return act.sub.MirrorSubdirs(target_dir, in_files, source_dir)
+def _reject(p, argname, others):
+    """Exits with a usage error of argparse.ArgumentParser p if any of
+    others, (argument name, value) pairs, is set with argument argname."""
+    for n, v in others:
+        if v:
+            p.error(f'Argument {n} not allowed with {argname}.')
 
 
-def _merge_mergelist(msd, in_path, mode4symbols, symset):
-    """Returns None or act.sub.Error instance iff merge failed."""
+def _merge_mergelist(msd, in_path, symbol_args, options):
+    """Merges merge list in_path.
+
+    Args:
+        symbol_args: (mode4symbols, symset, no_globals), see
+            act.mergetree.walk().
+        options: act.mergejson.MergeOptions, see _merge_options(). Usage is
+            returned if its usage is not None.
+
+    Returns:
+        (exception, usage, written) tuple. exception: None or act.sub.Error
+        instance iff merge failed. usage and written: see
+        act.mergejson.MergeOptions.
+    """
+    mode4symbols, symset, no_globals = symbol_args
+    options = options._replace(
+        no_globals=no_globals,
+        usage=None if options.usage is None else {},
+        written={})
+    out_path = _out_path(msd, in_path, not options.writer or
+                         options.writer.writes_files)
     result = None
-    out_dir, in_fname = os.path.split(msd.gen_file_path(in_path))
-    out_fname = act.sub.merged_file_name(in_fname)
-    out_path = act.sub.canonical(os.path.join(out_dir, out_fname))
     try:
-        act.mergejson.merge(in_path, out_path, mode4symbols, symset)
+        act.mergejson.merge(in_path, out_path, mode4symbols, symset, options)
     except act.sub.Error as ex:
         logger.exception(
-            'Exception merging %s. mode4symbols=%s. symset=%s. outfile=%s.',
-            in_path, mode4symbols, symset, out_path)
+            'Exception merging %s. mode4symbols=%s. symset=%s. '
+            'no_globals=%s. outfile=%s.', in_path, mode4symbols, symset,
+            no_globals, out_path)
         result = ex
+    return (result, options.usage, options.written)
+
+
+def _merge_options(args, records, writer=None):
+    """Returns act.mergejson.MergeOptions of args for _merge_mergelist()."""
+    return act.mergejson.MergeOptions(
+        usage={} if records.symbol_usage else None,
+        preinterpolate=args.preinterpolate,
+        writer=writer,
+        delta=args.delta)
+
+
+def _out_path(msd, in_path, create_dir=True):
+    """Returns output path for merge list in_path."""
+    out_dir, in_fname = os.path.split(msd.gen_file_path(in_path, create_dir))
+    out_fname = act.sub.merged_file_name(in_fname)
+    return act.sub.canonical(os.path.join(out_dir, out_fname))
+
+
+def _merge_in_parallel(args, msd, merge_lists, options):
+    """Merges merge_lists (see act.mergetree.walk()) in a pool of args.jobs
+    processes, with options (see _merge_options()).
+
+    Returns:
+        List of (exception or None, usage, written) per merge list, see
+        _merge_mergelist().
+    """
+    waiting, before = _order(msd, merge_lists)
+    ready = [(-_size(p), i)
+             for i, (p, _, _) in enumerate(merge_lists)
+             if not waiting[i]]
+    heapq.heapify(ready)
+    results = [None] * len(merge_lists)
+    running = {}
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.jobs,
+            initializer=_init_merge_worker,
+            initargs=(msd, args.memo_size, options, act.sub.write_options(),
+                      act.sub.logging_options())) as pool:
+        while ready or running:
+            # At most one waiting per process, so the largest ready is next.
+            while ready and len(running) < args.jobs:
+                i = heapq.heappop(ready)[1]
+                running[pool.submit(_merge_worker, *merge_lists[i][:2])] = i
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                i = running.pop(f)
+                result = f.result()
+                act.symbols.add_worker_memo_stats(result[-1])
+                results[i] = result[:-1]
+                for j in before[i]:
+                    waiting[j].discard(i)
+                    if not waiting[j]:
+                        heapq.heappush(
+                            ready, (-_size(merge_lists[j][0]), j))
+    logger.info('Merged %d merge lists with %d processes.', len(merge_lists),
+                args.jobs)
+    return results
+
+
+def _order(msd, merge_lists):
+    """Returns (waiting, before) lists, per merge list: the set of indices of
+    the earlier ones it waits for, and the indices of the later ones waiting
+    for it. See _collisions()."""
+    after = _collisions(msd, merge_lists)
+    waiting = [set(a) for a in after]
+    before = [[] for _ in merge_lists]
+    for i, a in enumerate(after):
+        for j in a:
+            before[j].append(i)
+    return (waiting, before)
+
+
+def _collisions(msd, merge_lists):
+    """Returns, for each of merge_lists, the set of indices of the earlier 
+    ones that may write one of its outputs.
+
+    A merge list in DIR mode, or NAMED mode with a symbol set selector, 
+    writes <dir>/<name>, and <dir>/<set>/<name> for symbol sets. Other merge
+    lists write <dir>/<name> only.
+    """
+    result = []
+    # Output path -> indices of merge lists writing it.
+    exact = {}
+    # (directory, name) -> indices of merge lists writing directory/*/name.
+    per_set = {}
+    # (directory, name) -> indices of merge lists writing directory/x/name.
+    in_sub_dir = {}
+    for i, (in_path, (mode4symbols, symset, _), _) in enumerate(merge_lists):
+        out_path = _out_path(msd, in_path, False)
+        out_dir, name = os.path.split(out_path)
+        key = (os.path.dirname(out_dir), name)
+        earlier = set(exact.get(out_path, ())) | set(per_set.get(key, ()))
+        exact.setdefault(out_path, []).append(i)
+        in_sub_dir.setdefault(key, []).append(i)
+        if mode4symbols == act.sub.M4S_DIR or (
+                mode4symbols == act.sub.M4S_NAMED and
+                act.sub.is_symset_selector(symset)):
+            earlier.update(in_sub_dir.get((out_dir, name), ()))
+            per_set.setdefault((out_dir, name), []).append(i)
+        result.append(earlier)
     return result
 
 
-def _new_symbol_args(dir_path, mode_args_4_dir):
-    result = None
-    in_path = os.path.join(dir_path, _MODE4SYMBOLS_FNAME)
+def _size(in_path):
+    """Returns size of the files merge list in_path merges, 0 if unknown."""
     try:
-        mode_args_4_dir.read(in_path)
-    except act.sub.Error as ex:
-        logger.exception('Exception reading new symbol mode arguments from %s.',
-                         in_path)
-        result = ex
-    return result
+        return sum(
+            os.path.getsize(p)
+            for p in act.sub.read_and_resolve_path_array(in_path))
+    except (act.sub.Error, OSError):
+        return 0
 
 
-class _ModeArgs4Dir:
+# Arguments of _merge_mergelist() in worker processes.
+_worker_args = None
 
-    def __init__(self, root_dirpath, mode4symbols, symset):
-        self._d2ma = {}
-        self._can_overwrite_once = None
-        self.add(root_dirpath, mode4symbols, symset)
-        # pylint: disable=consider-iterating-dictionary
-        for k in self._d2ma.keys():  # there is only one
-            self._can_overwrite_once = k
 
-    def add(self, dirpath, mode4symbols, symset):
-        assert os.path.isdir(dirpath), f'Not a directory: {dirpath}.'
-        k = act.sub.canonical(dirpath) + os.path.normcase('/')
-        if k == self._can_overwrite_once:
-            self._can_overwrite_once = None
-        else:
-            assert k not in self._d2ma, f'Key overwrite. {k=} {self._d2ma=}.'
-        self._d2ma[k] = (mode4symbols, symset)
-
-    def get(self, dirpath):
-        """Returns (mode4symbols, symset) tuple for files in dirpath."""
-        longest_matching_key = ''
-        p = act.sub.canonical(dirpath) + os.path.normcase('/')
-        # pylint: disable=consider-iterating-dictionary
-        for k in self._d2ma.keys():
-            if p.startswith(k):
-                if len(k) > len(longest_matching_key):
-                    longest_matching_key = k
-        assert longest_matching_key in self._d2ma, f'{longest_matching_key=} {p=} {self._d2ma=}'
-        return self._d2ma[longest_matching_key]
-
-    def read(self, filepath):
-        cfp = act.sub.canonical(filepath)
-        dirpath, filename = os.path.split(cfp)
-        j = act.sub.read_json(cfp)
-        if not isinstance(j, dict):
-            raise Error(f'File {filename} is not a JSON object. '
-                        f'Directory: {dirpath}.')
-        if act.sub.A_MODE4SYM_N not in j:
-            raise Error(f'File {filename} JSON object missing key: '
-                        f'{act.sub.A_MODE4SYM_N}. '
-                        f'Directory: {dirpath}.')
-        mode4symbols = j[act.sub.A_MODE4SYM_N]
-        symset = j.get(act.sub.A_SYMSET_N)
-        errmsg = act.sub.check_symset_options(mode4symbols, symset)
-        if errmsg:
-            raise Error(f'File {filename} JSON object invalid options.'
-                        f'{errmsg} '
-                        f'Directory: {dirpath}.')
-        strange_keys = []
-        for k in j.keys():
-            if k not in [act.sub.A_MODE4SYM_N, act.sub.A_SYMSET_N]:
-                strange_keys.append(k)
-        if strange_keys:
-            raise Error(f'File {filename} JSON object strange keys: '
-                        f'{strange_keys}. '
-                        f'Directory: {dirpath}.')
-        self.add(dirpath, mode4symbols, symset)
-        logger.info(
-            'Options from %s apply in and under this directory. '
-            'Options: %s. Directory: %s.', filename, j, dirpath)
-
-
-def _remove_excluded_files_from_list(dirpath, filenames):
-    result = None
-    p = os.path.join(dirpath, _EXCLUDE_FNAME)
-    assert os.path.exists(p), p
-    try:
-        xnames = [os.path.normcase(f) for f in act.sub.read_json(p)]
-        for x in xnames:
-            if x not in filenames:
-                raise Error(f'File name {x} in {_EXCLUDE_FNAME}. '
-                            f'No such file in directory {dirpath}. ')
-            if not act.sub.is_mergelist(x):
-                raise Error(f'File name {x} in {_EXCLUDE_FNAME}. '
-                            'Name does not match merge list name pattern. '
-                            f'Directory {dirpath}.')
-            if os.path.split(x)[0]:
-                raise Error(f'File name {x} in {_EXCLUDE_FNAME}. '
-                            'Name can not have path components. '
-                            f'Directory {dirpath}.')
-            filenames.remove(x)
-            logger.info('Skip file %s because it is in %s of directory %s.', x,
-                        _EXCLUDE_FNAME, dirpath)
-    except act.sub.Error as ex:
-        logger.exception('Exclude list error.')
-        result = ex
+def _init_merge_worker(msd, memo_size, options, write_options,
+                       logging_options):
+    global _worker_args  # pylint: disable=global-statement
+    act.sub.use_logging_options(logging_options)
+    _worker_args = (msd, options)
+    act.symbols.use_memo(memo_size)
+    act.sub.use_write_options(write_options)
+
+
+def _merge_worker(in_path, symbol_args):
+    """Returns (exception or None, usage, written, memo statistics), see
+    _merge_mergelist() and act.symbols.take_memo_stats().
+    """
+    msd, options = _worker_args
+    result = _merge_mergelist(msd, in_path, symbol_args, options)
+    act.sub.sync_dirs()
+    return result + (act.symbols.take_memo_stats(),)
+
+
+def _wait_for_writes(requested, records):
+    """Waits for background writes, and handles failures as if synchronous.
+
+    Args:
+        requested: List of (merge list, {output path: future}) in merge order.
+        records: _Records of the merge lists.
+
+    Returns: 
+        (written, exceptions) tuple. written: output path -> write status.
+        exceptions: act.sub.Error per output that could not be written.
+    """
+    written = {}
+    exceptions = []
+    failed = set()
+    last_requester = {}
+    for in_path, futures in requested:
+        for p, f in futures.items():
+            last_requester[p] = in_path
+            if f.exception() is None:
+                written[p] = f.result()
+            else:
+                ex = f.exception()
+                logger.error('Exception writing %s merged from %s. %s', p,
+                             in_path, ex)
+                exceptions.append(ex)
+                failed.add(in_path)
+    # No output left of a merge list with an output not written.
+    for in_path, futures in requested:
+        if in_path in failed:
+            records.discard(in_path)
+            for p in futures:
+                if p in written and last_requester[p] == in_path:
+                    os.remove(p)
+                    del written[p]
+    return (written, exceptions)
+
+
+def _compare_replaced(written, previous, out_dir, replaced_dir):
+    """Sets the write status of outputs added to out_dir as if written to 
+    replaced_dir, see _merge_all()."""
+    for p, status in written.items():
+        cp = act.sub.canonical(p)
+        if status == act.sub.WRITE_ADDED and cp in previous:
+            old = os.path.join(replaced_dir, os.path.relpath(cp, out_dir))
+            written[p] = (act.sub.WRITE_UNCHANGED if act.sub.same_content(
+                cp, old) else act.sub.WRITE_CHANGED)
+
+
+def _files_in(out_dir, excluded):
+    """Returns set of canonical paths of files under out_dir, but excluded."""
+    result = set()
+    for dirpath, _, filenames in os.walk(out_dir):
+        for f in filenames:
+            p = act.sub.canonical(os.path.join(dirpath, f))
+            if p not in excluded:
+                result.add(p)
     return result
 
 
-def main(argv, a_actual_out_dir=None):
+def _remove_files(paths, out_dir):
+    """Removes files, then directories under out_dir left empty."""
+    for p in sorted(paths):
+        logger.info('Remove file not generated: %s.', p)
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            # A stale sidecar or index, removed when its output was written.
+            pass
+    for dirpath, _, _ in os.walk(out_dir, topdown=False):
+        if not os.listdir(dirpath) and not os.path.samefile(dirpath, out_dir):
+            os.rmdir(dirpath)
+
+
+def main(argv, a_actual_out_dir=None, stop=None):
+    """Runs mergeall with command line arguments argv.
+
+    Args:
+        a_actual_out_dir: If a list, the output directory is appended.
+        stop: threading.Event that ends --watch when set.
+
+    Returns:
+        List of exceptions merging, of the last run with --watch.
+    """
     args = _parse_args(argv)
     act.sub.set_up_logging(act.sub.LOGGING_LEVEL_NAME2VALUE[args.log_level],
                            args.console)
     logger.debug('Args: %s', args)
-    act.sub.create_or_empty_dir(args.outdir)
+    act.symbols.use_memo(args.memo_size)
+    act.sub.use_fsync(args.fsync)
+    act.sub.use_sidecars(args.sidecar)
+    act.sub.use_index(args.index)
+    act.sub.use_store(
+        act.writers.ContentStore(args.store, args.symlinks)
+        if args.store else None)
     # Output dir is returned in list (a way to pass a string by reference).
     if a_actual_out_dir is not None:
         a_actual_out_dir.append(args.outdir)
-    msd = _make_mirror_subdirs_obj(args.indir, args.outdir)
-    mode_args_4_dir = _ModeArgs4Dir(args.indir, args.mode4symbols, args.symset)
-    # Build in_file list by walking top down to guarantee that files in
-    # parent directories are processed before files in child directories.
-    # We depend on this for a feature. We overwrite the per symset generated
-    # merged files with a file generated from a mergelist in a source symset
-    # source sub-directory. Note that glob.glob() does not guarantee this.
+    if args.deps_only:
+        return _write_dependency_graph(args)
+    if args.watch:
+        return _watch(args, stop or threading.Event())
+    return _run(args)
+
+
+def _run(args):
+    """Merges all, see main()."""
+    keep_unchanged = _keeps_unchanged(args)
+    previous = set()
+    if (keep_unchanged or args.manifest) and not args.archive:
+        previous = _files_in(
+            args.outdir, {
+                act.sub.canonical(
+                    os.path.join(args.outdir,
+                                 act.incremental.SYMBOL_USAGE_FNAME)),
+                act.sub.canonical(
+                    os.path.join(args.outdir,
+                                 act.incremental.DEPENDENCIES_FNAME)),
+                act.sub.canonical(args.manifest or args.outdir),
+                act.sub.canonical(args.depgraph or args.outdir)
+            })
+    if keep_unchanged or args.archive:
+        return _merge_all(args, previous)
+    # Build in a new directory swapped into place at the end, so the output
+    # directory is never seen empty or partly written.
+    staging = act.writers.StagingDir(args.outdir)
+    try:
+        exceptions = _merge_all(args, previous, staging)
+        staging.commit()
+    except BaseException:
+        staging.discard()
+        raise
+    act.sub.sync_dirs()
+    act.writers.wait_for_removals()
+    return exceptions
+
+
+def _keeps_unchanged(args):
+    """True if the output directory is updated in place, unchanged outputs
+    kept."""
+    return args.keep_unchanged or args.symbols_changed or args.incremental
+
+
+def _output_options(args, symbol_args):
+    """Returns the options that make output files of a merge list differ:
+    symbol args, and all options of what is written."""
+    return list(symbol_args) + [
+        args.delta, args.sidecar, args.index,
+        act.sub.canonical(args.store) if args.store else None, args.symlinks
+    ]
+
+
+def _watch(args, stop):
+    """Runs _run(), then again after each change to its inputs.
+
+    Returns:
+        Exceptions of the last run, when stop is set or on Ctrl-C.
+    """
     exceptions = []
-    for t in os.walk(args.indir):
-        # Force deterministic order of dir traversal with in place sort.
-        t[_OW_DIRNAMES].sort()
-        # Ditto for file names, but copied as doc doesn't say in place is safe.
-        filenames = [os.path.normcase(f) for f in sorted(t[_OW_FILENAMES])]
-        # Are there files to exclude in this directory?
-        if _EXCLUDE_FNAME in filenames:
-            ex = _remove_excluded_files_from_list(t[_OW_DIRPATH], filenames)
-            if ex:
-                exceptions.append(ex)
-        # Are there new symbol mode args defined starting from this directory?
-        if _MODE4SYMBOLS_FNAME in filenames:
-            ex = _new_symbol_args(t[_OW_DIRPATH], mode_args_4_dir)
-            if ex:
-                exceptions.append(ex)
-        # Get symbol mode for this directory.
-        mode4symbols, symset = mode_args_4_dir.get(t[_OW_DIRPATH])
-        # Merge each merge file in current directory.
-        for in_fname in filenames:
-            if act.sub.is_mergelist(in_fname):
-                in_path = act.sub.canonical(
-                    os.path.join(t[_OW_DIRPATH], in_fname))
-                ex = _merge_mergelist(msd, in_path, mode4symbols, symset)
-                if ex:
-                    exceptions.append(ex)
-            else:
-                logger.debug('Skip file "%s" in "%s".', in_fname,
-                             t[_OW_DIRPATH])
+    run = 0
+    try:
+        before = _snapshot(args)
+        while True:
+            run += 1
+            start = time.perf_counter()
+            exceptions = _run(args)
+            logger.info('Watch run %d took %.3f seconds, %d exceptions.', run,
+                        time.perf_counter() - start, len(exceptions))
+            # Changes while merging are merged next.
+            after = _snapshot(args)
+            changed = _changed(before, after, args.indir)
+            while not changed:
+                if stop.wait(args.poll):
+                    return exceptions
+                before, after = after, _snapshot(args)
+                changed = _changed(before, after, args.indir)
+            # Wait for a burst of changes, like saving many files, to end.
+            more = changed
+            while more:
+                if stop.wait(args.debounce):
+                    return exceptions
+                before, after = after, _snapshot(args)
+                more = _changed(before, after, args.indir)
+                changed.update(more)
+            for p in sorted(changed):
+                logger.debug('Changed: %s.', p)
+            logger.info('Watch found %d files changed.', len(changed))
+            before = after
+    except KeyboardInterrupt:
+        logger.info('Watch interrupted.')
+    return exceptions
+
+
+def _snapshot(args):
+    """Returns {path: stat signature} of the files --watch polls.
+
+    These are the files under args.indir, but those runs write: the output
+    and store directories, the log, manifest, dependency graph and archive.
+    Plus the inputs recorded by the last run.
+    """
+    skip_dirs = {
+        act.sub.canonical(d) for d in [args.outdir, args.store] if d
+    }
+    skip_files = {
+        act.sub.canonical(f) for f in [
+            act.sub.LOG_FILE, args.manifest, args.depgraph, args.archive
+        ] if f
+    }
+    result = {}
+    dirs = [act.sub.canonical(args.indir)]
+    while dirs:
+        try:
+            entries = list(os.scandir(dirs.pop()))
+        except OSError:
+            continue
+        for e in entries:
+            p = act.sub.canonical(e.path)
+            if e.is_dir(follow_symlinks=False):
+                if p not in skip_dirs:
+                    dirs.append(e.path)
+            elif p not in skip_files:
+                result[p] = act.sub.stat_signature(e)
+    recorded = act.incremental.Dependencies.input_paths(args.outdir)
+    for p in recorded - result.keys():
+        result[p] = act.sub.stat_signature(p)
+    return result
+
+
+def _changed(before, after, in_dir):
+    """Returns set of paths changed from snapshot before to after.
+
+    A path outside in_dir only in after was not polled before, see
+    _snapshot().
+    """
+    return {
+        p for p in before.keys() | after.keys()
+        if before.get(p) != after.get(p) and (p in before or _is_in(p, in_dir))
+    }
+
+
+def _write_dependency_graph(args):
+    """Writes args.depgraph without merging, see --deps_only.
+
+    Returns:
+        List of exceptions reading merge lists, exclusion lists and symbol
+        args files.
+    """
+    msd = act.mergetree.make_mirror_subdirs_obj(args.indir, args.outdir)
+    mode_args_4_dir = act.mergetree.ModeArgs4Dir(args.indir, args.mode4symbols,
+                                                 args.symset, args.no_globals)
+    exceptions = []
+    graph = []
+    for in_path, _, _ in act.mergetree.walk(args.indir, mode_args_4_dir,
+                                            exceptions):
+        ex = _add_to_graph(
+            graph, args, in_path,
+            os.path.relpath(_out_path(msd, in_path, False), args.outdir))
+        if ex:
+            logger.error('Exception reading inputs of %s. %s', in_path, ex)
+            exceptions.append(ex)
+    _write_graph(graph, args.depgraph)
     return exceptions
 
 
+def _add_to_graph(graph, args, in_path, rel_target):
+    """Appends to graph the inputs of merge list in_path.
+
+    Returns:
+        None or act.sub.Error instance iff its inputs could not be read.
+    """
+    try:
+        inputs = act.mergetree.inputs(in_path, args.indir)
+    except act.sub.Error as ex:
+        return ex
+    graph.append({
+        'mergelist': in_path,
+        'target': act.sub.canonical(os.path.join(args.outdir, rel_target)),
+        'inputs': inputs
+    })
+    return None
+
+
+def _write_graph(graph, fname):
+    act.sub.write_as_json({'version': 1, 'mergelists': graph}, fname)
+
+
+def _is_in(path, dir_path):
+    """True if path is dir_path or in it."""
+    dir_path = act.sub.canonical(dir_path)
+    return os.path.commonpath([dir_path, act.sub.canonical(path)]) == dir_path
+
+
+class _Records:
+    """What a run records of the merge lists for later runs, and what it
+    takes from the records of the previous run. See act.incremental.
+
+    Attributes:
+        symbol_usage: act.incremental.SymbolUsage with --symbol_usage or
+            --symbols_changed, else None.
+        dependencies: act.incremental.Dependencies with --incremental, else
+            None.
+        stale: Indices of the merge lists to merge, all if None.
+    """
+
+    def __init__(self, args, msd):
+        self.symbol_usage = None
+        if args.symbol_usage or args.symbols_changed:
+            self.symbol_usage = act.incremental.SymbolUsage(msd)
+        if args.symbols_changed and not self.symbol_usage.load():
+            raise Error(
+                f'No {act.incremental.SYMBOL_USAGE_FNAME} from a previous '
+                f'run in output directory {msd.out_dir()}.')
+        self.dependencies = None
+        if args.incremental:
+            self.dependencies = act.incremental.Dependencies(msd, args.indir)
+            self.dependencies.load()
+        self.stale = None
+        self._args = args
+        # Merge list index -> inputs, see act.incremental.Dependencies.inputs().
+        self._inputs = {}
+
+    def select(self, msd, merge_lists):
+        """Returns merge_lists, as a list with stale set if incremental."""
+        if not self.dependencies:
+            return merge_lists
+        merge_lists = list(merge_lists)
+        self.stale = self.dependencies.stale(
+            merge_lists, lambda a: _output_options(self._args, a),
+            _collisions(msd, merge_lists))
+        logger.info('Merge %d of %d merge lists again.', len(self.stale),
+                    len(merge_lists))
+        self._inputs = {
+            i: self.dependencies.inputs(merge_lists[i][0])
+            for i in sorted(self.stale)
+        }
+        return merge_lists
+
+    def carried_over(self, i, in_path, symbol_args):
+        """Returns the outputs of merge list i, in_path, kept from the
+        previous run, or None if it is merged."""
+        if self._args.symbols_changed and self.symbol_usage.is_current(
+                in_path, _output_options(self._args, symbol_args)):
+            return self.symbol_usage.outputs(in_path)
+        if self.stale is not None and i not in self.stale:
+            return self.dependencies.carry_over(in_path)
+        return None
+
+    def add(self, i, in_path, symbol_args, usage, written):
+        """Records merge list i, in_path, merged."""
+        # Outputs written with other options are not current.
+        options = _output_options(self._args, symbol_args)
+        if self.symbol_usage:
+            self.symbol_usage.add(in_path, options, usage)
+        if self.dependencies and self._inputs[i] is not None:
+            self.dependencies.add(in_path, options, self._inputs[i], written)
+
+    def discard(self, in_path):
+        """Forgets merge list in_path, its outputs not written."""
+        for r in (self.symbol_usage, self.dependencies):
+            if r:
+                r.discard(in_path)
+
+    def save(self):
+        """Saves the records, see act.incremental."""
+        for r in (self.symbol_usage, self.dependencies):
+            if r:
+                r.save()
+
+
+class _Results:
+    """What the merges wrote, and the exceptions, in the order found."""
+
+    def __init__(self, background):
+        # Output path -> write status.
+        self.written = {}
+        self.exceptions = []
+        # With background writes, (merge list, written) in merge order.
+        self._requested = [] if background else None
+
+    def carry_over(self, outputs):
+        """Adds outputs of a merge list not merged, kept as they are."""
+        self.written.update(dict.fromkeys(outputs, act.sub.WRITE_UNCHANGED))
+
+    def add(self, in_path, ex, written):
+        """Adds the result of merging merge list in_path."""
+        if self._requested is None:
+            self.written.update(written)
+        else:
+            self._requested.append((in_path, written))
+        if ex:
+            self.exceptions.append(ex)
+
+    def wait_for_writes(self, records):
+        """Waits for background writes, see _wait_for_writes()."""
+        written, exceptions = _wait_for_writes(self._requested, records)
+        self.written.update(written)
+        self.exceptions.extend(exceptions)
+
+
+def _merge_all(args, previous, staging=None):
+    """Merges the merge lists under args.indir into args.outdir.
+
+    Args:
+        previous: Files in args.outdir before, see _run().
+        staging: If not None, the act.writers.StagingDir to merge into
+            instead, and previous are where its files will be in it.
+
+    Returns:
+        List of exceptions merging.
+    """
+    manifest, depgraph = args.manifest, args.depgraph
+    if staging:
+        manifest, depgraph = [
+            staging.staging_path(p) if p and _is_in(p, args.outdir) else p
+            for p in [manifest, depgraph]
+        ]
+        previous = {staging.staging_path(p) for p in previous}
+    out_dir = staging.path if staging else args.outdir
+    msd = act.mergetree.make_mirror_subdirs_obj(args.indir, out_dir)
+    records = _Records(args, msd)
+    graph = [] if depgraph else None
+    results = _merge_lists(args, msd, records, graph)
+    generated = {act.sub.canonical(p) for p in results.written}
+    generated.update(
+        [c for p in generated for c in act.sub.companion_paths(p)])
+    removed = previous - generated
+    if _keeps_unchanged(args):
+        _remove_files(removed, out_dir)
+    if manifest and staging:
+        _compare_replaced(results.written, previous, out_dir, staging.target)
+    records.save()
+    if manifest:
+        act.writers.write_manifest(manifest, results.written, removed,
+                                   out_dir)
+    if depgraph:
+        _write_graph(graph, depgraph)
+    act.sub.sync_dirs()
+    if args.store:
+        act.writers.log_store_report(
+            {act.sub.canonical(p) for p in results.written})
+    act.symbols.log_memo_stats()
+    return results.exceptions
+
+
+def _merge_lists(args, msd, records, graph):
+    """Merges the merge lists under args.indir, in the order found, or
+    carries over their outputs, see _Records.
+
+    Args:
+        graph: If not None, list to which the dependency graph entry of each
+            merge list is appended, see _add_to_graph().
+
+    Returns:
+        _Results.
+    """
+    writer = None
+    if args.writers:
+        writer = act.writers.BackgroundWriter(args.writers,
+                                              args.write_budget * 2**20)
+    elif args.archive:
+        writer = act.writers.ArchiveWriter(args.archive, msd.out_dir())
+    results = _Results(args.writers)
+    options = _merge_options(args, records, writer)
+    for i, in_path, symbol_args, merged in _walk(args, msd, records,
+                                                 results.exceptions):
+        if graph is not None:
+            # Merging reports the errors too.
+            _add_to_graph(
+                graph, args, in_path,
+                os.path.relpath(_out_path(msd, in_path, False),
+                                msd.out_dir()))
+        carried = records.carried_over(i, in_path, symbol_args)
+        if carried is not None:
+            results.carry_over(carried)
+            continue
+        ex, usage, written = merged or _merge_mergelist(
+            msd, in_path, symbol_args, options)
+        results.add(in_path, ex, written)
+        if not ex:
+            records.add(i, in_path, symbol_args, usage, written)
+    if writer:
+        writer.close()
+    if args.writers:
+        results.wait_for_writes(records)
+    return results
+
+
+def _walk(args, msd, records, exceptions):
+    """Yields (index, merge list, symbol args, merged) for the merge lists
+    under args.indir, see act.mergetree.walk(). Appends to exceptions the
+    errors walking, in the order found merging one after the other.
+
+    merged: With args.jobs > 1, the _merge_mergelist() result of merging it
+    in parallel, None if not to be merged. Otherwise None.
+    """
+    # Walk top down to guarantee that files in parent directories are
+    # processed before files in child directories. We depend on this for a
+    # feature. We overwrite the per symset generated merged files with a file
+    # generated from a mergelist in a source symset source sub-directory.
+    # Note that glob.glob() does not guarantee this.
+    walk_exceptions = []
+    merge_lists = records.select(
+        msd,
+        act.mergetree.walk(
+            args.indir,
+            act.mergetree.ModeArgs4Dir(args.indir, args.mode4symbols,
+                                       args.symset, args.no_globals),
+            walk_exceptions))
+    merged = {}
+    if args.jobs > 1:
+        merge_lists = list(merge_lists)
+        indices = [
+            i for i in range(len(merge_lists))
+            if records.stale is None or i in records.stale
+        ]
+        merged = dict(
+            zip(
+                indices,
+                _merge_in_parallel(args, msd, [merge_lists[i] for i in indices],
+                                   _merge_options(args, records))))
+    walk_ex_done = 0
+    for i, (in_path, symbol_args, walk_ex_count) in enumerate(merge_lists):
+        exceptions.extend(walk_exceptions[walk_ex_done:walk_ex_count])
+        walk_ex_done = walk_ex_count
+        yield (i, in_path, symbol_args, merged.get(i))
+    exceptions.extend(walk_exceptions[walk_ex_done:])
+
+
 if __name__ == '__main__':
+    act.writers.use_detached_removals(True)
     main_returned = main(sys.argv[1:])
     rc = len(main_returned)
     if rc != 0:
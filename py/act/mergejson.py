@@ -4,9 +4,14 @@
 import logging
 import os.path
 import argparse
+import collections
+import concurrent.futures
+import time
+import typing
 # own imports
 import act.sub
 import act.symbols
+import act.writers
 
 # Text with _A prefix for command line Args
 _A_DESCRIPTION = """Merge json files and replace symbols.
@@ -33,6 +38,20 @@ Example: ["a.json","/x/b.json","../y/c.json","symbols.json"].
 _A_OUTFILE_N = '--outfile'
 _A_OUTFILE_D = f"<infile's dir>/{act.sub.OUT_MERGED_DEFAULT_PREFIX}<infile's name>"
 _A_OUTFILE_H = f'Merged json file to (over)write. Default is {_A_OUTFILE_D}.'
+_A_JOBS_H = ('Number of processes rendering and writing symbol sets in parallel '
+             f'when {act.sub.A_MODE4SYM_N} is {act.sub.M4S_DIR}. Outputs are '
+             'the same for any number.')
+_A_DEPFILE_N = '--depfile'
+_A_DEPFILE_H = (
+    'Write to FILE a Make depfile, as Make and Ninja read, with '
+    f'{_A_OUTFILE_N[2:].upper()}, and each output of a symbol set in '
+    f'{act.sub.M4S_DIR} mode, and their {act.sub.A_SIDECAR_N} and '
+    f'{act.sub.A_INDEX_N} files, depending on the files merging reads: '
+    f'{_A_INFILE_N.upper()}, the merge lists in it, and the files they list, '
+    'symbol definition file included. A depfile with the same content as '
+    'before is not rewritten.')
+_A_DEPS_ONLY_N = '--deps_only'
+_A_DEPS_ONLY_H = f'Write the {_A_DEPFILE_N} FILE only, do not merge.'
 
 logger = logging.getLogger(__name__)
 
@@ -45,10 +64,59 @@ class JsonCanNotMergeObjectWithPrimitiveType(Error):
     pass
 
 
-def _merge_files(source_path_list, target_path, symbols=None):
+class MergeOptions(typing.NamedTuple):
+    """Options of merge(), and where it reports what it wrote.
+
+    jobs: In DIR mode, number of processes rendering symbol sets.
+    no_globals: In DIR mode, no output with global symbols only.
+    usage: If not None, a dictionary to which merge() adds, for each output
+        path, what interpolation used from the symbol definition file (see
+        act.symbols.Symbols.usage()), or None if the output is not
+        interpolated.
+    preinterpolate: Interpolate each file before merging, remembering the
+        result for later merges in this process. Ignored if usage is not
+        None.
+    written: If not None, a dictionary to which merge() adds, for each
+        output path, what act.sub.write_as_json() returned.
+    writer: If not None, an act.writers.BackgroundWriter or
+        act.writers.ArchiveWriter that writes the outputs (except in DIR mode
+        with jobs > 1). With a BackgroundWriter, the written values are
+        futures of what act.sub.write_as_json() returned, and errors writing
+        are not raised by merge(), so in DIR mode outputs written may be left
+        when another one fails. Unless rendering fails in DIR mode: then the
+        first failed write is raised, as when writing synchronously. With an
+        ArchiveWriter, outputs written before a failure in DIR mode stay in
+        the archive.
+    delta: In DIR mode, if act.sub.DELTA_ONLY or act.sub.DELTA_WITH_FULL,
+        write the output of each symbol set as a JSON Patch against the
+        output with global symbols only, see act.sub.DELTA_EXT.
+    """
+    jobs: int = 1
+    no_globals: bool = False
+    usage: dict = None
+    preinterpolate: bool = False
+    written: dict = None
+    writer: object = None
+    delta: str = None
+
+
+def _merge_files(source_path_list, target_path, symbols, options):
     """Merge json files in a source file list.
     """
     logger.debug("ENTER _merge_files(%s, %s).", source_path_list, target_path)
+    writer = None
+    if options.writer:
+        writer = (options.writer, _size_hint(source_path_list))
+    if symbols and _can_preinterpolate(source_path_list, options):
+        return _write(_merge_preinterpolated(source_path_list, symbols),
+                      target_path, options.written, writer)
+    return _interpolate_and_write(_merge_tree(source_path_list), target_path,
+                                  symbols, options.usage, options.written,
+                                  writer)
+
+
+def _merge_tree(source_path_list):
+    """Returns the merged, not yet interpolated, json of the files."""
     t = {}
     file_count = 0
     for p in source_path_list:
@@ -67,22 +135,155 @@ def _merge_files(source_path_list, target_path, symbols=None):
             _merge_obj(t, o, loc_stk)
         else:
             t = o
+    return t
+
+
+def _can_preinterpolate(source_path_list, options):
+    """True if interpolating files before merge gives the same outputs.
+
+    Values end up in the merged json at the same JSON pointer as in their
+    file, so they interpolate the same, within the same scope. But symbols 
+    in values later overridden would count as used, so symbol usage needs
+    interpolation after merge. A single file gains nothing.
+    """
+    return (options.preinterpolate and options.usage is None and
+            len(source_path_list) > 1)
+
+
+# (Canonical path, stat signature, act.symbols.Symbols.set_key) -> json,
+# least recently used first. A file changed, or a symbol definition file
+# changed, is a new key, the old one ages out.
+_preinterpolated_cache = collections.OrderedDict()
+# Number of interpolated files _preinterpolated_cache keeps.
+_PREINTERPOLATED_CACHE_SIZE = 256
+
+
+def _preinterpolated(p, symbols):
+    """Returns json of file p with symbols interpolated. Do not modify it."""
+    cp = act.sub.canonical(p)
+    key = (cp, act.sub.stat_signature(cp), symbols.set_key)
+    o = _preinterpolated_cache.get(key)
+    if o is None:
+        o = act.sub.read_json(p)
+        act.sub.check_types(o, [p])
+        symbols.interpolate(o)
+        _preinterpolated_cache[key] = o
+        if len(_preinterpolated_cache) > _PREINTERPOLATED_CACHE_SIZE:
+            _preinterpolated_cache.popitem(last=False)
+    else:
+        logger.debug('Preinterpolated cache hit: %s %s.', p, symbols.set_name)
+        _preinterpolated_cache.move_to_end(key)
+    return o
+
+
+def _merge_preinterpolated(source_path_list, symbols):
+    """Returns merge of source_path_list files, interpolated one by one.
+
+    Same result as _merge_tree() then interpolation. Objects along merge paths
+    are new, other values are shared with the cache, so do not modify it.
+    """
+    t = _preinterpolated(source_path_list[0], symbols)
+    for p in source_path_list[1:]:
+        t = _merged(t, _preinterpolated(p, symbols), [p])
+    return t
+
+
+def _size_hint(source_path_list):
+    """Returns estimate of the memory size of the merge of the files."""
+    return sum(os.path.getsize(p) for p in source_path_list)
+
+
+def _interpolate_and_write(t,
+                           target_path,
+                           symbols,
+                           usage=None,
+                           written=None,
+                           writer=None):
+    """Interpolate symbols in merged json t (in place) and write it."""
     if symbols:
         logger.debug('before interpolate %s', t)
         logger.debug('sym2val %s', symbols.sym2val)
         symbols.interpolate(t)
         logger.debug('after interpolate %s', t)
-    try:
-        act.sub.write_as_json(t, target_path)
-    except act.sub.Error:
-        try:
-            os.remove(target_path)
-        except FileNotFoundError:
-            pass
-        raise
+    _write(t, target_path, written, writer)
+    if usage is not None:
+        usage[target_path] = symbols.usage() if symbols else None
     return target_path
 
 
+def _write(t, target_path, written=None, writer=None):
+    """Writes t, or requests writer[0] to write it if writer is not None.
+
+    writer: (act.writers.BackgroundWriter, size hint) tuple.
+    """
+    if writer:
+        status = writer[0].write(t, target_path, writer[1])
+    else:
+        status = act.sub.write_as_json(t, target_path, output=True)
+    if written is not None:
+        written[target_path] = status
+    return target_path
+
+
+def dependencies(mergelist_path):
+    """Returns canonical paths of the files merging mergelist_path reads.
+
+    These are mergelist_path, the merge lists in it, and the files they list,
+    symbol definition file included, each once.
+    """
+    merge_lists = []
+    files = act.sub.read_and_resolve_path_array(mergelist_path, merge_lists)
+    return list(dict.fromkeys(merge_lists + files))
+
+
+def outputs(source_path,
+            target_path,
+            symbol_set_mode,
+            symbol_set_name=None,
+            options=MergeOptions()):
+    """Returns the paths merge() with the same arguments writes.
+
+    Reads the merge list and the symbol definition file, does not merge.
+    """
+    _, symbols = _preprocess(source_path)
+    if not symbols:
+        return [target_path]
+    index = act.symbols.SymbolIndex.get(symbols.source_file)
+    if (symbol_set_mode == act.sub.M4S_NAMED and
+            act.sub.is_symset_selector(symbol_set_name)):
+        todo = _dir_mode_todo(target_path, index.select(symbol_set_name),
+                              False)
+        delta = None
+    elif symbol_set_mode == act.sub.M4S_DIR:
+        set_names = sorted(symbols.set_names)
+        if symbol_set_name:
+            set_names = index.select(symbol_set_name)
+        todo = _dir_mode_todo(target_path, set_names, not options.no_globals)
+        delta = options.delta
+    else:
+        return [target_path]
+    return [p for n, po in todo for p in _set_outputs(n, po, delta)]
+
+
+def depfile_targets(paths):
+    """Returns paths, each followed by the companion files written next to it.
+
+    A depfile lists them as targets too, so that the build tool knows of all
+    files merge() writes, see act.sub.companion_paths().
+    """
+    return [c for p in paths for c in [p] + act.sub.companion_paths(p)]
+
+
+def _set_outputs(symbol_set_name, target_path, delta):
+    """Returns the paths a DIR mode output of a symbol set is written to."""
+    result = []
+    if not delta or not symbol_set_name or delta == act.sub.DELTA_WITH_FULL:
+        result.append(target_path)
+    if delta and symbol_set_name:
+        result.append(target_path + act.sub.DELTA_EXT)
+    return result
+
+
 def _preprocess(mergelist_path):
     """Pre-process mergelist. 
     
@@ -120,7 +321,11 @@ def _preprocess(mergelist_path):
     return (mspl, symbols)
 
 
-def merge(source_path, target_path, symbol_set_mode, symbol_set_name=None):
+def merge(source_path,
+          target_path,
+          symbol_set_mode,
+          symbol_set_name=None,
+          options=MergeOptions()):
     """Merge json files in a json array of file paths.
     
     Args:
@@ -129,10 +334,13 @@ def merge(source_path, target_path, symbol_set_mode, symbol_set_name=None):
             this name may be created, one per symbol set name, in sub-
             directories in teh otuptu file's directory.
         symbol_set_mode: See command line help. 
-        symbol_set_name: See command lien help. 
+        symbol_set_name: See command lien help. A symbol set selector (see
+            act.sub.is_symset_selector) in NAMED or DIR mode.
+        options: MergeOptions.
 
     Returns:
-         target_path, or sequence of target paths for DIR mode.
+         target_path, or sequence of target paths for DIR mode, or for NAMED
+         mode with a symbol set selector.
     
     Raises (act.sub.Error or classes derived from it)
         o For invalid combinations of symbol_set_mode and symbol_set_name 
@@ -141,7 +349,8 @@ def merge(source_path, target_path, symbol_set_mode, symbol_set_name=None):
         o If merge lists has more than one symbol file.
         o ... 
     """
-    err_msg = act.sub.check_symset_options(symbol_set_mode, symbol_set_name)
+    err_msg = act.sub.check_symset_options(symbol_set_mode, symbol_set_name,
+                                           options.no_globals)
     if err_msg:
         raise Error(err_msg)
     files2merge, symbols = _preprocess(source_path)
@@ -153,6 +362,13 @@ def merge(source_path, target_path, symbol_set_mode, symbol_set_name=None):
         if symbol_set_mode == act.sub.M4S_IGNORE:
             symbols = None
         elif symbol_set_mode == act.sub.M4S_NAMED:
+            if act.sub.is_symset_selector(symbol_set_name):
+                # R E T U R N
+                return _merge_dir_mode(
+                    files2merge, target_path, symbols,
+                    act.symbols.SymbolIndex.get(symbols.source_file).select(
+                        symbol_set_name),
+                    options._replace(no_globals=True, delta=None))
             symbols = act.symbols.Symbols(symbols.source_file, symbol_set_name)
         elif symbol_set_mode == act.sub.M4S_FNAME:
             # FNAME mode is default, so if there is no symbol def file in
@@ -173,39 +389,251 @@ def merge(source_path, target_path, symbol_set_mode, symbol_set_name=None):
                     'file name, so global symbols only. '
                     'Merge list: %s.', source_path)
         elif symbol_set_mode == act.sub.M4S_DIR:
+            set_names = sorted(symbols.set_names)
+            if symbol_set_name:
+                set_names = act.symbols.SymbolIndex.get(
+                    symbols.source_file).select(symbol_set_name)
             # R E T U R N
-            return _merge_dir_mode(files2merge, target_path, symbols)
+            return _merge_dir_mode(files2merge, target_path, symbols,
+                                   set_names, options)
     elif symbol_set_name:
         raise Error('Merge list has no symbol definition file. Expected a '
                     f'symbol definition file with symbol set '
                     f'"{symbol_set_name}". Merge list: {source_path}.')
-    return _merge_files(files2merge, target_path, symbols)
+    return _merge_files(files2merge, target_path, symbols, options)
 
 
-def _merge_dir_mode(files2merge, target_path, symbols):
+def _merge_dir_mode(files2merge, target_path, symbols, set_names, options):
+    """Merge once, then render and write the merged template per symbol set.
+    
+    With options.jobs > 1, symbol sets are rendered and written by a pool of
+    that many processes. Either all outputs are written, or none are left.
+
+    With options.preinterpolate (jobs 1 and no delta only), merge
+    preinterpolated files per symbol set instead.
+    """
+    jobs, writer, delta = options.jobs, options.writer, options.delta
+    if delta and options.no_globals:
+        raise Error(f'{act.sub.A_DELTA_N} needs the output with global '
+                    f'symbols, not allowed with {act.sub.A_NO_GLOBALS_N}. '
+                    f'Output: {target_path}.')
+    template, base = _dir_mode_template(files2merge, symbols, options)
+    todo = _dir_mode_todo(target_path, set_names, not options.no_globals)
     outpaths = []
-    # Global symbols in base dir.
-    outpaths.append(_merge_files(files2merge, target_path, symbols))
+    timings = []
+    usages = {}
+    statuses = {}
+    start = time.perf_counter()
     try:
-        h, t = os.path.split(target_path)
-        for symbol_set_name in sorted(symbols.set_names):
-            po = os.path.join(h, symbol_set_name)
-            act.sub.create_dir_if_inexistant(po)
-            po = os.path.join(po, t)
-            outpaths.append(
-                _merge_files(
-                    files2merge, po,
-                    act.symbols.Symbols(symbols.source_file, symbol_set_name)))
-    except act.sub.Error:
-        for po in outpaths:
-            try:
-                os.remove(po)
-            except FileNotFoundError:
-                pass
+        if jobs > 1 and len(todo) > 1:
+            futures = _render_in_pool(template, base, symbols.source_file,
+                                      todo, options)
+            for f, (n, po) in zip(futures, todo):
+                if f.exception() is None:
+                    seconds, usage4po, status4po, memo_stats = f.result()
+                    act.symbols.add_worker_memo_stats(memo_stats)
+                    _add_statuses(status4po, usage4po, outpaths, usages,
+                                  statuses)
+                    timings.append((n, seconds))
+                    for p in status4po:
+                        act.sub.sync_dir_later(p)
+                else:
+                    # Removed with the others, what the worker wrote before
+                    # it failed.
+                    outpaths.extend(_set_outputs(n, po, delta))
+            for f in futures:
+                if f.exception() is not None:
+                    raise f.exception()
+        else:
+            sized = (writer, _size_hint(files2merge)) if writer else None
+            for n, po in todo:
+                if template:
+                    seconds, usage4po, status4po = _render_and_write(
+                        template, symbols.source_file, n, po, sized, delta,
+                        base)
+                else:
+                    seconds, usage4po, status4po = (
+                        _merge_preinterpolated_and_write(
+                            files2merge, symbols.source_file, n, po, sized))
+                _add_statuses(status4po, usage4po, outpaths, usages,
+                              statuses)
+                timings.append((n, seconds))
+    except (act.sub.Error, OSError):
+        if writer and not writer.writes_files:
+            # Members can not be taken out of an archive, those written stay.
+            raise
+        failed = _remove_outputs(outpaths, statuses)
+        if failed:
+            # Written synchronously, the failed write would have stopped the
+            # loop first.
+            po, ex = failed
+            raise Error(f'Exception writing json to {po}.') from ex
         raise
+    _log_timings(timings, jobs, time.perf_counter() - start)
+    if options.usage is not None:
+        options.usage.update(usages)
+    if options.written is not None:
+        options.written.update(statuses)
     return outpaths
 
 
+def _dir_mode_template(files2merge, symbols, options):
+    """Returns (template, base) for _render_and_write(), or (None, None) to
+    merge preinterpolated files per symbol set instead."""
+    if (options.jobs <= 1 and not options.delta and
+            _can_preinterpolate(files2merge, options)):
+        return (None, None)
+    template = act.symbols.Template(_merge_tree(files2merge), symbols.scope)
+    logger.debug('Template has %d strings to interpolate.', template.slot_count)
+    base = None
+    if options.delta:
+        base = template.slot_values(
+            template.render(act.symbols.Symbols(symbols.source_file)))
+    return (template, base)
+
+
+def _render_in_pool(template, base, source_file, todo, options):
+    """Returns futures of _render_worker() results, one per todo output,
+    rendered by a pool of options.jobs processes."""
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(options.jobs, len(todo)),
+            initializer=_init_render_worker,
+            initargs=(template, base,
+                      options._replace(usage=None, written=None, writer=None),
+                      act.symbols.memo_size(),
+                      act.sub.write_options())) as pool:
+        return [
+            pool.submit(_render_worker, source_file, n, po) for n, po in todo
+        ]
+
+
+def _dir_mode_todo(target_path, set_names, with_globals):
+    """Returns list of (symbol set name, output path) in DIR mode."""
+    h, t = os.path.split(target_path)
+    todo = []
+    if with_globals:
+        # Global symbols (set name None) in base dir.
+        todo.append((None, target_path))
+    for symbol_set_name in set_names:
+        todo.append((symbol_set_name, os.path.join(h, symbol_set_name, t)))
+    return todo
+
+
+def _remove_outputs(outpaths, statuses):
+    """Removes the DIR mode outputs written before a failure.
+
+    Waits for the background writes, see _write().
+
+    Returns:
+        (output path, exception) for the first output a background write 
+        failed to write, or None.
+    """
+    result = None
+    for po in outpaths:
+        status = statuses.get(po)
+        if isinstance(status, concurrent.futures.Future):
+            ex = status.exception()
+            if ex is not None:
+                logger.error('Exception writing %s. %s', po, ex)
+                result = result or (po, ex)
+                continue
+        try:
+            os.remove(po)
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            # What made writing it fail, a directory in the way say.
+            logger.warning('Could not remove %s. %s', po, ex)
+    return result
+
+
+def _add_statuses(status4po, usage4po, outpaths, usages, statuses):
+    """Adds what one output's rendering wrote to what DIR mode wrote."""
+    for p, status in status4po.items():
+        outpaths.append(p)
+        usages[p] = usage4po
+        statuses[p] = status
+
+
+def _create_dir_for(target_path, writer):
+    if not writer or writer[0].writes_files:
+        act.sub.create_dir_if_inexistant(os.path.split(target_path)[0])
+
+
+def _render_and_write(template,
+                      source_file,
+                      symbol_set_name,
+                      target_path,
+                      writer=None,
+                      delta=None,
+                      base=None):
+    """Returns (seconds taken, symbols usage, {path: write status}) for one 
+    DIR mode output. See _write() for writer.
+
+    With delta, a symbol set's output is written as a patch against the 
+    rendering whose template.slot_values() are base.
+    """
+    start = time.perf_counter()
+    _create_dir_for(target_path, writer)
+    symbols = act.symbols.Symbols(source_file, symbol_set_name)
+    written = {}
+    rendered = template.render(symbols)
+    if not delta or not symbol_set_name or delta == act.sub.DELTA_WITH_FULL:
+        _write(rendered, target_path, written, writer)
+    if delta and symbol_set_name:
+        _write(template.patch(base, rendered), target_path + act.sub.DELTA_EXT,
+               written, writer)
+    return (time.perf_counter() - start, symbols.usage(), written)
+
+
+def _merge_preinterpolated_and_write(files2merge,
+                                     source_file,
+                                     symbol_set_name,
+                                     target_path,
+                                     writer=None):
+    """Same as _render_and_write() without delta, symbols usage None."""
+    start = time.perf_counter()
+    _create_dir_for(target_path, writer)
+    symbols = act.symbols.Symbols(source_file, symbol_set_name)
+    written = {}
+    _write(_merge_preinterpolated(files2merge, symbols), target_path, written,
+           writer)
+    return (time.perf_counter() - start, None, written)
+
+
+_worker_template = None
+# delta and base arguments of _render_and_write() in worker processes.
+_worker_delta = (None, None)
+
+
+def _init_render_worker(template, base, options, memo_size, write_options):
+    global _worker_template, _worker_delta  # pylint: disable=global-statement
+    _worker_template = template
+    _worker_delta = (options.delta, base)
+    act.symbols.use_memo(memo_size)
+    act.sub.use_write_options(write_options)
+
+
+def _render_worker(source_file, symbol_set_name, target_path):
+    """Returns _render_and_write() result, plus memo statistics."""
+    return _render_and_write(_worker_template, source_file, symbol_set_name,
+                             target_path, None,
+                             *_worker_delta) + (act.symbols.take_memo_stats(),)
+
+
+def _log_timings(timings, jobs, elapsed):
+    for n, seconds in timings:
+        logger.info('Rendered and wrote symbol set %s in %.3f s.',
+                    n if n else '<globals>', seconds)
+    if timings:
+        slowest = max(timings, key=lambda x: x[1])
+        logger.info(
+            'DIR mode: %d outputs in %.3f s with %d job(s). Sum %.3f s. '
+            'Slowest %s %.3f s.', len(timings), elapsed, jobs,
+            sum(x[1] for x in timings), slowest[0] if slowest[0] else
+            '<globals>', slowest[1])
+
+
 def _merge_obj(t, s, loc_stk):
     """Merge object s into object t."""
     kt = set(t.keys())
@@ -233,6 +661,26 @@ def _merge_obj(t, s, loc_stk):
         loc_stk.pop()
 
 
+def _merged(t, s, loc_stk):
+    """Returns object s merged into object t, like _merge_obj(), as a new 
+    object. Values not merged are shared, not copied."""
+    result = dict(t)
+    for k in sorted(t.keys() & s.keys()):  # attribute names in common
+        loc_stk.append(k)
+        if isinstance(t[k], dict) and isinstance(s[k], dict):
+            result[k] = _merged(t[k], s[k], loc_stk)
+        elif isinstance(t[k], dict) or isinstance(s[k], dict):
+            raise JsonCanNotMergeObjectWithPrimitiveType(
+                f'Target type {type(t[k])}. Source type {type(s[k])}. '
+                f'Source {loc_stk}.')
+        else:
+            result[k] = s[k]
+        loc_stk.pop()
+    for k in sorted(s.keys() - t.keys()):  # source only attribute names
+        result[k] = s[k]
+    return result
+
+
 def _determine_symbol_set_name(mergelist_path):
     """Result None means default to global symbol set."""
     result = None
@@ -273,9 +721,16 @@ def _parse_args():
                    _A_OUTFILE_N,
                    help=_A_OUTFILE_H,
                    default=_A_OUTFILE_D)
-    act.sub.add_symset_args(p)
-    act.sub.add_log_arg(p)
+    act.sub.add_jobs_arg(p, _A_JOBS_H)
+    act.sub.add_merge_args(p)
+    act.sub.add_manifest_arg(
+        p, f'Paths are relative to the directory of {_A_OUTFILE_N[2:].upper()}.')
+    p.add_argument(_A_DEPFILE_N, metavar='FILE', help=_A_DEPFILE_H)
+    p.add_argument(_A_DEPS_ONLY_N, help=_A_DEPS_ONLY_H, action='store_true')
+    act.sub.add_output_args(p)
     pa = p.parse_args()
+    if pa.deps_only and not pa.depfile:
+        p.error(f'Argument {_A_DEPS_ONLY_N} requires {_A_DEPFILE_N}.')
     if pa.outfile == _A_OUTFILE_D:
         h, t = os.path.split(pa.infile)
         pa.outfile = os.path.join(h, act.sub.OUT_MERGED_DEFAULT_PREFIX + t)
@@ -285,9 +740,7 @@ def _parse_args():
             val_name_in_help = _A_OUTFILE_N[2:].upper()
             p.error(f'Parent directory of {val_name_in_help} does not exist. '
                     f'{val_name_in_help}: {pa.outfile}.')
-    err_msg = act.sub.check_symset_options(pa.mode4symbols, pa.symset)
-    if err_msg:
-        p.error(err_msg)
+    act.sub.check_merge_args(pa, p)
     return pa
 
 
@@ -296,7 +749,43 @@ def _main():
     act.sub.set_up_logging(act.sub.LOGGING_LEVEL_NAME2VALUE[args.log_level],
                            args.console)
     logger.debug('symset=%s mode4symbols=%s', args.symset, args.mode4symbols)
-    merge(args.infile, args.outfile, args.mode4symbols, args.symset)
+    act.symbols.use_memo(args.memo_size)
+    act.sub.use_fsync(args.fsync)
+    act.sub.use_sidecars(args.sidecar)
+    act.sub.use_index(args.index)
+    if args.deps_only:
+        act.writers.write_depfile(
+            args.depfile,
+            depfile_targets(
+                outputs(
+                    args.infile, args.outfile, args.mode4symbols, args.symset,
+                    MergeOptions(no_globals=args.no_globals,
+                                 delta=args.delta))),
+            dependencies(args.infile))
+        return
+    if args.store:
+        act.sub.use_store(act.writers.ContentStore(args.store, args.symlinks))
+    written = {}
+    merge(
+        args.infile, args.outfile, args.mode4symbols, args.symset,
+        MergeOptions(jobs=args.jobs,
+                     no_globals=args.no_globals,
+                     preinterpolate=args.preinterpolate,
+                     written=written,
+                     delta=args.delta))
+    if args.manifest:
+        act.writers.write_manifest(args.manifest,
+                                   written,
+                                   base_dir=os.path.dirname(
+                                       os.path.abspath(args.outfile)))
+    if args.depfile:
+        # In DIR mode, all outputs depend on the same files.
+        act.writers.write_depfile(args.depfile, depfile_targets(written),
+                                  dependencies(args.infile))
+    act.sub.sync_dirs()
+    if args.store:
+        act.writers.log_store_report(written)
+    act.symbols.log_memo_stats()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,222 @@
+"""The tree of merge lists mergeall.py merges: walked in merge order, with the
+symbol args and exclusion lists of its directories.
+"""
+import logging
+import os
+import os.path
+# own imports
+import act.mergejson
+import act.sub
+
+# Name of json file used to override mode4symbols in dir sub-tree.
+MODE4SYMBOLS_FNAME = os.path.normcase('mergeall.args.json')
+# Name of json file used to exclude files just that directory.
+EXCLUDE_FNAME = os.path.normcase('mergeall.exclude.json')
+# Indices for tuples yielded by os.walk()
+_OW_DIRPATH = 0
+_OW_DIRNAMES = 1
+_OW_FILENAMES = 2
+
+logger = logging.getLogger(__name__)
+
+
+class Error(act.sub.Error):
+    """Exceptions raised in this module are of this class."""
+
+
+def make_mirror_subdirs_obj(source_dir, target_dir):
+    """Returns act.sub.MirrorSubdirs of the merge lists under source_dir to
+    target_dir."""
+    in_files = []
+    for t in os.walk(source_dir):
+        for f in sorted(t[_OW_FILENAMES]):
+            cp = act.sub.canonical(os.path.join(t[_OW_DIRPATH], f))
+            if act.sub.is_mergelist(cp):
+                in_files.append(cp)
+    return act.sub.MirrorSubdirs(target_dir, in_files, source_dir)
+
+
+def walk(in_dir, mode_args_4_dir, exceptions):
+    """Yields (merge list path, symbol args, len(exceptions)) in merge order.
+
+    Errors in exclusion lists and symbol args files are added to exceptions.
+    """
+    # Build in_file list by walking top down to guarantee that files in
+    # parent directories are processed before files in child directories.
+    # We depend on this for a feature. We overwrite the per symset generated
+    # merged files with a file generated from a mergelist in a source symset
+    # source sub-directory. Note that glob.glob() does not guarantee this.
+    for t in os.walk(in_dir):
+        # Force deterministic order of dir traversal with in place sort.
+        t[_OW_DIRNAMES].sort()
+        # Ditto for file names, but copied as doc doesn't say in place is safe.
+        filenames = [os.path.normcase(f) for f in sorted(t[_OW_FILENAMES])]
+        # Are there files to exclude in this directory?
+        if EXCLUDE_FNAME in filenames:
+            ex = _remove_excluded_files_from_list(t[_OW_DIRPATH], filenames)
+            if ex:
+                exceptions.append(ex)
+        # Are there new symbol mode args defined starting from this directory?
+        if MODE4SYMBOLS_FNAME in filenames:
+            ex = _new_symbol_args(t[_OW_DIRPATH], mode_args_4_dir)
+            if ex:
+                exceptions.append(ex)
+        # Get symbol mode for this directory.
+        symbol_args = mode_args_4_dir.get(t[_OW_DIRPATH])
+        # Merge each merge file in current directory.
+        for in_fname in filenames:
+            if act.sub.is_mergelist(in_fname):
+                in_path = act.sub.canonical(
+                    os.path.join(t[_OW_DIRPATH], in_fname))
+                yield (in_path, symbol_args, len(exceptions))
+            else:
+                logger.debug('Skip file "%s" in "%s".', in_fname,
+                             t[_OW_DIRPATH])
+
+
+def _remove_excluded_files_from_list(dirpath, filenames):
+    result = None
+    p = os.path.join(dirpath, EXCLUDE_FNAME)
+    assert os.path.exists(p), p
+    try:
+        xnames = [os.path.normcase(f) for f in act.sub.read_json(p)]
+        for x in xnames:
+            if x not in filenames:
+                raise Error(f'File name {x} in {EXCLUDE_FNAME}. '
+                            f'No such file in directory {dirpath}. ')
+            if not act.sub.is_mergelist(x):
+                raise Error(f'File name {x} in {EXCLUDE_FNAME}. '
+                            'Name does not match merge list name pattern. '
+                            f'Directory {dirpath}.')
+            if os.path.split(x)[0]:
+                raise Error(f'File name {x} in {EXCLUDE_FNAME}. '
+                            'Name can not have path components. '
+                            f'Directory {dirpath}.')
+            filenames.remove(x)
+            logger.info('Skip file %s because it is in %s of directory %s.', x,
+                        EXCLUDE_FNAME, dirpath)
+    except act.sub.Error as ex:
+        logger.exception('Exclude list error.')
+        result = ex
+    return result
+
+
+def _new_symbol_args(dir_path, mode_args_4_dir):
+    result = None
+    in_path = os.path.join(dir_path, MODE4SYMBOLS_FNAME)
+    try:
+        mode_args_4_dir.read(in_path)
+    except act.sub.Error as ex:
+        logger.exception('Exception reading new symbol mode arguments from %s.',
+                         in_path)
+        result = ex
+    return result
+
+
+class ModeArgs4Dir:
+    """Symbol args per directory, which apply in its sub-tree too.
+
+    Stored in a trie of path components, so get() takes one step per
+    component of the directory path, however many directories have args.
+    """
+
+    def __init__(self, root_dirpath, mode4symbols, symset, no_globals):
+        # Trie node: [args or None, {path component: node}].
+        self._trie = [None, {}]
+        self._can_overwrite_once = None
+        self.add(root_dirpath, mode4symbols, symset, no_globals)
+        self._can_overwrite_once = self._key(root_dirpath)
+
+    @staticmethod
+    def _key(dirpath):
+        return tuple(act.sub.canonical(dirpath).rstrip(os.sep).split(os.sep))
+
+    def add(self, dirpath, mode4symbols, symset, no_globals):
+        """Sets the args of dirpath and its sub-tree."""
+        assert os.path.isdir(dirpath), f'Not a directory: {dirpath}.'
+        k = self._key(dirpath)
+        node = self._trie
+        for c in k:
+            node = node[1].setdefault(c, [None, {}])
+        if k == self._can_overwrite_once:
+            self._can_overwrite_once = None
+        else:
+            assert node[0] is None, f'Key overwrite. {k=} {node[0]=}.'
+        node[0] = (mode4symbols, symset, no_globals)
+
+    def get(self, dirpath):
+        """Returns (mode4symbols, symset, no_globals) tuple for dirpath."""
+        p = self._key(dirpath)
+        result = None
+        node = self._trie
+        for c in p:
+            node = node[1].get(c)
+            if node is None:
+                break
+            if node[0] is not None:
+                result = node[0]
+        assert result is not None, f'No args for {p=}.'
+        return result
+
+    def read(self, filepath):
+        """Adds the args in symbol args file filepath for its directory."""
+        cfp = act.sub.canonical(filepath)
+        dirpath, filename = os.path.split(cfp)
+        j = act.sub.read_json(cfp)
+        if not isinstance(j, dict):
+            raise Error(f'File {filename} is not a JSON object. '
+                        f'Directory: {dirpath}.')
+        if act.sub.A_MODE4SYM_N not in j:
+            raise Error(f'File {filename} JSON object missing key: '
+                        f'{act.sub.A_MODE4SYM_N}. '
+                        f'Directory: {dirpath}.')
+        mode4symbols = j[act.sub.A_MODE4SYM_N]
+        symset = j.get(act.sub.A_SYMSET_N)
+        no_globals = j.get(act.sub.A_NO_GLOBALS_N, False)
+        if not isinstance(no_globals, bool):
+            raise Error(f'File {filename} JSON object invalid options. '
+                        f'Value of {act.sub.A_NO_GLOBALS_N} must be true or '
+                        f'false. Directory: {dirpath}.')
+        errmsg = act.sub.check_symset_options(mode4symbols, symset, no_globals)
+        if errmsg:
+            raise Error(f'File {filename} JSON object invalid options.'
+                        f'{errmsg} '
+                        f'Directory: {dirpath}.')
+        strange_keys = []
+        for k in j.keys():
+            if k not in [
+                    act.sub.A_MODE4SYM_N, act.sub.A_SYMSET_N,
+                    act.sub.A_NO_GLOBALS_N
+            ]:
+                strange_keys.append(k)
+        if strange_keys:
+            raise Error(f'File {filename} JSON object strange keys: '
+                        f'{strange_keys}. '
+                        f'Directory: {dirpath}.')
+        self.add(dirpath, mode4symbols, symset, no_globals)
+        logger.info(
+            'Options from %s apply in and under this directory. '
+            'Options: %s. Directory: %s.', filename, j, dirpath)
+
+
+def inputs(in_path, in_dir):
+    """Returns canonical paths of the files merging in_path depends on.
+
+    These are the files merging it reads (see act.mergejson.dependencies()),
+    the symbol args files that apply, and the exclusion list file of its
+    directory.
+    """
+    result = act.mergejson.dependencies(in_path)
+    in_dir = act.sub.canonical(in_dir)
+    dir_path = os.path.dirname(act.sub.canonical(in_path))
+    p = os.path.join(dir_path, EXCLUDE_FNAME)
+    if os.path.isfile(p):
+        result.append(p)
+    while True:
+        p = os.path.join(dir_path, MODE4SYMBOLS_FNAME)
+        if os.path.isfile(p):
+            result.append(p)
+        if dir_path == in_dir or dir_path == os.path.dirname(dir_path):
+            break
+        dir_path = os.path.dirname(dir_path)
+    return result
@@ -0,0 +1,155 @@
+"""Read json files by JSON pointer, and apply delta outputs.
+
+See mergejson.py and mergeall.py options --index and --delta.
+
+Example:
+    import act.pointer
+    value = act.pointer.read_json_pointer('a.merged.json', '/a/b')
+"""
+import json
+import logging
+import mmap
+import os.path
+# own imports
+import act.jsontext
+import act.sub
+
+logger = logging.getLogger(__name__)
+
+
+class Error(act.sub.Error):
+    """Exceptions raised in this module are of this class."""
+
+
+def split_json_pointer(pointer):
+    """Returns list of reference tokens of RFC 6901 JSON pointer.
+
+    Example: '/a~1b/0' gives ['a/b', '0']. The empty pointer '' refers to the
+    whole document and gives [].
+    """
+    if not isinstance(pointer, str) or (pointer and pointer[0] != '/'):
+        raise Error(f'Invalid JSON pointer "{pointer}". Must be empty or '
+                    'start with "/".')
+    result = []
+    for t in pointer.split('/')[1:]:
+        if '~' in t and t.replace('~0', '').replace('~1', '').count('~'):
+            raise Error(f'Invalid JSON pointer "{pointer}". "~" must be '
+                        'followed by "0" or "1".')
+        result.append(t.replace('~1', '/').replace('~0', '~'))
+    return result
+
+
+def apply_patch(o, patch):
+    """Applies JSON Patch (RFC 6902) "replace" operations to o, in place.
+
+    Applies a delta output, see act.sub.DELTA_EXT, to a copy of the output it is
+    against. Other operations are not supported.
+
+    Returns:
+        o, or the value of a replace of the whole document.
+    """
+    for op in patch:
+        if op.get('op') != 'replace':
+            raise Error(f'JSON Patch operation not supported: {op}.')
+        tokens = split_json_pointer(op['path'])
+        if not tokens:
+            o = op['value']
+            continue
+        parent = _resolve(o, tokens[:-1], op['path'], 'patched json')
+        k = tokens[-1]
+        if isinstance(parent, list):
+            _resolve(parent, [k], op['path'], 'patched json')
+            k = int(k)
+        elif not isinstance(parent, dict) or k not in parent:
+            raise Error(f'No value for JSON pointer "{op["path"]}" in '
+                        'patched json.')
+        parent[k] = op['value']
+    return o
+
+
+def read_json_pointer(fname, pointer, verify=False):
+    """Returns the value JSON pointer refers to in json file fname.
+
+    If fname has an up to date index, see act.sub.write_index(), only the
+    bytes of the indexed value the pointer is in are decoded, read from a
+    memory map of fname. Otherwise, or if those bytes do not decode, the
+    whole file is decoded.
+
+    Args:
+        fname: Json file.
+        pointer: RFC 6901 JSON pointer, '' for the whole document.
+        verify: The index is up to date if fname has the size and
+            modification time it records. If verify, it must also have the
+            sha256 digest, which takes reading all of fname, but is still
+            faster than decoding it.
+
+    Raises:
+        Error if the pointer is invalid or refers to no value, or if fname
+        is not valid json.
+    """
+    tokens = split_json_pointer(pointer)
+    index = _read_index(fname, verify)
+    if index is not None:
+        # All values down to the index depth are in the index.
+        n = min(len(tokens), index['depth'])
+        span = index['pointers'].get(act.jsontext.json_pointer(tokens[:n]))
+        if span is None:
+            raise Error(f'No value for JSON pointer "{pointer}" in {fname}.')
+        try:
+            o = _read_span(fname, span)
+        except Error as ex:
+            logger.warning('%s Decode all of %s.', ex, fname)
+        else:
+            return _resolve(o, tokens[n:], pointer, fname)
+    try:
+        with open(fname, 'r', encoding='utf-8') as fp:
+            o = json.load(fp)
+    except ValueError as ex:
+        ex.add_note(fname)
+        raise Error(f'Exception reading json from {fname}.') from ex
+    return _resolve(o, tokens, pointer, fname)
+
+
+def _read_span(fname, span):
+    """Returns the value decoded from [offset, length] span of fname."""
+    with open(fname, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            try:
+                return json.loads(m[span[0]:span[0] + span[1]])
+            except ValueError as ex:
+                ex.add_note(fname)
+                raise Error(f'Index does not match {fname}.') from ex
+
+
+def _read_index(fname, verify):
+    """Returns index of fname, or None if it has no up to date index."""
+    index_fname = fname + act.sub.INDEX_EXT
+    try:
+        with open(index_fname, 'r', encoding='utf-8') as fp:
+            index = json.load(fp)
+    except FileNotFoundError:
+        logger.info('No index: %s.', index_fname)
+        return None
+    if index.get('version') != act.sub.INDEX_VERSION:
+        logger.warning('Index version %s, expected %d: %s.',
+                       index.get('version'), act.sub.INDEX_VERSION, index_fname)
+        return None
+    st = os.stat(fname)
+    if (index['size'], index['mtime_ns']) != (st.st_size, st.st_mtime_ns) or (
+            verify and index['sha256'] != act.sub.file_digest(fname).hex()):
+        logger.info('Index out of date: %s.', index_fname)
+        return None
+    return index
+
+
+def _resolve(o, tokens, pointer, fname):
+    """Returns the value in o reference tokens refer to."""
+    for t in tokens:
+        if isinstance(o, dict) and t in o:
+            o = o[t]
+        elif (isinstance(o, list) and t.isdigit() and
+              (t == '0' or t[0] != '0') and int(t) < len(o)):
+            o = o[int(t)]
+        else:
+            raise Error(f'No value for JSON pointer "{pointer}" in {fname}.')
+    return o
@@ -0,0 +1,72 @@
+"""Load json from binary sidecar files.
+
+A sidecar file has the same json as the json file it is next to, in a format
+much faster to load. See act.sub.write_sidecar(), and mergejson.py and
+mergeall.py option --sidecar.
+
+Example:
+    import act.sidecar
+    config = act.sidecar.load('a.merged.json')
+"""
+import json
+import logging
+import marshal
+# own imports
+import act.sub
+
+logger = logging.getLogger(__name__)
+
+
+class Error(act.sub.Error):
+    """Exceptions raised in this module are of this class."""
+
+
+def read(sidecar_path):
+    """Returns (digest of json file, decoded json) from a sidecar file.
+
+    Raises:
+        Error if not a sidecar file of a version this module can read.
+    """
+    with open(sidecar_path, 'rb') as fp:
+        data = fp.read()
+    size = act.sub.SIDECAR_HEADER.size
+    if len(data) < size:
+        raise Error(f'Not a sidecar file: {sidecar_path}.')
+    magic, version, marshal_version, digest = act.sub.SIDECAR_HEADER.unpack(
+        data[:size])
+    if magic != act.sub.SIDECAR_MAGIC:
+        raise Error(f'Not a sidecar file: {sidecar_path}.')
+    if (version != act.sub.SIDECAR_VERSION or
+            marshal_version != marshal.version):
+        raise Error(f'Sidecar file version {version}, marshal version '
+                    f'{marshal_version}, expected {act.sub.SIDECAR_VERSION} '
+                    f'and {marshal.version}: {sidecar_path}.')
+    try:
+        return (digest, marshal.loads(data[size:]))
+    except (EOFError, ValueError, TypeError) as ex:
+        raise Error(f'Corrupt sidecar file: {sidecar_path}.') from ex
+
+
+def load(json_path, verify=True):
+    """Returns decoded json of file json_path, from its sidecar if usable.
+
+    The json file is decoded instead if its sidecar is missing, of another
+    version, or out of date.
+
+    Args:
+        json_path: Json file next to which the sidecar is.
+        verify: Check the sidecar is up to date, by hashing the json file.
+            Faster than decoding the json, slower than loading the sidecar.
+    """
+    sidecar_path = json_path + act.sub.SIDECAR_EXT
+    try:
+        digest, o = read(sidecar_path)
+        if not verify or digest == act.sub.file_digest(json_path):
+            return o
+        logger.info('Sidecar out of date: %s.', sidecar_path)
+    except FileNotFoundError:
+        logger.info('No sidecar: %s.', sidecar_path)
+    except Error:
+        logger.exception('Sidecar not usable: %s.', sidecar_path)
+    with open(json_path, 'r', encoding='utf-8') as fp:
+        return json.load(fp)
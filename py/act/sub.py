@@ -8,6 +8,11 @@ import shutil
 import uuid
 import sys
 import copy
+import hashlib
+import marshal
+import struct
+# own imports
+import act.jsontext
 
 # == PUBLIC CONSTANTS =========================================================
 
@@ -18,6 +23,29 @@ OUT_MERGED_EXT = os.path.normcase(f'.merged{JSON_EXT}')
 OUT_MERGED_DEFAULT_PREFIX = os.path.normcase(f'{OUT_PREFIX}merged.')
 
 LOG_FILE = f'./{OUT_PREFIX}python.log.txt'
+# What write_as_json() did, and manifest keys, see act.writers.write_manifest().
+WRITE_ADDED = 'added'
+WRITE_CHANGED = 'changed'
+WRITE_UNCHANGED = 'unchanged'
+MANIFEST_REMOVED = 'removed'
+# Archive file name extensions, see act.writers.ArchiveWriter.
+ARCHIVE_EXTS = ('.jsonl', '.tar', '.tar.gz', '.tgz', '.zip')
+# Binary sidecar file written next to json files, see write_sidecar().
+SIDECAR_EXT = '.marshal'
+SIDECAR_MAGIC = b'ACTJ'
+SIDECAR_VERSION = 1
+# Magic, sidecar version, marshal version, sha256 digest of json file.
+SIDECAR_HEADER = struct.Struct('<4sHH32s')
+# Index of json values by JSON pointer written next to json files, see
+# write_index().
+INDEX_EXT = '.index'
+INDEX_VERSION = 2
+# JSON Patch written instead of a DIR mode output, see
+# act.pointer.apply_patch().
+DELTA_EXT = os.path.normcase(f'.patch{JSON_EXT}')
+# Values of A_DELTA_N: write delta outputs only, or full outputs as well.
+DELTA_ONLY = 'only'
+DELTA_WITH_FULL = 'with_full'
 LOGGING_LEVEL_NAME2VALUE = {
     'critical': logging.CRITICAL,
     'error': logging.ERROR,
@@ -28,6 +56,12 @@ LOGGING_LEVEL_NAME2VALUE = {
 LOGGING_LEVEL_VALUE2NAME = {v: k for k, v in LOGGING_LEVEL_NAME2VALUE.items()}
 
 A_SYMSET_N = '--symset'
+A_NO_GLOBALS_N = '--no_globals'
+A_SIDECAR_N = '--sidecar'
+A_INDEX_N = '--index'
+A_DELTA_N = '--delta'
+A_STORE_N = '--store'
+A_JOBS_N = '--jobs'
 A_MODE4SYM_N = '--mode4symbols'
 M4S_DIR = 'DIR'
 M4S_ERROR = 'ERROR'
@@ -46,11 +80,72 @@ _A_CONSOLE_H = 'Also write log messages to console.'
 _A_LOG_LEVEL_H = ('logging level. Log messages are appended to '
                   f'"{LOG_FILE}". Default is "{_A_LOG_LEVEL_D}".')
 
+_A_JOBS_D = 1
+_A_MEMO_SIZE_N = '--memo_size'
+_A_MEMO_SIZE_D = 0
+_A_MEMO_SIZE_H = ('Remember up to this many interpolated strings per run, '
+                  'so that strings repeated with the same symbol set are '
+                  'interpolated only once. Hit and miss statistics are logged. '
+                  f'Default is {_A_MEMO_SIZE_D}, no memo.')
+_A_MANIFEST_N = '--manifest'
+_A_MANIFEST_H = (
+    f'Write to FILE a json object with arrays "{WRITE_ADDED}", '
+    f'"{WRITE_CHANGED}", "{WRITE_UNCHANGED}" and "{MANIFEST_REMOVED}" of '
+    'output file paths. Output files with the same content as before are not '
+    'rewritten, and are "unchanged".')
+_A_SIDECAR_H = (
+    'Next to each output json file, write the same json in a binary format '
+    f'much faster to load, in a file with the same name plus "{SIDECAR_EXT}". '
+    'It has the hash of the json file, to detect when it is out of date. '
+    'Load it with python module act.sidecar.')
+_A_INDEX_H = (
+    'Next to each output json file, write a json index of the byte offset and '
+    'length in the output file of each value, by JSON pointer, down to DEPTH '
+    f'levels, in a file with the same name plus "{INDEX_EXT}". With it, '
+    'act.pointer.read_json_pointer() decodes only the part of the output file '
+    'it needs.')
+_A_DELTA_H = (
+    f'In {A_MODE4SYM_N} {M4S_DIR}, write the output of each symbol set as a '
+    'JSON Patch (RFC 6902) against the output with global symbols only, '
+    f'with the same name plus "{DELTA_EXT}". The patch replaces the strings '
+    'the symbol set interpolates differently. Apply it with '
+    f'act.pointer.apply_patch(). "{DELTA_WITH_FULL}" writes the full outputs '
+    f'too. Not allowed with {A_NO_GLOBALS_N}.')
+_A_STORE_H = (
+    'Write each distinct output content once, to a file in DIR named by its '
+    'sha256 hash, and make output files hard links to it. Identical outputs '
+    'then take the space of one, and are written once. Files in DIR are '
+    'never removed, files no output links to any more can be. Output files '
+    'must not be modified in place, as that modifies the outputs linked to '
+    'the same file.')
+_A_SYMLINKS_N = '--symlinks'
+_A_SYMLINKS_H = (f'With {A_STORE_N}, make output files symbolic links instead '
+                 'of hard links, as needed if DIR is on another file system.')
+_A_FSYNC_N = '--fsync'
+_A_FSYNC_H = ('Flush each output file to disk before renaming it into place, '
+              'and the output directories once at the end. Slower, but no '
+              'output is lost or left partly written by a system crash.')
+_A_PREINTERPOLATE_N = '--preinterpolate'
+_A_PREINTERPOLATE_H = (
+    'Interpolate symbols in each file to merge before merging, and remember '
+    'the result per file and symbol set for the rest of the run, so that '
+    'files shared by many merge lists are interpolated only once per symbol '
+    'set. Outputs are the same. Ignored where symbol usage is recorded, which '
+    'needs interpolation after merge.')
+
 _M4S_CHOICES = [
     M4S_DIR, M4S_ERROR, M4S_FNAME, M4S_GLOBAL, M4S_IGNORE, M4S_NAMED
 ]
-_A_SYMSET_H = ('Symbol set name for symbol interpolation. Error unless '
-               f'{A_MODE4SYM_N} is {M4S_NAMED}.')
+_A_SYMSET_H = (
+    'Symbol set name for symbol interpolation, or a symbol set selector: a '
+    'comma separated list of symbol set names and glob patterns, e.g. '
+    '"DE,FR,U*". Mandatory if '
+    f'{A_MODE4SYM_N} is {M4S_NAMED}. Optional if {A_MODE4SYM_N} is {M4S_DIR}, '
+    'to generate files for the selected symbol sets only. Error for other '
+    f'{A_MODE4SYM_N} values.')
+_A_NO_GLOBALS_H = (
+    f'When {A_MODE4SYM_N} is {M4S_DIR}, do not generate the (deprecated) file '
+    f'with global symbols only. Error for other {A_MODE4SYM_N} values.')
 _A_MODE4SYM_D = M4S_FNAME
 _A_MODE4SYM_H = f'''
 How to generate files when merge list refers to a symbol definition file.
@@ -75,7 +170,9 @@ Choice GLOBAL : generate OUTFILE with global symbols only.
 Choice IGNORE : generate OUTFILE with no symbol interpolation.
 
 Choice {M4S_NAMED} : generate OUTFILE with symbol set specified by the 
-{A_SYMSET_N} option.
+{A_SYMSET_N} option. If {A_SYMSET_N} is a list of names or has glob patterns,
+generate one file per selected symbol set as for choice DIR, but without the 
+global symbols only file.
 
 Default is {_A_MODE4SYM_D}.
 '''
@@ -111,23 +208,339 @@ def check_types(d, loc_stk, allow_nested_arrays=True):
         loc_stk.pop()
 
 
-def write_as_json(o, fname):
+def write_as_json(o, fname, compact=False, ensure_ascii=True, output=False):
+    """Writes o as json to file fname.
+
+    Output is the same as json.dump(o, fp, indent=4), but made faster, see 
+    act.jsontext.dump_indented().
+
+    The json is written to a temporary file in the same directory, renamed 
+    to fname when complete, so fname is never seen partly written. If the 
+    write fails, fname is as it was. See use_fsync(). If fname has the same
+    content already, it is left untouched, its modification time unchanged.
+
+    Args:
+        o: Decoded json to write.
+        fname: File to (over)write.
+        compact: No whitespace at all, instead of 4 space indentation.
+        ensure_ascii: Escape non-ASCII characters, as json.dump() does.
+        output: fname is a merge output, linked to the content store and
+            with a sidecar and an index, if turned on by use_store(),
+            use_sidecars() and use_index(), or without a stale one when
+            not. Files like manifests are not.
+
+    Returns:
+        WRITE_ADDED, WRITE_CHANGED or WRITE_UNCHANGED.
+    """
     logger.info('Write json to: %s.', fname)
     logger.debug('About to serialize as json python object: %s.', o)
-    with open(fname, 'w', encoding='utf-8') as fp:
-        try:
-            json.dump(o, fp, indent=4)
-        except (TypeError, ValueError, RecursionError) as ex:
-            ex.add_note(fname)
-            raise Error(f'Exception writing json to {fname}.') from ex
+
+    def write(fp):
+        if compact:
+            fp.write(
+                json.dumps(o, separators=(',', ':'),
+                           ensure_ascii=ensure_ascii))
+        else:
+            act.jsontext.dump_indented(o, fp, ensure_ascii)
+
+    try:
+        if output and _store:
+            result = _store.link(fname, write)
+        else:
+            result = replace_file(fname, write)
+    except (TypeError, ValueError, RecursionError) as ex:
+        ex.add_note(fname)
+        raise Error(f'Exception writing json to {fname}.') from ex
+    if output:
+        _write_companions(o, fname)
+    return result
+
+
+def _write_companions(o, fname):
+    """Writes sidecar and index of output fname, removes those turned off."""
+    if _sidecars:
+        write_sidecar(o, fname)
+    else:
+        _remove_stale(fname + SIDECAR_EXT)
+    if _index_depth:
+        write_index(fname, _index_depth)
+    else:
+        _remove_stale(fname + INDEX_EXT)
+
+
+def _remove_stale(fname):
+    """Removes fname, left by an earlier write, if it exists."""
+    try:
+        os.remove(fname)
+    except FileNotFoundError:
+        return
+    logger.info('Removed stale: %s.', fname)
+
+
+def replace_file(fname, write, binary=False):
+    """Replaces fname with what write(fp) writes, see write_as_json().
+
+    A replaced file keeps its permission bits.
+    """
+    tmp = temp_path(fname)
+    result = WRITE_CHANGED if os.path.isfile(fname) else WRITE_ADDED
+    replaced = False
+    try:
+        with (open(tmp, 'xb') if binary else open(
+                tmp, 'x', encoding='utf-8')) as fp:
+            write(fp)
+            fp.flush()
+            if result == WRITE_CHANGED and same_content(tmp, fname):
+                result = WRITE_UNCHANGED
+            elif _fsync:
+                os.fsync(fp.fileno())
+        if result == WRITE_CHANGED:
+            shutil.copymode(fname, tmp)
+        if result != WRITE_UNCHANGED:
+            os.replace(tmp, fname)
+            replaced = True
+    finally:
+        if not replaced:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+    if replaced:
+        sync_dir_later(fname)
+    else:
+        logger.info('Unchanged: %s.', fname)
+    return result
+
+
+def file_digest(fname):
+    """Returns sha256 digest of file fname's bytes."""
+    with open(fname, 'rb') as fp:
+        return hashlib.file_digest(fp, 'sha256').digest()
+
+
+def write_sidecar(o, json_fname):
+    """Writes o, the decoded json of file json_fname, in marshal format.
+
+    The sidecar file, json_fname plus SIDECAR_EXT, starts with a 
+    SIDECAR_HEADER that has the digest (see file_digest()) of json_fname. 
+    Decoding it is much faster than decoding json_fname, see act.sidecar.
+
+    Returns:
+        WRITE_ADDED, WRITE_CHANGED or WRITE_UNCHANGED.
+    """
+    header = SIDECAR_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION,
+                                 marshal.version, file_digest(json_fname))
+    sidecar = json_fname + SIDECAR_EXT
+    try:
+        with open(sidecar, 'rb') as fp:
+            if fp.read(SIDECAR_HEADER.size) == header:
+                logger.info('Unchanged: %s.', sidecar)
+                return WRITE_UNCHANGED
+    except FileNotFoundError:
+        pass
+    logger.info('Write sidecar: %s.', sidecar)
+    try:
+        data = marshal.dumps(o)
+    except ValueError as ex:
+        ex.add_note(sidecar)
+        raise Error(f'Exception writing {sidecar}.') from ex
+    return replace_file(sidecar, lambda fp: fp.write(header + data), True)
+
+
+def write_index(json_fname, depth):
+    """Writes index of the values in json file json_fname, see INDEX_EXT.
+
+    The index file is a json object with the json_fname "size", "mtime_ns"
+    and "sha256" hex digest, and for each value down to depth levels, the
+    JSON pointer to it mapped to [offset, length] of its bytes in
+    json_fname. See act.pointer.read_json_pointer().
+
+    Returns:
+        WRITE_ADDED, WRITE_CHANGED or WRITE_UNCHANGED.
+    """
+    index_fname = json_fname + INDEX_EXT
+    logger.info('Write index: %s.', index_fname)
+    with open(json_fname, 'rb') as fp:
+        data = fp.read()
+        mtime_ns = os.fstat(fp.fileno()).st_mtime_ns
+    try:
+        pointers = act.jsontext.value_spans(data.decode('utf-8'), depth)
+    except (UnicodeDecodeError, ValueError, IndexError) as ex:
+        ex.add_note(json_fname)
+        raise Error(f'Exception indexing {json_fname}.') from ex
+    index = {
+        'version': INDEX_VERSION,
+        'depth': depth,
+        'size': len(data),
+        'mtime_ns': mtime_ns,
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'pointers': pointers
+    }
+    return replace_file(
+        index_fname, lambda fp: json.dump(index, fp, separators=(',', ':')))
+
+
+_COMPARE_CHUNK = 1 << 20
+
+
+def temp_path(fname):
+    """Returns a new path in the directory of fname, for a temporary file."""
+    h, t = os.path.split(os.path.abspath(fname))
+    return os.path.join(h, f'.{t}.{uuid.uuid4().hex}.tmp')
+
+
+def same_content(path1, path2):
+    """True if files path1 and path2 have the same bytes."""
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    with open(path1, 'rb') as fp1, open(path2, 'rb') as fp2:
+        while True:
+            b1 = fp1.read(_COMPARE_CHUNK)
+            if b1 != fp2.read(_COMPARE_CHUNK):
+                return False
+            if not b1:
+                return True
+
+
+# ContentStore write_as_json() links outputs to, or None. See use_store().
+_store = None
+
+
+def use_store(store):
+    """Sets act.writers.ContentStore write_as_json() writes to, None for none.
+    """
+    global _store  # pylint: disable=global-statement
+    _store = store
+
+
+def content_store():
+    """Returns the ContentStore set by use_store(), or None."""
+    return _store
+
+
+def write_options():
+    """Returns the options set by use_*() functions, for use_write_options()
+    in another process."""
+    return (_fsync, _sidecars, _index_depth, _store)
+
+
+def use_write_options(options):
+    """Sets options write_options() returned."""
+    fsync, sidecars, index, store = options
+    use_fsync(fsync)
+    use_sidecars(sidecars)
+    use_index(index)
+    use_store(store)
+
+
+# True if write_as_json() writes sidecars. See use_sidecars().
+_sidecars = False
+
+
+def use_sidecars(sidecars):
+    """Sets whether write_as_json() also writes a sidecar, see write_sidecar().
+    """
+    global _sidecars  # pylint: disable=global-statement
+    _sidecars = sidecars
+
+
+def is_sidecars():
+    """True if write_as_json() writes sidecars, see use_sidecars()."""
+    return _sidecars
+
+
+# Depth of index written by write_as_json(), 0 for none. See use_index().
+_index_depth = 0
+
+
+def use_index(depth):
+    """Sets whether write_as_json() also writes an index, see write_index().
+
+    Args:
+        depth: JSON pointer depth of the values indexed, 0 for no index.
+    """
+    global _index_depth  # pylint: disable=global-statement
+    _index_depth = depth
+
+
+def index_depth():
+    """Returns the depth set by use_index()."""
+    return _index_depth
+
+
+def companion_paths(json_fname):
+    """Returns paths of files write_as_json() writes next to json_fname."""
+    result = []
+    if _sidecars:
+        result.append(json_fname + SIDECAR_EXT)
+    if _index_depth:
+        result.append(json_fname + INDEX_EXT)
+    return result
+
+
+# True if written files are flushed to disk. See use_fsync().
+_fsync = False
+# Directories with files renamed into them, flushed by sync_dirs().
+_dirs_to_sync = set()
+
+
+def use_fsync(fsync):
+    """Sets whether files written are flushed to disk.
+
+    If fsync is True, write_as_json() flushes each file to disk before it 
+    is renamed into place. The directories they are renamed into are 
+    flushed by sync_dirs(), once per directory for a batch of files.
+    """
+    global _fsync  # pylint: disable=global-statement
+    _fsync = fsync
+
+
+def is_fsync():
+    """True if files written are flushed to disk, see use_fsync()."""
+    return _fsync
+
+
+def sync_dir_later(path):
+    """If flushing to disk, sync_dirs() will flush the directory of path."""
+    if _fsync:
+        _dirs_to_sync.add(os.path.dirname(canonical(path)))
+
+
+def sync_dirs():
+    """Flushes to disk directories files were renamed into since last call."""
+    dirs = sorted(_dirs_to_sync)
+    _dirs_to_sync.clear()
+    # Directories can not be opened to be flushed on Windows.
+    if dirs and hasattr(os, 'O_DIRECTORY'):
+        for d in dirs:
+            fd = os.open(d, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        logger.info('Flushed %d directories to disk.', len(dirs))
+
+
+def stat_signature(path):
+    """Returns a value that changes when the file changes, or None.
+
+    path may be an os.DirEntry, which stats it at most once.
+    """
+    try:
+        st = path.stat() if isinstance(path, os.DirEntry) else os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
 
 
 _read_json_cache = {}
 
 
 def read_json(fname, level=logging.INFO):
+    """Returns json decoded from file fname, cached until the file changes."""
     cp = canonical(fname)
-    if cp not in _read_json_cache:
+    sig = stat_signature(cp)
+    if cp not in _read_json_cache or _read_json_cache[cp][0] != sig:
         logger.log(level, 'Read json from: %s.', fname)
         try:
             with open(fname, 'r', encoding='utf-8') as fp:
@@ -135,13 +548,14 @@ def read_json(fname, level=logging.INFO):
         except json.decoder.JSONDecodeError as ex:
             ex.add_note(fname)
             raise Error(f'Exception reading json from {fname}.') from ex
-        _read_json_cache[cp] = o
+        _read_json_cache[cp] = (sig, o)
     else:
         logger.debug('Read json cache hit : %s.', cp)
-    return copy.deepcopy(_read_json_cache[cp])
+    return copy.deepcopy(_read_json_cache[cp][1])
 
 
 def set_up_logging(level, also_log_to_console=True):
+    """Logs to LOG_FILE, and to the console if also_log_to_console."""
     _lf = logging.Formatter(_LOGGING_FORMAT)
     _lh = logging.FileHandler(LOG_FILE, 'a', encoding='utf8')
     _lh.setFormatter(_lf)
@@ -158,6 +572,20 @@ def set_up_logging(level, also_log_to_console=True):
     logger.info('Current directory: %s.', os.getcwd())
 
 
+def logging_options():
+    """Returns root logger level and log file, see use_logging_options()."""
+    return (logging.getLogger().level, os.path.abspath(LOG_FILE))
+
+
+def use_logging_options(options):
+    """Logs as logging_options() returned, in a worker process: a forked one
+    has the handlers of its parent, a spawned one logs to the file only."""
+    level, log_file = options
+    logging.basicConfig(filename=log_file, format=_LOGGING_FORMAT,
+                        encoding='utf8')
+    logging.getLogger().setLevel(level)
+
+
 def _is_array_of_filepaths(file_path):
     o = read_json(file_path)
     if not isinstance(o, list):
@@ -177,7 +605,7 @@ class MergeListCycle(Error):
     """When merge lists referring to other merge lists make a cycle."""
 
 
-def read_and_resolve_path_array(source_path):
+def read_and_resolve_path_array(source_path, merge_lists=None):
     """Reads JSON array of file paths.
 
     Resolves relative paths relative to dir containing source_path.
@@ -185,20 +613,26 @@ def read_and_resolve_path_array(source_path):
     If array item is itself a file containing a JSON array of file paths,
     expand in place, recursively.
 
+    If merge_lists is a list, the canonical paths of source_path and of the
+    arrays expanded in it are appended to it.
+
     Returns: list of canonical paths.
 
     Raises:
         MergeListCycle
     """
-    return _read_and_resolve_path_array(source_path, [])
+    return _read_and_resolve_path_array(source_path, [], merge_lists)
 
 
-def _read_and_resolve_path_array(source_path, merge_list_stack):
+def _read_and_resolve_path_array(source_path, merge_list_stack,
+                                 merge_lists=None):
     source_path = canonical(source_path)
     if source_path in merge_list_stack:
         raise MergeListCycle('Merge list in merge list makes loop: '
                              f'"{source_path}". {merge_list_stack=}')
     merge_list_stack.append(source_path)
+    if merge_lists is not None:
+        merge_lists.append(source_path)
     source_path_list_raw = read_json(source_path)
     basedir = os.path.split(source_path)[0]
     result = []
@@ -210,7 +644,8 @@ def _read_and_resolve_path_array(source_path, merge_list_stack):
             raise Error('Invalid item in JSON array of file paths: '
                         f'"{p}" in {source_path} is not a file.')
         if _is_array_of_filepaths(p):
-            result = result + _read_and_resolve_path_array(p, merge_list_stack)
+            result = result + _read_and_resolve_path_array(
+                p, merge_list_stack, merge_lists)
         else:
             result.append(canonical(p))
     merge_list_stack.pop()
@@ -241,6 +676,42 @@ def dwok(arg, argname, argparser):
     return arg
 
 
+def posint(arg, argname, argparser):
+    """For arg parser to check arg is a positive integer."""
+    try:
+        result = int(arg)
+    except ValueError:
+        result = 0
+    if result < 1:
+        argparser.error(f'Argument {argname} invalid. Not a positive integer: '
+                        f'"{arg}".')
+    return result
+
+
+def nonnegint(arg, argname, argparser):
+    """For arg parser to check arg is an integer, 0 or more."""
+    try:
+        result = int(arg)
+    except ValueError:
+        result = -1
+    if result < 0:
+        argparser.error(f'Argument {argname} invalid. Not an integer 0 or '
+                        f'more: "{arg}".')
+    return result
+
+
+def posfloat(arg, argname, argparser):
+    """For arg parser to check arg is a positive number."""
+    try:
+        result = float(arg)
+    except ValueError:
+        result = 0
+    if not result > 0:
+        argparser.error(f'Argument {argname} invalid. Not a positive number: '
+                        f'"{arg}".')
+    return result
+
+
 def canonical(path):
     """Returns unique representation of file path."""
     return os.path.normcase(os.path.abspath(path))
@@ -258,20 +729,49 @@ def create_dir_if_inexistant(dir_path):
             raise
 
 
-def create_or_empty_dir(dir_path):
-    """Ensures that dir_path is an existing empty directory."""
-    if os.path.exists(dir_path):
-        # Rename to work around WindowsError: [Error 5] Access is denied: ...
-        # when creatng the dir after deletion.
-        renamed = os.path.join(os.path.split(dir_path)[0], str(uuid.uuid4()))
-        logging.debug('Rename "%s" to "%s".', dir_path, renamed)
-        os.rename(dir_path, renamed)
-        logging.debug('Remove "%s".', renamed)
-        shutil.rmtree(renamed)
-    create_dir_if_inexistant(dir_path)
+def add_manifest_arg(argparser, help_text):
+    """Adds --manifest, help_text telling the paths are relative to what."""
+    argparser.add_argument(_A_MANIFEST_N,
+                           metavar='FILE',
+                           help=_A_MANIFEST_H + ' ' + help_text)
+
+
+def add_sidecar_arg(argparser):
+    """Adds --sidecar, see use_sidecars()."""
+    argparser.add_argument(A_SIDECAR_N, help=_A_SIDECAR_H, action='store_true')
+
+
+def add_index_arg(argparser):
+    """Adds --index, see use_index()."""
+    argparser.add_argument(A_INDEX_N,
+                           metavar='DEPTH',
+                           help=_A_INDEX_H,
+                           default=0,
+                           type=lambda x: posint(x, A_INDEX_N, argparser))
+
+
+def add_delta_arg(argparser):
+    """Adds --delta, for DIR mode outputs as JSON Patch."""
+    argparser.add_argument(A_DELTA_N,
+                           help=_A_DELTA_H,
+                           choices=[DELTA_ONLY, DELTA_WITH_FULL])
+
+
+def add_store_args(argparser):
+    """Adds --store and --symlinks, see use_store()."""
+    argparser.add_argument(A_STORE_N, metavar='DIR', help=_A_STORE_H)
+    argparser.add_argument(_A_SYMLINKS_N,
+                           help=_A_SYMLINKS_H,
+                           action='store_true')
+
+
+def add_fsync_arg(argparser):
+    """Adds --fsync, see use_fsync()."""
+    argparser.add_argument(_A_FSYNC_N, help=_A_FSYNC_H, action='store_true')
 
 
 def add_log_arg(argparser):
+    """Adds --log_level and --console, see set_up_logging()."""
     argparser.add_argument(_A_LOG_LEVEL_N[1:3],
                            _A_LOG_LEVEL_N,
                            help=_A_LOG_LEVEL_H,
@@ -284,24 +784,86 @@ def add_log_arg(argparser):
 
 
 def add_symset_args(arg_parser):
+    """Adds --mode4symbols, --symset and --no_globals."""
     arg_parser.add_argument(A_MODE4SYM_N[1:3],
                             A_MODE4SYM_N,
                             help=_A_MODE4SYM_H,
                             default=_A_MODE4SYM_D,
                             choices=_M4S_CHOICES)
     arg_parser.add_argument(A_SYMSET_N[1:3], A_SYMSET_N, help=_A_SYMSET_H)
-
-
-def check_symset_options(mode4symbols, symset_name):
+    arg_parser.add_argument(A_NO_GLOBALS_N,
+                            help=_A_NO_GLOBALS_H,
+                            action='store_true')
+
+
+def add_memo_arg(arg_parser):
+    """Adds --memo_size, see act.symbols.use_memo()."""
+    arg_parser.add_argument(
+        _A_MEMO_SIZE_N,
+        help=_A_MEMO_SIZE_H,
+        default=_A_MEMO_SIZE_D,
+        type=lambda x: nonnegint(x, _A_MEMO_SIZE_N, arg_parser))
+
+
+def add_preinterpolate_arg(arg_parser):
+    """Adds --preinterpolate."""
+    arg_parser.add_argument(_A_PREINTERPOLATE_N,
+                            help=_A_PREINTERPOLATE_H,
+                            action='store_true')
+
+
+def add_jobs_arg(argparser, help_text):
+    """Adds -j/--jobs, a number of processes."""
+    argparser.add_argument(A_JOBS_N[1:3],
+                           A_JOBS_N,
+                           help=f'{help_text} Default is {_A_JOBS_D}.',
+                           default=_A_JOBS_D,
+                           type=lambda x: posint(x, A_JOBS_N, argparser))
+
+
+def add_merge_args(argparser):
+    """Adds the options of how merge lists are merged."""
+    add_symset_args(argparser)
+    add_memo_arg(argparser)
+    add_preinterpolate_arg(argparser)
+
+
+def add_output_args(argparser):
+    """Adds the options of what is written and how, and logging options."""
+    add_sidecar_arg(argparser)
+    add_index_arg(argparser)
+    add_delta_arg(argparser)
+    add_store_args(argparser)
+    add_fsync_arg(argparser)
+    add_log_arg(argparser)
+
+
+def check_merge_args(args, argparser):
+    """Exits via argparser.error() if parsed args of add_merge_args() and
+    add_output_args() do not go together."""
+    err_msg = check_symset_options(args.mode4symbols, args.symset,
+                                   args.no_globals)
+    if err_msg:
+        argparser.error(err_msg)
+    if args.delta and args.no_globals:
+        argparser.error(f'Argument {A_DELTA_N} not allowed with '
+                        f'{A_NO_GLOBALS_N}.')
+
+
+def check_symset_options(mode4symbols, symset_name, no_globals=False):
     """Returns error text or None if options are valid."""
     result = None
     if mode4symbols not in _M4S_CHOICES:
         result = (f'Invalid {A_MODE4SYM_N} option value: "{mode4symbols}". '
                   f'Possible values are: {_M4S_CHOICES}.')
-    elif symset_name and mode4symbols != M4S_NAMED:
+    elif symset_name and mode4symbols not in (M4S_NAMED, M4S_DIR):
         result = (
             f'The {A_SYMSET_N} option is prohibited unless {A_MODE4SYM_N} '
-            f'option is {M4S_NAMED}.')
+            f'option is {M4S_NAMED} or {M4S_DIR}.')
+    elif no_globals and mode4symbols != M4S_DIR:
+        result = (
+            f'The {A_NO_GLOBALS_N} option is prohibited unless {A_MODE4SYM_N} '
+            f'option is {M4S_DIR}.')
     elif mode4symbols == M4S_NAMED and symset_name is None:
         result = (
             f'The {A_SYMSET_N} option is mandatory if {A_MODE4SYM_N} option '
@@ -309,6 +871,11 @@ def check_symset_options(mode4symbols, symset_name):
     return result
 
 
+def is_symset_selector(symset_name):
+    """True if symset_name is a list of names or has glob patterns."""
+    return any(c in symset_name for c in ',*?[')
+
+
 class MirrorSubdirs():
     """All paths returned are canonical.
     
@@ -348,6 +915,7 @@ class MirrorSubdirs():
         self.__out_dir = canonical(out_dir_root)
 
     def out_dir(self):
+        """Returns the canonical output directory."""
         return self.__out_dir
 
     def rel_path(self, source_path):
@@ -360,12 +928,16 @@ class MirrorSubdirs():
         result = cpath[len(self.__source_common_prefix):]
         return result
 
-    def gen_file_path(self, source_path):
-        """Returns mirrored target path corresponding to source_path."""
+    def gen_file_path(self, source_path, create_dir=True):
+        """Returns mirrored target path corresponding to source_path.
+        
+        Creates its directory, unless create_dir is False.
+        """
         rel_path = self.rel_path(source_path)
         path = os.path.join(self.__out_dir, rel_path)
         dir_part, file_part = os.path.split(path)
-        create_dir_if_inexistant(dir_part)
+        if create_dir:
+            create_dir_if_inexistant(dir_part)
         return os.path.join(dir_part, file_part)
 
 
@@ -383,10 +955,12 @@ def _is_that_file(filepath, end):
 
 
 def is_mergelist(filepath):
+    """True if filepath is a merge list file name."""
     return _is_that_file(filepath, MERGELIST_EXT)
 
 
 def is_symbol_def_file(filepath):
+    """True if filepath is a symbol definition file name."""
     return _is_that_file(filepath, _SYMBOLS_EXT)
 
 
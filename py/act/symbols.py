@@ -57,6 +57,20 @@ I.e. simply symbols.json, or anything, followed by .symbols.json.
 
 Named sets of symbols can not nest.
 
+Interpolation Scope
+===================
+By default, symbols are interpolated in all values. The reserved key 
+"$interpolate" in the symbol definition file limits where, with RFC 6901 JSON
+pointers to subtrees of the merged json to include and/or exclude. Example:
+
+{"$interpolate" : { "include":["/config"], "exclude":["/config/vectors"] }
+,"skin":"fur"
+}
+
+Without "include", everything not excluded is included. Excluded subtrees are
+skipped entirely, so a literal '${' in them is left as is. Array elements are
+referred to by index, e.g. "/list/0".
+
 Mergelist File
 ==============
 If not specified as a command line parameter, the name of the symbol set to
@@ -75,7 +89,10 @@ Error if symbol set name not defined in symbol file.
 Pseuo-BNF
 =========
 symbols := '{' symbol_set_or_global_symbol (',' symbol_set_or_global_symbol)* '}'
-symbol_set_or_global_symbol := ( symbol_set | symbol_def )
+symbol_set_or_global_symbol := ( symbol_set | symbol_def | scope )
+scope := '"$interpolate"' ':' '{' pointers (',' pointers)? '}'
+pointers := ( '"include"' | '"exclude"' ) ':' '[' (pointer (',' pointer)*)? ']'
+pointer := A json string, RFC 6901 JSON pointer
 symbol_set := name ':' '{' symbol_def (',' symbol_def)* '}'
 symbol_def := name ':' value
 name := '"' (letter|'_') (letter | digit | '_')* '"'
@@ -93,9 +110,21 @@ files containing JSON arrays.
 
 import re
 import logging
+import collections
+import fnmatch
+import functools
+import itertools
+import typing
 # own imports
+import act.jsontext
+import act.pointer
 import act.sub
 
+# Reserved key in symbol definition file for interpolation scope.
+SCOPE_KEY = '$interpolate'
+# Regular expression for a symbol name.
+_R_NAME = r'[^\d\W]\w*'
+
 logger = logging.getLogger(__name__)
 
 
@@ -103,98 +132,524 @@ class Error(act.sub.Error):
     """Exceptions raised in this module are of this class."""
 
 
-class Symbols:  # pylint: disable=too-few-public-methods
+class SymbolIndex:
+    """Validated contents of one symbol definition file.
 
-    _R_NAME = r'[^\d\W]\w*'
+    Built once per symbol definition file (and again if the file changes) and
+    shared by all Symbols objects made from that file. Use SymbolIndex.get()
+    rather than the constructor.
+    The symbol dictionary for a set (globals overridden by the set's own
+    symbols) is resolved the first time it is asked for.
+    """
 
-    _read_json_cache = {}
+    _rx_name = re.compile('^' + _R_NAME + r'\Z')
 
-    def __init__(self, in_file, set_name=None):
-        self.sym2val = {}
-        self.replacement_counts = {}
-        self.names_not_in_dict = set()
-        self.set_names = set()
-        self._rx = re.compile(r'\$\{(' + self._R_NAME + r')\}', re.UNICODE)
-        self.source_file = act.sub.canonical(in_file)
-        k = self.source_file  # k is short hand for self.source_file
-        if k not in self._read_json_cache:
-            self._read_json_cache[k] = act.sub.read_json(in_file)
-        self._parse(self._read_json_cache[k], in_file, set_name)
+    _cache = {}
+
+    _generations = itertools.count()
 
-    def _parse(self, d, fname, set_name):
-        """Argument d is a read only reference (from a cache)."""
+    @classmethod
+    def get(cls, in_file):
+        """Returns the (cached) index for symbol definition file in_file."""
+        source_file = act.sub.canonical(in_file)
+        if (source_file not in cls._cache or cls._cache[source_file].signature
+                != act.sub.stat_signature(source_file)):
+            cls._cache[source_file] = cls(source_file)
+        else:
+            logger.debug('Symbol index cache hit : %s.', source_file)
+        return cls._cache[source_file]
+
+    def __init__(self, source_file):
+        self.source_file = source_file
+        # Tells symbol sets of different indexes apart, even for same file.
+        self.generation = next(self._generations)
+        self.signature = act.sub.stat_signature(source_file)
+        self.globals = {}
+        self.set_names = frozenset()
+        self.scope = None
+        self._sets = {}
+        self._resolved = {}
+        self._parse(act.sub.read_json(source_file), source_file)
+
+    def _parse(self, d, fname):
 
         def _check_name(n):
-            if rx.match(n) is None:
+            if self._rx_name.match(n) is None:
                 raise Error(
                     f'Symbol name {n} not an identifier in file {fname}.')
 
         if isinstance(d, list):
             raise Error(
                 f'Symbol definition file is a json array. File: {fname}.')
-        rx = re.compile('^' + self._R_NAME + r'\Z')
-        # first pass: globals and check everything
         for k in sorted(d.keys()):
+            if k == SCOPE_KEY:
+                self.scope = Scope.from_json(d[k], fname)
+                continue
             _check_name(k)
             if isinstance(d[k], str):
-                self.sym2val[k] = d[k]
-                self.replacement_counts[k] = 0
+                self.globals[k] = d[k]
             elif isinstance(d[k], dict):
-                self.set_names.add(k)
                 for j in sorted(d[k].keys()):
                     _check_name(j)
                     if not isinstance(d[k][j], str):
                         raise Error(
                             f'Invalid value for symbol {j} in set {k} in {fname}.'
                         )
+                self._sets[k] = d[k]
             else:
                 raise Error(f'Invalid value for symbol {k} in {fname}.')
-        if set_name and set_name not in self.set_names:
-            raise Error(
-                f'No symbol set "{set_name}" in symbol def file {fname}.')
-        #second pass: values redefined in symbol set override globals
-        for k in sorted(self.set_names):
-            if k == set_name:
-                for j in sorted(d[k].keys()):
-                    self.sym2val[j] = d[k][j]
-                    self.replacement_counts[j] = 0
-                break
-
-    def _repl(self, match_obj):
-        k = match_obj.group(1)
-        if k not in self.sym2val:
-            self.names_not_in_dict.add(k)
-            result = match_obj.group(0)
-        else:
-            result = self.sym2val[k]
-            self.replacement_counts[k] = self.replacement_counts[k] + 1
+        self.set_names = frozenset(self._sets)
+
+    def select(self, selector):
+        """Returns sorted list of symbol set names selected by selector.
+
+        Args:
+            selector: Comma separated list of symbol set names and glob 
+                patterns.
+
+        Raises:
+            Error if a name or pattern in selector selects no symbol set.
+        """
+        result = set()
+        for item in selector.split(','):
+            matches = [n for n in self.set_names if fnmatch.fnmatchcase(n, item)]
+            if not matches:
+                raise Error(f'No symbol set "{item}" in symbol def file '
+                            f'{self.source_file}.')
+            result.update(matches)
+        return sorted(result)
+
+    def resolve(self, set_name=None):
+        """Returns symbol to value dictionary for set_name. 
+        
+        Values redefined in symbol set override globals. If set_name is None,
+        the dictionary has global symbols only. The dictionary returned is 
+        shared, so treat it as read only.
+        """
+        if set_name not in self._resolved:
+            if set_name is None:
+                self._resolved[set_name] = self.globals
+            elif set_name not in self._sets:
+                raise Error(f'No symbol set "{set_name}" in symbol def file '
+                            f'{self.source_file}.')
+            else:
+                d = dict(self.globals)
+                d.update(self._sets[set_name])
+                self._resolved[set_name] = d
+        return self._resolved[set_name]
+
+
+class Scope:
+    """Where to interpolate in decoded JSON.
+
+    Given as lists of RFC 6901 JSON pointers to subtrees to include and to 
+    exclude. If include is None, everything not excluded is in scope.
+
+    While walking decoded JSON, where it is (in scope, out of scope, or 
+    undecided further down) is a value from root() or child().
+    """
+
+    # Marks a whole subtree in a tree of reference tokens.
+    _ALL = 'ALL'
+
+    # Where value for a subtree in which nothing is interpolated.
+    OUT = 'OUT'
+
+    def __init__(self, include=None, exclude=()):
+        self.include = include
+        self.exclude = list(exclude)
+        self._inc = self._ALL if include is None else self._tree(include)
+        self._exc = self._tree(self.exclude)
+
+    @classmethod
+    def from_json(cls, o, fname):
+        """Returns Scope from SCOPE_KEY value o in symbol def file fname."""
+        if not isinstance(o, dict) or set(o.keys()) - {'include', 'exclude'}:
+            raise Error(f'Value for {SCOPE_KEY} must be a JSON object with '
+                        f'keys "include" and/or "exclude" in {fname}.')
+        for k, v in o.items():
+            if not isinstance(v, list):
+                raise Error(f'Value for {SCOPE_KEY} key "{k}" must be a JSON '
+                            f'array of JSON pointers in {fname}.')
+            for p in v:
+                try:
+                    act.pointer.split_json_pointer(p)
+                except act.sub.Error as ex:
+                    raise Error(f'{ex} In {SCOPE_KEY} key "{k}" in '
+                                f'{fname}.') from ex
+        return cls(o.get('include'), o.get('exclude', []))
+
+    def as_json(self):
+        """Returns the SCOPE_KEY value this scope is made from."""
+        result = {'exclude': self.exclude}
+        if self.include is not None:
+            result['include'] = self.include
+        return result
+
+    @classmethod
+    def _tree(cls, pointers):
+        result = {}
+        for p in pointers:
+            tokens = act.pointer.split_json_pointer(p)
+            if not tokens:
+                return cls._ALL
+            node = result
+            for t in tokens[:-1]:
+                node = node.setdefault(t, {})
+                if node is cls._ALL:
+                    break
+            else:
+                node[tokens[-1]] = cls._ALL
         return result
 
+    def root(self):
+        """Returns where the root of the json is, see child()."""
+        if self._exc is self._ALL:
+            return self.OUT
+        return (self._inc, self._exc)
+
+    @classmethod
+    def child(cls, where, k):
+        """Returns where value k is, given where its container is."""
+        inc, exc = where
+        t = k if isinstance(k, str) else str(k)
+        if inc is not cls._ALL:
+            inc = inc.get(t)
+            if inc is None:
+                return cls.OUT
+        if exc:
+            exc = exc.get(t, {})
+            if exc is cls._ALL:
+                return cls.OUT
+        return (inc, exc)
+
+    @classmethod
+    def is_in(cls, where):
+        """True if all of where is in the scope."""
+        return where[0] is cls._ALL
+
+
+class Symbols:  # pylint: disable=too-few-public-methods
+    """Symbol values of one symbol set of a symbol definition file.
+
+    The values of set set_name override the global ones, set_name None is
+    for global symbols only. The validated file contents come from the
+    shared SymbolIndex of the file. interpolate() replaces symbol references
+    in decoded JSON, and counts what it replaced, see usage().
+    """
+
+    _rx = re.compile(r'\$\{(' + _R_NAME + r')\}', re.UNICODE)
+
+    def __init__(self, in_file, set_name=None):
+        index = SymbolIndex.get(in_file)
+        self.source_file = index.source_file
+        self.set_names = index.set_names
+        self.scope = index.scope
+        self.set_name = set_name or None
+        self.sym2val = index.resolve(self.set_name)
+        # Same for Symbols with the same values, until the file changes.
+        self.set_key = (index.generation, set_name or None)
+        self.replacement_counts = dict.fromkeys(self.sym2val, 0)
+        self.names_not_in_dict = set()
+
     def _replace(self, s):
-        return self._rx.sub(self._repl, s)
+        if '${' not in s:
+            return s
+        if _memo is None:
+            return self._substitute(_tokenize(s))
+        key = (self.set_key, s)
+        hit = _memo.get(key)
+        if hit is None:
+            tokens = _tokenize(s)
+            hit = (self._substitute(tokens), tokens)
+            _memo.put(key, hit)
+        else:
+            self._tally(hit[1])
+        return hit[0]
+
+    def _substitute(self, tokens):
+        """Returns the string tokens came from, with symbols replaced."""
+        sym2val = self.sym2val
+        result = list(tokens.parts)
+        result[1::2] = [
+            sym2val.get(k, p) for k, p in zip(tokens.names, tokens.placeholders)
+        ]
+        self._tally(tokens)
+        return ''.join(result)
+
+    def _tally(self, tokens):
+        for k, n in tokens.counts:
+            if k in self.sym2val:
+                self.replacement_counts[k] += n
+            else:
+                self.names_not_in_dict.add(k)
+
+    def usage(self):
+        """Returns what interpolation used so far, as a JSON friendly dict.
+
+        Keys: "symbols" symbol definition file, "set" symbol set name (None
+        for global symbols only), "used" symbol to value for symbols 
+        replaced at least once, "missing" sorted names of undefined symbols.
+        """
+        return {
+            'symbols': self.source_file,
+            'set': self.set_name,
+            'used': {
+                k: self.sym2val[k]
+                for k, n in sorted(self.replacement_counts.items())
+                if n
+            },
+            'missing': sorted(self.names_not_in_dict)
+        }
 
     def interpolate(self, jo):
         """Interpolate symbols in decoded JSON values. 
         
         Args: 
-            jo: Decoded JSON in which to interpolate symbols. 
+            jo: Decoded JSON in which to interpolate symbols, in place, within
+                the scope from the symbol definition file.
         """
+        Template(jo, self.scope).render_in_place(self)
+
+
+class _Tokens(typing.NamedTuple):
+    """A string split into literal parts and symbol references.
+
+    parts: literal, symbol name, literal, ..., symbol name, literal.
+    names: the symbol names, i.e. parts[1::2].
+    placeholders: '${name}' for each of names, kept if name is undefined.
+    counts: (name, number of references) pairs, one per distinct name.
+    """
+    parts: tuple
+    names: tuple
+    placeholders: tuple
+    counts: tuple
+
+
+@functools.lru_cache(maxsize=65536)
+def _tokenize(s):
+    parts = tuple(Symbols._rx.split(s))  # pylint: disable=protected-access
+    names = parts[1::2]
+    return _Tokens(parts, names, tuple('${' + k + '}' for k in names),
+                   tuple(collections.Counter(names).items()))
+
+
+class SubstitutionMemo:
+    """Bounded memo of interpolated strings, least recently used out first.
+
+    Keyed by symbol set and string to interpolate. The symbol references of
+    the string are kept with the result, so that replacement counts stay 
+    exact when the memo is hit.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._d = collections.OrderedDict()
+
+    def get(self, key):
+        """Returns the value memoized for key, or None."""
+        result = self._d.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._d.move_to_end(key)
+        return result
+
+    def put(self, key, value):
+        """Memoizes value for key, forgetting the least recently used."""
+        self._d[key] = value
+        if len(self._d) > self.maxsize:
+            self._d.popitem(last=False)
+
+    def stats(self):
+        """Returns dictionary of hits, misses, size and maxsize."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._d),
+            'maxsize': self.maxsize
+        }
+
+
+_memo = None
+
+
+def use_memo(maxsize):
+    """Memoize interpolated strings for all Symbols objects.
+
+    Args:
+        maxsize: Number of strings to remember. 0 or None turns memo off.
+
+    Returns:
+        The SubstitutionMemo, or None if turned off.
+    """
+    global _memo  # pylint: disable=global-statement
+    _memo = SubstitutionMemo(maxsize) if maxsize else None
+    return _memo
+
 
-        def f(k_or_i):
+def memo_size():
+    """Returns the maxsize use_memo() was last called with, 0 if off."""
+    return _memo.maxsize if _memo is not None else 0
+
+
+# Hits and misses of worker processes memos, see add_worker_memo_stats().
+_worker_memo_stats = collections.Counter()
+
+
+def take_memo_stats():
+    """Returns hits and misses of the memo since the last call, None if off.
+
+    For a worker process to return to add_worker_memo_stats().
+    """
+    if _memo is None:
+        return None
+    result = {'hits': _memo.hits, 'misses': _memo.misses}
+    _memo.hits = _memo.misses = 0
+    return result
+
+
+def add_worker_memo_stats(stats):
+    """Adds take_memo_stats() of a worker process to log_memo_stats()."""
+    if stats:
+        _worker_memo_stats.update(stats)
+
+
+def log_memo_stats():
+    """Logs hits and misses of the memo, then of worker processes' memos."""
+    if _memo is not None:
+        logger.info('Substitution memo statistics: %s.', _memo.stats())
+    if _worker_memo_stats:
+        logger.info('Substitution memo statistics of worker processes: %s.',
+                    dict(_worker_memo_stats))
+        _worker_memo_stats.clear()
+
+
+class Template:
+    """Decoded JSON with an index of the values in which to interpolate.
+
+    The constructor scans the JSON once for string values containing '${'
+    (the slots) and splits each into literal and symbol name parts. Rendering
+    the template for a set of symbols then visits only the slots. The template
+    is not modified by rendering, so render it as often as needed.
+    """
+
+    def __init__(self, jo, scope=None):
+        """Scans jo for slots, in scope only if scope is not None."""
+        self.jo = jo
+        self.slot_count = 0
+        # Nested dicts keyed like the JSON, down to the slots, which are
+        # the strings to interpolate.
+        self._slots = self._scan(jo, scope.root() if scope else None)
+        # JSON pointers to the slots. See slot_pointers().
+        self._pointers = None
+
+    def _scan(self, jo, where):
+        if isinstance(jo, list):
+            items = enumerate(jo)
+        elif isinstance(jo, dict):
+            items = jo.items()
+        else:
+            raise Error(f'This is not decoded JSON: jo={jo}.')
+        result = {}
+        if where is Scope.OUT:
+            return result
+        for k, v in items:
+            sub = None if where is None else Scope.child(where, k)
+            if sub is Scope.OUT:
+                continue
             if isinstance(v, str):
-                jo[k_or_i] = self._replace(v)
+                if (sub is None or Scope.is_in(sub)) and '${' in v and _tokenize(
+                        v).names:
+                    result[k] = v
+                    self.slot_count += 1
             elif isinstance(v, (dict, list)):
-                self.interpolate(v)
+                sub = self._scan(v, sub)
+                if sub:
+                    result[k] = sub
             elif not (v is None or isinstance(v, (bool, float, int))):
                 raise Error(
                     f'Strange type for decoded JSON. Type {type(v)}. Value {v}.'
                 )
+        return result
 
-        if isinstance(jo, list):
-            for i, v in enumerate(jo):
-                f(i)
-        elif isinstance(jo, dict):
-            for k, v in jo.items():
-                f(k)
-        else:
-            raise Error(f'This is not decoded JSON: jo={jo}.')
+    def render(self, symbols):
+        """Returns the JSON with symbols interpolated.
+
+        Only objects and arrays on the way to a slot are copied. Everything 
+        else is shared with the template, so treat the result as read only.
+
+        Args:
+            symbols: Symbols object. Its replacement counts are updated.
+        """
+        return self._render(self.jo, self._slots, symbols)
+
+    def render_in_place(self, symbols):
+        """Interpolates the slots of the template's JSON itself."""
+        self._render_in_place(self.jo, self._slots, symbols)
+
+    def _render_in_place(self, jo, slots, symbols):
+        for k, v in slots.items():
+            if isinstance(v, str):
+                # pylint: disable=protected-access
+                jo[k] = symbols._replace(v)
+            else:
+                self._render_in_place(jo[k], v, symbols)
+
+    def _render(self, jo, slots, symbols):
+        result = jo.copy()
+        for k, v in slots.items():
+            if isinstance(v, str):
+                # pylint: disable=protected-access
+                result[k] = symbols._replace(v)
+            else:
+                result[k] = self._render(jo[k], v, symbols)
+        return result
+
+    def slot_pointers(self):
+        """Returns list of JSON pointers to the slots."""
+        if self._pointers is None:
+            self._pointers = []
+            self._collect_pointers(self._slots, [])
+        return self._pointers
+
+    def _collect_pointers(self, slots, tokens):
+        for k, v in slots.items():
+            if isinstance(v, str):
+                self._pointers.append(act.jsontext.json_pointer(tokens + [k]))
+            else:
+                self._collect_pointers(v, tokens + [k])
+
+    def slot_values(self, jo):
+        """Returns list of the values of jo, a rendering of this template, at
+        the slots, in the order of slot_pointers()."""
+        result = []
+        self._collect_values(jo, self._slots, result)
+        return result
+
+    def _collect_values(self, jo, slots, result):
+        for k, v in slots.items():
+            if isinstance(v, str):
+                result.append(jo[k])
+            else:
+                self._collect_values(jo[k], v, result)
+
+    def patch(self, base, jo):
+        """Returns JSON Patch (RFC 6902) from one rendering to another.
+
+        Renderings only differ at the slots, so the patch has a "replace"
+        operation per slot with a different value. Apply it with
+        act.pointer.apply_patch().
+
+        Args:
+            base: slot_values() of the rendering to patch.
+            jo: Rendering of this template the patch gives.
+        """
+        result = []
+        for p, b, v in zip(self.slot_pointers(), base, self.slot_values(jo)):
+            if v != b:
+                result.append({'op': 'replace', 'path': p, 'value': v})
+        return result
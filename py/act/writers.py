@@ -0,0 +1,465 @@
+"""Write merge outputs: in the background, to an archive, to a content store,
+in a staging directory, and the files that list them.
+"""
+import concurrent.futures
+import ctypes
+import errno
+import hashlib
+import io
+import json
+import logging
+import os.path
+import shutil
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import uuid
+import warnings
+import zipfile
+# own imports
+import act.jsontext
+import act.sub
+
+logger = logging.getLogger(__name__)
+
+
+def write_manifest(fname, written, removed=(), base_dir=None):
+    """Writes a json object listing output files per what was done to them.
+
+    Args:
+        fname: Manifest file to write.
+        written: Dictionary output path -> act.sub.write_as_json() return
+            value.
+        removed: Paths of output files removed.
+        base_dir: Paths in manifest are relative to this directory. Default 
+            is the directory of fname.
+    """
+    if base_dir is None:
+        base_dir = os.path.dirname(os.path.abspath(fname))
+    o = {
+        k: [] for k in
+        [act.sub.WRITE_ADDED, act.sub.WRITE_CHANGED, act.sub.WRITE_UNCHANGED,
+         act.sub.MANIFEST_REMOVED]
+    }
+    for p, status in written.items():
+        o[status].append(p)
+    o[act.sub.MANIFEST_REMOVED].extend(removed)
+    for k, paths in o.items():
+        o[k] = sorted(
+            os.path.relpath(p, base_dir).replace('\\', '/') for p in paths)
+    act.sub.write_as_json(o, fname)
+
+
+def write_depfile(fname, targets, dependencies):
+    """Writes a Make depfile, as Make and Ninja read, of targets.
+
+    Args:
+        fname: Depfile to write.
+        targets: Paths of the files made.
+        dependencies: Paths of the files they are made from.
+
+    Returns:
+        act.sub.WRITE_ADDED, act.sub.WRITE_CHANGED or act.sub.WRITE_UNCHANGED.
+        An unchanged depfile is not rewritten.
+    """
+    lines = [' '.join(_make_escape(t) for t in targets) + ':']
+    lines.extend(' ' + _make_escape(p) for p in dependencies)
+    text = ' \\\n'.join(lines) + '\n'
+    return act.sub.replace_file(fname, lambda fp: fp.write(text))
+
+
+def _make_escape(path):
+    """Returns path escaped for a Make rule."""
+    return path.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+
+class BackgroundWriter:
+    """Writes merge outputs with act.sub.write_as_json() in a pool of threads.
+
+    Writes to the same path are done in the order they were requested. 
+    Requests wait while the estimated size of the json waiting to be written
+    exceeds the memory budget.
+    """
+
+    writes_files = True
+
+    def __init__(self, threads, memory_budget):
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='writer')
+        self._budget = memory_budget
+        self._pending = 0
+        self._cond = threading.Condition()
+        # Canonical path -> future of last write requested.
+        self._last = {}
+
+    def write(self, o, fname, size=0):
+        """Requests act.sub.write_as_json(o, fname). Do not modify o
+        afterwards.
+
+        Args:
+            size: Estimated memory size of o, in bytes.
+
+        Returns:
+            concurrent.futures.Future of act.sub.write_as_json() return
+            value.
+        """
+        key = act.sub.canonical(fname)
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending == 0 or self._pending +
+                                size <= self._budget)
+            self._pending += size
+            result = self._pool.submit(self._write, o, fname, size,
+                                       self._last.get(key))
+            self._last[key] = result
+        return result
+
+    def _write(self, o, fname, size, previous):
+        try:
+            if previous is not None:
+                # Started earlier, as the pool starts work in request order.
+                concurrent.futures.wait([previous])
+            return act.sub.write_as_json(o, fname, output=True)
+        finally:
+            with self._cond:
+                self._pending -= size
+                self._cond.notify_all()
+
+    def close(self):
+        """Waits until all requested writes are done."""
+        self._pool.shutdown(wait=True)
+        self._last.clear()
+
+
+class ArchiveWriter:
+    """Writes json files as members of a single archive file.
+
+    The archive format is given by the archive file name extension, see
+    act.sub.ARCHIVE_EXTS. A .jsonl archive has one line per member: a json
+    object with attributes "path", the member name, and "json", its json. The
+    members of .zip and .tar archives are as written by
+    act.sub.write_as_json().
+
+    Member names are file paths relative to a base directory, with "/"
+    separators. A name written again is added again, and the last one
+    wins, as when a .zip or .tar is extracted.
+
+    The archive is written to a temporary file renamed into place by close(),
+    or removed by discard(). Once discarded, no archive is written.
+    """
+
+    # Files are not written, so directories for them need not exist.
+    writes_files = False
+
+    def __init__(self, archive_path, base_dir):
+        self._path = archive_path
+        self._base_dir = base_dir
+        self._names = set()
+        self._tmp = act.sub.temp_path(archive_path)
+        self._discarded = False
+        lower = archive_path.lower()
+        self._jsonl = None
+        self._tar = None
+        self._zip = None
+        if lower.endswith('.jsonl'):
+            self._jsonl = open(self._tmp, 'x', encoding='utf-8')  # pylint: disable=consider-using-with
+        elif lower.endswith('.zip'):
+            self._zip = zipfile.ZipFile(self._tmp, 'x', zipfile.ZIP_DEFLATED)  # pylint: disable=consider-using-with
+        elif lower.endswith(('.tar.gz', '.tgz')):
+            self._tar = tarfile.open(self._tmp, 'x:gz')  # pylint: disable=consider-using-with
+        elif lower.endswith('.tar'):
+            self._tar = tarfile.open(self._tmp, 'x')  # pylint: disable=consider-using-with
+        else:
+            raise act.sub.Error(f'Archive file name {archive_path} does not '
+                                f'end with one of {act.sub.ARCHIVE_EXTS}.')
+
+    def write(self, o, fname, size=0):  # pylint: disable=unused-argument
+        """Adds o as member for path fname. Returns like
+        act.sub.write_as_json()."""
+        name = os.path.relpath(fname, self._base_dir).replace('\\', '/')
+        if self._discarded:
+            raise act.sub.Error(f'Archive {self._path} discarded, member '
+                                f'{name} not written.')
+        logger.info('Write json to archive member: %s.', name)
+        result = (act.sub.WRITE_CHANGED
+                  if name in self._names else act.sub.WRITE_ADDED)
+        self._names.add(name)
+        try:
+            if self._jsonl:
+                self._jsonl.write(
+                    json.dumps({
+                        'path': name,
+                        'json': o
+                    }, separators=(',', ':')))
+                self._jsonl.write('\n')
+                return result
+            fp = io.StringIO()
+            act.jsontext.dump_indented(o, fp)
+        except (TypeError, ValueError, RecursionError) as ex:
+            ex.add_note(f'{self._path} member {name}')
+            raise act.sub.Error(f'Exception writing json to {self._path} '
+                                f'member {name}.') from ex
+        data = fp.getvalue().encode('utf-8')
+        if self._zip:
+            with warnings.catch_warnings():
+                warnings.filterwarnings('ignore', 'Duplicate name')
+                self._zip.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+        return result
+
+    def close(self):
+        """Completes the archive, and renames it into place."""
+        if self._discarded:
+            logger.error('Archive %s not written, it was discarded.',
+                         self._path)
+            return
+        archive = self._jsonl or self._zip or self._tar
+        archive.close()
+        if act.sub.is_fsync():
+            with open(self._tmp, 'rb') as fp:
+                os.fsync(fp.fileno())
+        os.replace(self._tmp, self._path)
+        act.sub.sync_dir_later(self._path)
+        logger.info('Wrote %d members to archive %s.', len(self._names),
+                    self._path)
+
+    def discard(self):
+        """Closes and removes the incomplete archive."""
+        if not self._discarded:
+            self._discarded = True
+            (self._jsonl or self._zip or self._tar).close()
+            os.remove(self._tmp)
+            logger.info('Discarded archive %s.', self._path)
+
+
+class ContentStore:
+    """Directory of json files named by the hash of their content.
+
+    Output files are links to the files in the store, so identical outputs
+    are stored and written once. See use_store().
+    """
+
+    def __init__(self, store_dir, symlinks=False):
+        """Links are hard links, or symbolic links if symlinks."""
+        self.store_dir = act.sub.canonical(store_dir)
+        self.symlinks = symlinks
+
+    def path(self, digest):
+        """Returns path of the file in the store with sha256 hex digest."""
+        return os.path.join(self.store_dir, digest[:2],
+                            digest[2:] + act.sub.JSON_EXT)
+
+    def link(self, fname, write):
+        """Makes fname a link to the file in the store with the json text 
+        write(fp) writes, adding it to the store if new.
+
+        Returns:
+            act.sub.WRITE_ADDED, act.sub.WRITE_CHANGED or
+            act.sub.WRITE_UNCHANGED.
+        """
+        fp = io.StringIO()
+        write(fp)
+        data = fp.getvalue().encode('utf-8')
+        stored = self.path(hashlib.sha256(data).hexdigest())
+        if not os.path.isfile(stored):
+            logger.info('Add to store: %s.', stored)
+            os.makedirs(os.path.dirname(stored), exist_ok=True)
+            act.sub.replace_file(stored, lambda fp: fp.write(data), True)
+        target = stored
+        if self.symlinks:
+            target = os.path.relpath(
+                stored, os.path.dirname(act.sub.canonical(fname)))
+        result = act.sub.WRITE_ADDED
+        if os.path.lexists(fname):
+            if self._links_to(fname, stored, target):
+                logger.info('Unchanged: %s.', fname)
+                return act.sub.WRITE_UNCHANGED
+            result = act.sub.WRITE_CHANGED
+        tmp = act.sub.temp_path(fname)
+        if self.symlinks:
+            os.symlink(target, tmp)
+        else:
+            os.link(stored, tmp)
+        try:
+            os.replace(tmp, fname)
+        except OSError:
+            os.remove(tmp)
+            raise
+        act.sub.sync_dir_later(fname)
+        return result
+
+    def _links_to(self, fname, stored, target):
+        if self.symlinks:
+            return os.path.islink(fname) and os.readlink(fname) == target
+        return not os.path.islink(fname) and os.path.samefile(fname, stored)
+
+    @staticmethod
+    def report(paths):
+        """Returns dictionary of space and writes saved by links in paths.
+
+        Files in paths linked to the same file count as one file stored and
+        written.
+        """
+        stored = {}
+        size = 0
+        for p in paths:
+            st = os.stat(p)
+            stored[(st.st_dev, st.st_ino)] = st.st_size
+            size += st.st_size
+        stored_size = sum(stored.values())
+        return {
+            'outputs': len(paths),
+            'stored': len(stored),
+            'writes_saved': len(paths) - len(stored),
+            'bytes': size,
+            'bytes_stored': stored_size,
+            'bytes_saved': size - stored_size
+        }
+
+
+def log_store_report(paths):
+    """Logs ContentStore.report() of paths."""
+    r = ContentStore.report(sorted(paths))
+    logger.info(
+        'Store: %d outputs in %d stored files, %d writes saved. '
+        '%d bytes in %d stored, %d bytes saved.', r['outputs'], r['stored'],
+        r['writes_saved'], r['bytes'], r['bytes_stored'], r['bytes_saved'])
+    return r
+
+
+class StagingDir:
+    """Directory to build in, swapped into place when complete.
+
+    Readers of the target directory see its previous content until
+    commit(), then the new content, never partial content. The staging
+    directory is next to the target directory, so relative paths between
+    files in them are the same.
+    """
+
+    def __init__(self, target_dir):
+        self.target = act.sub.canonical(target_dir)
+        parent, name = os.path.split(self.target)
+        self.path = os.path.join(parent, f'.{name}.{uuid.uuid4()}')
+        logger.info('Build %s in staging directory %s.', self.target,
+                    self.path)
+        os.makedirs(self.path)
+
+    def target_path(self, path):
+        """Returns where path in the staging directory is after commit()."""
+        return os.path.join(
+            self.target, os.path.relpath(act.sub.canonical(path), self.path))
+
+    def staging_path(self, path):
+        """Returns where path in the target directory is in the staging 
+        directory."""
+        return os.path.join(
+            self.path, os.path.relpath(act.sub.canonical(path), self.target))
+
+    def commit(self):
+        """Swaps the staging directory into place.
+
+        The previous target directory is removed in the background, see
+        remove_tree_later().
+        """
+        if not os.path.exists(self.target):
+            os.rename(self.path, self.target)
+        else:
+            if not _exchange(self.path, self.target):
+                # Not atomic, the target is missing between the renames.
+                previous = os.path.join(
+                    os.path.dirname(self.target), str(uuid.uuid4()))
+                os.rename(self.target, previous)
+                os.rename(self.path, self.target)
+                self.path = previous
+            # The staging path has the previous target directory.
+            remove_tree_later(self.path)
+        act.sub.sync_dir_later(self.target)
+        logger.info('Swapped staging directory into place: %s.', self.target)
+
+    def discard(self):
+        """Removes the staging directory."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+# Linux renameat2() arguments.
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+
+
+def _exchange(path1, path2):
+    """Atomically exchanges what the paths are, returns False if the system
+    can not."""
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    renameat2.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+        ctypes.c_uint
+    ]
+    if renameat2(_AT_FDCWD, os.fsencode(path1), _AT_FDCWD, os.fsencode(path2),
+                 _RENAME_EXCHANGE) == 0:
+        return True
+    err = ctypes.get_errno()
+    if err in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+        return False
+    raise OSError(err, os.strerror(err), path1, None, path2)
+
+
+# Threads removing directory trees. See remove_tree_later().
+_removals = []
+# True if trees are removed by detached processes. See use_detached_removals().
+_detached_removals = False
+# Run by a detached process to remove the directory tree in argv[1].
+_REMOVE_TREE_CODE = ('import shutil, sys; '
+                     'shutil.rmtree(sys.argv[1], ignore_errors=True)')
+
+
+def use_detached_removals(detached):
+    """Sets whether remove_tree_later() hands trees to detached processes.
+
+    A program run from the command line sets it, so it exits without
+    waiting for the removal. Tests and other callers in the same process
+    leave it off, and can wait with wait_for_removals().
+    """
+    global _detached_removals  # pylint: disable=global-statement
+    _detached_removals = detached
+
+
+def remove_tree_later(dir_path):
+    """Removes directory tree dir_path in the background.
+
+    The tree is removed by a process in a new session if set by
+    use_detached_removals(), which outlives this process. Otherwise by a
+    thread: the process does not exit before it is done, see also
+    wait_for_removals().
+    """
+    logger.info('Remove in the background: %s.', dir_path)
+    if _detached_removals:
+        subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, '-c', _REMOVE_TREE_CODE, dir_path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True)
+        return
+    t = threading.Thread(target=shutil.rmtree,
+                         args=(dir_path,),
+                         kwargs={'ignore_errors': True},
+                         name='remove')
+    t.start()
+    _removals.append(t)
+
+
+def wait_for_removals():
+    """Waits until trees remove_tree_later() is removing are removed."""
+    while _removals:
+        _removals.pop().join()
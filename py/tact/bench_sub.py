@@ -0,0 +1,96 @@
+"""Benchmark of act.sub.write_as_json() against json.dump(o, fp, indent=4).
+
+Each timed write creates a new file, as rewriting a file with the same
+content only compares it; that is timed separately, as "unchanged".
+
+Not a unit test. Run from the py directory: python -m tact.bench_sub
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+# own imports
+import act.sub
+
+
+def _make(depth, width, leaf):
+    """Returns json object nested depth deep, width attributes per object."""
+    if depth == 0:
+        return leaf(width)
+    return {f'key{i}': _make(depth - 1, width, leaf) for i in range(width)}
+
+
+_SHAPES = {
+    # Like merged configuration files: objects of strings.
+    'strings': lambda w: {f'NAME_{i}': f'value ${{x}} {i}' for i in range(w)},
+    # Mixed primitives and small arrays.
+    'mixed': lambda w: {
+        'n': w,
+        'f': w / 3,
+        'b': True,
+        'z': None,
+        'a': [str(i) for i in range(w)],
+        's': 'é' * w
+    },
+}
+
+
+def _time(f, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _new_paths(d, prefix):
+    """Yields paths of files not yet in directory d."""
+    for i in itertools.count():
+        yield os.path.join(d, f'{prefix}{i}.json')
+
+
+def _json_dump(o, fname):
+    with open(fname, 'w', encoding='utf-8') as fp:
+        json.dump(o, fp, indent=4)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument('--depth', type=int, default=4)
+    p.add_argument('--width', type=int, default=10)
+    p.add_argument('--repeat', type=int, default=5)
+    args = p.parse_args()
+    d = tempfile.mkdtemp()
+    try:
+        for name, leaf in _SHAPES.items():
+            o = _make(args.depth, args.width, leaf)
+            old = os.path.join(d, f'{name}.old.json')
+            new = os.path.join(d, f'{name}.new.json')
+            paths = _new_paths(d, name)
+            t_old = _time(lambda: _json_dump(o, next(paths)), args.repeat)  # pylint: disable=cell-var-from-loop
+            t_new = _time(lambda: act.sub.write_as_json(o, next(paths)),  # pylint: disable=cell-var-from-loop
+                          args.repeat)
+            t_compact = _time(
+                lambda: act.sub.write_as_json(o, next(paths), compact=True),  # pylint: disable=cell-var-from-loop
+                args.repeat)
+            _json_dump(o, old)
+            act.sub.write_as_json(o, new)
+            t_unchanged = _time(lambda: act.sub.write_as_json(o, new),  # pylint: disable=cell-var-from-loop
+                                args.repeat)
+            with open(old, 'rb') as f_old, open(new, 'rb') as f_new:
+                same = f_old.read() == f_new.read()
+            print(f'{name:8} {os.path.getsize(old):>11,} bytes  '
+                  f'json.dump {t_old:.3f} s  write_as_json {t_new:.3f} s '
+                  f'({t_old / t_new:.1f}x)  compact {t_compact:.3f} s  '
+                  f'unchanged {t_unchanged:.3f} s  identical {same}')
+    finally:
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    main()
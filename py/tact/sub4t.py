@@ -361,6 +361,7 @@ class TestMergeallBase(JsonArrayIn):
         if self._testname.endswith('_d4s'):
             arg_v.append('--mode4symbols')
             arg_v.append('DIR')
+        arg_v.extend(self._td[self._testname].get('A', []))
         return (outdir, arg_v)
 
     def _validate(self, arg_outdir, actual_outdir):
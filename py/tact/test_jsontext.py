@@ -0,0 +1,56 @@
+"""Unit tests for jsontext.py.
+"""
+import unittest
+import io
+import json
+import logging
+# own imports
+import act.jsontext
+import tact.sub4t
+
+_LOG_LEVEL = logging.CRITICAL
+
+# Json to write, as decoded by json.loads() or built in python.
+_WRITE = {
+    'primitives': ['"a"', '1', '-1.5e300', 'true', 'false', 'null', '"é\\n"'],
+    'empty': ['{}', '[]', '{"a":{},"b":[],"c":[{}, []]}'],
+    'flat': ['{"a":1,"b":"x","c":null}', '[1,"x",2.5,true]'],
+    'nested': [
+        '{"a":{"b":{"c":[1,[2,{"d":"é"}]]}},"e":[{"f":1},"g"]}',
+        '[[[]],[{"a":[1]}],{"b":{}}]',
+        tact.sub4t.J45_DE,
+    ],
+}
+
+
+class TestDumpIndented(unittest.TestCase):
+    """Output must be the same as json.dump(o, fp, indent=4)."""
+
+    def _assert_same(self, o):
+        for ensure_ascii in [True, False]:
+            fp = io.StringIO()
+            act.jsontext.dump_indented(o, fp, ensure_ascii)
+            self.assertEqual(
+                json.dumps(o, indent=4, ensure_ascii=ensure_ascii),
+                fp.getvalue())
+
+    def test_json(self):
+        for k, v in _WRITE.items():
+            with self.subTest(k):
+                for s in v:
+                    self._assert_same(json.loads(s))
+
+    def test_python(self):
+        self._assert_same({1: (1, 2), None: float('nan'), 2.5: [-float('inf')]})
+        self._assert_same({True: {'a': ('b',)}, 'c': [(), {}]})
+
+    def test_errors(self):
+        for o, regex in [({'a': {1j: 1}}, 'keys must be'),
+                         ([1, {'a': {1j}}], 'not JSON serializable')]:
+            with self.assertRaisesRegex(TypeError, regex):
+                act.jsontext.dump_indented(o, io.StringIO())
+
+
+if __name__ == '__main__':
+    tact.sub4t.set_up_root_logging(_LOG_LEVEL)
+    unittest.main()
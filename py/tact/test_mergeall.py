@@ -1,8 +1,18 @@
 """Unit tests for mergeall.py.
 """
 import os
+import json
 import logging
+import tarfile
+import threading
+import time
+import zipfile
 # own imports
+import act.incremental
+import act.mergeall
+import act.mergetree
+import act.sub
+import act.writers
 import tact.sub4t
 
 _LOG_LEVEL = logging.INFO
@@ -19,6 +29,7 @@ _EXCLUDE_FNAME = os.path.normcase('mergeall.exclude.json')
 # O : (optional) output directory relative path. If present, resolved from
 #     parent dir of test's _root_dir and passed to mergeall.py as command line
 #     option --outdir.
+# A : (optional) list of more command line arguments for mergeall.py.
 #
 # Test Name suffix
 # _d4s => run mergeall.py with --mode4symbols DIR command line option.
@@ -301,6 +312,91 @@ _TD = {
             '{"ACT":{"QTY":"1.0","BUKRS":"1210","LEDGER_SETUP":"ALL"}}',
         ],
     },
+    'merge_once_render_many_d4s': {
+        # Nested objects merged from two files, rendered once per set. Each
+        # set must see the merged template, not another set's rendering.
+        'n': ['a.json', 'b.json', 'mergelist.json', 'symbols.json'],
+        'i': [
+            '{"o":{"p":"${x}","q":["${y}",{"r":"${x}${y}"}]},"s":"a"}',
+            '{"o":{"t":"${y}"},"s":"${x}"}',
+            '["a.json", "b.json", "symbols.json"]',
+            '{"S":{"x":"1"},"T":{"x":"2","y":"3"},"y":"0"}',
+        ],
+        'N': ['merged.json', 'S/merged.json', 'T/merged.json'],
+        'I': [
+            '{"o":{"p":"${x}","q":["0",{"r":"${x}0"}],"t":"0"},"s":"${x}"}',
+            '{"o":{"p":"1","q":["0",{"r":"10"}],"t":"0"},"s":"1"}',
+            '{"o":{"p":"2","q":["3",{"r":"23"}],"t":"3"},"s":"2"}',
+        ],
+    },
+    'memo_d4s': {
+        # Same strings in several merge lists, interpolated with a memo.
+        'n': [
+            'a.json', 'a.mergelist.json', 'b.mergelist.json', 'symbols.json'
+        ],
+        'i': [
+            '{"p":"${x}${y}","q":"${x}${y}"}',
+            '["a.json", "symbols.json"]',
+            '["a.json", "symbols.json"]',
+            '{"S":{"x":"1"},"T":{"x":"2"},"y":"0"}',
+        ],
+        'N': [
+            'a.merged.json', 'b.merged.json', 'S/a.merged.json',
+            'S/b.merged.json', 'T/a.merged.json', 'T/b.merged.json'
+        ],
+        'I': [
+            '{"p":"${x}0","q":"${x}0"}',
+            '{"p":"${x}0","q":"${x}0"}',
+            '{"p":"10","q":"10"}',
+            '{"p":"10","q":"10"}',
+            '{"p":"20","q":"20"}',
+            '{"p":"20","q":"20"}',
+        ],
+        'A': ['--memo_size', '2'],
+    },
+    'preinterpolate_d4s': {
+        # Shared base layer interpolated before merge, once per symbol set,
+        # with values overridden by the other layers and a scope.
+        'n': [
+            'base.json', 'a.json', 'a.mergelist.json', 'b.mergelist.json',
+            'symbols.json'
+        ],
+        'i': [
+            '{"o":{"p":"${x}","q":"${y}"},"r":["${x}"],"d":{"s":"${x}"}}',
+            '{"o":{"q":"a${x}"},"r":"${y}"}',
+            '["base.json", "a.json", "symbols.json"]',
+            '["base.json", "symbols.json"]',
+            '{"S":{"x":"1"},"T":{"x":"2"},"y":"0",'
+            '"$interpolate":{"exclude":["/d"]}}',
+        ],
+        'N': [
+            'a.merged.json', 'b.merged.json', 'S/a.merged.json',
+            'S/b.merged.json', 'T/a.merged.json', 'T/b.merged.json'
+        ],
+        'I': [
+            '{"o":{"p":"${x}","q":"a${x}"},"r":"0","d":{"s":"${x}"}}',
+            '{"o":{"p":"${x}","q":"0"},"r":["${x}"],"d":{"s":"${x}"}}',
+            '{"o":{"p":"1","q":"a1"},"r":"0","d":{"s":"${x}"}}',
+            '{"o":{"p":"1","q":"0"},"r":["1"],"d":{"s":"${x}"}}',
+            '{"o":{"p":"2","q":"a2"},"r":"0","d":{"s":"${x}"}}',
+            '{"o":{"p":"2","q":"0"},"r":["2"],"d":{"s":"${x}"}}',
+        ],
+        'A': ['--preinterpolate'],
+    },
+    'scope_d4s': {
+        # Interpolation scope from symbol definition file in DIR mode.
+        'n': ['a.json', 'mergelist.json', 'symbols.json'],
+        'i': [
+            '{"p":"${x}","data":{"q":"${x}"}}',
+            '["a.json", "symbols.json"]',
+            '{"$interpolate":{"exclude":["/data"]},"S":{"x":"1"},"x":"0"}',
+        ],
+        'N': ['merged.json', 'S/merged.json'],
+        'I': [
+            '{"p":"0","data":{"q":"${x}"}}',
+            '{"p":"1","data":{"q":"${x}"}}',
+        ],
+    },
     'symset_subdir_override_topdown_d4s': {
         # Test that would fail if mergelist paths were processed in
         # alphabetical and not top down order.
@@ -384,6 +480,401 @@ class TestMergeall(tact.sub4t.TestMergeallBase):
     def test_symset_subdir_override_topdown_d4s(self):
         self._doit()
 
+    def test_merge_once_render_many_d4s(self):
+        self._doit()
+
+    def test_memo_d4s(self):
+        self._doit()
+
+    def test_preinterpolate_d4s(self):
+        self._doit()
+
+    def test_scope_d4s(self):
+        self._doit()
+
+
+class TestMergeallWriters(TestMergeall):
+    """Same tests, outputs written by background threads."""
+
+    _CALL_STACK_FNAME_INDEX = 3
+
+    def _setup(self):
+        outdir, arg_v = super()._setup()
+        arg_v.extend(['--writers', '3', '--write_budget', '1'])
+        return (outdir, arg_v)
+
+
+class TestMergeallJobs(TestMergeall):
+    """Same tests, merge lists merged by a pool of processes."""
+
+    _CALL_STACK_FNAME_INDEX = 3
+
+    def _setup(self):
+        outdir, arg_v = super()._setup()
+        arg_v.extend(['--jobs', '3'])
+        return (outdir, arg_v)
+
+
+class TestMergeallSameForAnyJobs(tact.sub4t.TestMergeallBase):
+
+    _td = {
+        'same_outputs_and_errors_d4s': {
+            'n': [
+                'a.json', 'symbols.json', 'a.mergelist.json',
+                'S/a.mergelist.json', 'S/b.json', 'S/T/a.mergelist.json',
+                'b/bad.mergelist.json', 'c/' + _EXCLUDE_FNAME,
+                'c/c.mergelist.json'
+            ],
+            'i': [
+                '{"p":"${x}"}', '{"S":{"x":"1"},"T":{"x":"2"},"x":"0"}',
+                '["a.json","symbols.json"]', '["../a.json","b.json"]',
+                '{"q":1}', '["../../a.json","../../symbols.json"]',
+                '["missing.json"]', '["nothing.mergelist.json"]',
+                '["../a.json"]'
+            ],
+        },
+    }
+
+    _CALL_STACK_FNAME_INDEX = 1
+
+    def _run(self, arg_v, jobs):
+        outdir = os.path.join(self._root_dir, f'out{jobs}')
+        exceptions = act.mergeall.main(
+            arg_v + ['--outdir', outdir, '--jobs',
+                     str(jobs)])
+        outputs = {}
+        for dirpath, _, filenames in os.walk(outdir):
+            for f in filenames:
+                p = os.path.join(dirpath, f)
+                with open(p, 'rb') as fp:
+                    outputs[os.path.relpath(p, outdir)] = fp.read()
+        return ([str(ex) for ex in exceptions], outputs)
+
+    def test_same_outputs_and_errors_d4s(self):
+        _, arg_v = self._setup()
+        serial = self._run(arg_v, 1)
+        self.assertEqual(2, len(serial[0]))
+        # S/a.mergelist.json output overwrites the one for set S of
+        # a.mergelist.json.
+        self.assertEqual({'q': 1, 'p': '${x}'},
+                         json.loads(serial[1][os.path.join('S',
+                                                           'a.merged.json')]))
+        self.assertEqual({'p': '2'},
+                         json.loads(serial[1][os.path.join(
+                             'S', 'T', 'T', 'a.merged.json')]))
+        for jobs in [2, 4]:
+            self.assertEqual(serial, self._run(arg_v, jobs))
+
+
+class TestIncremental(tact.sub4t.TestMergeallBase):
+    """Test --incremental."""
+
+    _td = {
+        'same_as_clean_d4s': TestMergeallSameForAnyJobs._td[
+            'same_outputs_and_errors_d4s'],
+        'write_options': {
+            'n': ['a.json', 'a.mergelist.json'],
+            'i': ['{"p":{"q":{"r":1}}}', '["a.json"]'],
+        },
+    }
+
+    _CALL_STACK_FNAME_INDEX = 1
+
+    def _run(self, arg_v, outdir):
+        exceptions = act.mergeall.main(arg_v + ['--outdir', outdir])
+        outputs = {}
+        for dirpath, _, filenames in os.walk(outdir):
+            for f in filenames:
+                p = os.path.join(dirpath, f)
+                if f != act.incremental.DEPENDENCIES_FNAME:
+                    with open(p, 'rb') as fp:
+                        outputs[os.path.relpath(p, outdir)] = fp.read()
+        return ([str(ex) for ex in exceptions], outputs)
+
+    def _write(self, rel_path, text):
+        with open(os.path.join(self._input_base_dir, rel_path),
+                  'w',
+                  encoding='utf-8') as fp:
+            fp.write(text)
+
+    def test_write_options(self):
+        _, arg_v = self._setup()
+        outdir = os.path.join(self._root_dir, 'out')
+        arg_v += ['--outdir', outdir, '--incremental']
+        out = os.path.join(outdir, 'a.merged.json')
+        act.mergeall.main(arg_v + ['--index', '1'])
+        self.assertEqual(1, act.sub.read_json(out + act.sub.INDEX_EXT)['depth'])
+        act.mergeall.main(arg_v + ['--index', '3'])
+        self.assertEqual(3, act.sub.read_json(out + act.sub.INDEX_EXT)['depth'])
+        act.mergeall.main(arg_v + ['--index', '3', '--sidecar'])
+        self.assertTrue(os.path.isfile(out + act.sub.SIDECAR_EXT))
+        act.mergeall.main(arg_v)
+        self.assertEqual(
+            sorted(['a.merged.json', act.incremental.DEPENDENCIES_FNAME]),
+            sorted(os.listdir(outdir)))
+
+    def test_same_as_clean_d4s(self):
+        _, arg_v = self._setup()
+        in_dir = self._input_base_dir
+        for jobs in ['1', '2']:
+            outdir = os.path.join(self._root_dir, f'incremental{jobs}')
+            args = arg_v + ['--incremental', '--jobs', jobs]
+            clean = os.path.join(self._root_dir, 'clean')
+            self.assertEqual(self._run(arg_v, clean),
+                             self._run(args, outdir))
+            c_out = os.path.join(outdir, 'c', 'c.merged.json')
+            mtime_ns = os.stat(c_out).st_mtime_ns - 10**9
+            os.utime(c_out, ns=(mtime_ns, mtime_ns))
+            # Symbols change, S/T/a is gone, b/bad is fixed.
+            self._write('symbols.json', '{"S":{"x":"1"},"T":{"x":"3"}}')
+            self._write('b/bad.mergelist.json', '["../a.json"]')
+            os.rename(os.path.join(in_dir, 'S/T/a.mergelist.json'),
+                      os.path.join(in_dir, 'S/T/a.json'))
+            with self.assertLogs(act.mergeall.logger) as cm:
+                incremental = self._run(args, outdir)
+            self.assertIn('Merge 3 of 4 merge lists again.',
+                          [r.getMessage() for r in cm.records])
+            self.assertEqual(self._run(arg_v, clean),
+                             incremental)
+            self.assertEqual(1, len(incremental[0]))
+            self.assertNotIn(os.path.join('S', 'T', 'T', 'a.merged.json'),
+                             incremental[1])
+            self.assertEqual(mtime_ns, os.stat(c_out).st_mtime_ns)
+            # Nothing changed.
+            with self.assertLogs(act.mergeall.logger) as cm:
+                self.assertEqual(incremental, self._run(args, outdir))
+            self.assertIn('Merge 0 of 4 merge lists again.',
+                          [r.getMessage() for r in cm.records])
+            self.assertEqual(mtime_ns, os.stat(c_out).st_mtime_ns)
+            # Back to the start for the next number of jobs.
+            self._write('symbols.json', '{"S":{"x":"1"},"T":{"x":"2"},"x":"0"}')
+            self._write('b/bad.mergelist.json', '["missing.json"]')
+            os.rename(os.path.join(in_dir, 'S/T/a.json'),
+                      os.path.join(in_dir, 'S/T/a.mergelist.json'))
+
+
+class TestModeArgs4Dir(tact.sub4t.DirPerTest):
+
+    def test_longest_prefix(self):
+        self._testname_root_dir('longest_prefix')
+        for d in ['a/b/c', 'ab']:
+            os.makedirs(os.path.join(self._root_dir, d))
+        ma4d = act.mergetree.ModeArgs4Dir(self._root_dir, 'GLOBAL', None,
+                                          False)
+        ma4d.add(self._root_dir, 'DIR', None, False)
+        ma4d.add(os.path.join(self._root_dir, 'a'), 'FNAME', None, False)
+        ma4d.add(os.path.join(self._root_dir, 'a', 'b', 'c'), 'ERROR', None,
+                 False)
+        for d, mode in [('', 'DIR'), ('a', 'FNAME'), ('a/b', 'FNAME'),
+                        ('a/b/c', 'ERROR'), ('ab', 'DIR')]:
+            self.assertEqual(
+                mode,
+                ma4d.get(os.path.join(self._root_dir, d))[0], d)
+        with self.assertRaisesRegex(AssertionError, 'Key overwrite'):
+            ma4d.add(self._root_dir, 'IGNORE', None, False)
+        with self.assertRaisesRegex(AssertionError, 'No args'):
+            ma4d.get(os.path.dirname(self._root_dir))
+        self.assertEqual(('GLOBAL', None, False),
+                         act.mergetree.ModeArgs4Dir(os.sep, 'GLOBAL', None,
+                                                    False).get(self._root_dir))
+
+
+class TestDependencyGraph(tact.sub4t.TestMergeallBase):
+    """Test --depgraph and --deps_only."""
+
+    _td = {
+        'deps_only_d4s': TestMergeallSameForAnyJobs._td[
+            'same_outputs_and_errors_d4s'],
+    }
+
+    _CALL_STACK_FNAME_INDEX = 1
+
+    def test_deps_only_d4s(self):
+        _, arg_v = self._setup()
+        outdir = os.path.join(self._root_dir, 'out')
+        arg_v += ['--outdir', outdir]
+        depgraph = os.path.join(self._root_dir, 'deps.json')
+        exceptions = act.mergeall.main(
+            arg_v + ['--depgraph', depgraph, '--deps_only'])
+        self.assertEqual(2, len(exceptions))
+        self.assertFalse(os.path.exists(outdir))
+        graph = act.sub.read_json(depgraph)
+        in_dir = act.sub.canonical(self._input_base_dir)
+        self.assertEqual(
+            {
+                'mergelist': os.path.join(in_dir, 'S', 'T', 'a.mergelist.json'),
+                'target': os.path.join(act.sub.canonical(outdir), 'S', 'T',
+                                       'a.merged.json'),
+                'inputs': [
+                    os.path.join(in_dir, p) for p in
+                    ['S/T/a.mergelist.json', 'a.json', 'symbols.json']
+                ]
+            }, graph['mergelists'][2])
+        # bad.mergelist.json lists a missing file.
+        self.assertEqual(4, len(graph['mergelists']))
+        self.assertEqual(
+            os.path.join(in_dir, 'c', _EXCLUDE_FNAME),
+            graph['mergelists'][3]['inputs'][-1])
+        merged = os.path.join(self._root_dir, 'merged.json')
+        self.assertEqual(
+            2, len(act.mergeall.main(arg_v + ['--depgraph', merged])))
+        self.assertEqual(graph, act.sub.read_json(merged))
+
+
+class TestWatch(tact.sub4t.TestMergeallBase):
+    """Test --watch."""
+
+    _td = {
+        'rebuild': {
+            'n': ['a.json', 'a.mergelist.json', 'b.mergelist.json'],
+            'i': ['{"p":1}', '["a.json"]', '["../x.json"]'],
+            'A': ['--watch', '--poll', '0.01', '--debounce', '0.01'],
+        },
+        'own_files': {
+            'n': ['a.json', 'a.mergelist.json'],
+            'i': ['{"p":1}', '["a.json"]'],
+            'A': ['--watch', '--poll', '0.01', '--debounce', '0.01'],
+        },
+    }
+
+    _CALL_STACK_FNAME_INDEX = 1
+
+    def _wait_for(self, outdir, rel_path, o):
+        """Waits for output rel_path to be o, or gone if o is None."""
+        p = os.path.join(outdir, rel_path)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                if act.sub.read_json(p, logging.DEBUG) == o:
+                    return
+            except FileNotFoundError:
+                if o is None:
+                    return
+            except act.sub.Error:
+                pass
+            time.sleep(0.01)
+        self.fail(f'{p} is not {o}.')
+
+    def test_rebuild(self):
+        _, arg_v = self._setup()
+        # b merges a file outside the input directory.
+        x = os.path.join(self._root_dir, 'x.json')
+        with open(x, 'w', encoding='utf-8') as fp:
+            fp.write('{"q":1}')
+        outdir = os.path.join(self._root_dir, 'out')
+        stop = threading.Event()
+        returned = []
+        t = threading.Thread(target=lambda: returned.append(
+            act.mergeall.main(arg_v + ['--outdir', outdir], stop=stop)))
+        t.start()
+        self.addCleanup(t.join)
+        self.addCleanup(stop.set)
+        self._wait_for(outdir, 'b.merged.json', {'q': 1})
+        with open(x, 'w', encoding='utf-8') as fp:
+            fp.write('{"q":22}')
+        self._wait_for(outdir, 'b.merged.json', {'q': 22})
+        os.remove(os.path.join(self._input_base_dir, 'a.mergelist.json'))
+        self._wait_for(outdir, 'a.merged.json', None)
+        with open(os.path.join(self._input_base_dir, 'b.mergelist.json'),
+                  'w',
+                  encoding='utf-8') as fp:
+            fp.write('["missing.json"]')
+        self._wait_for(outdir, 'b.merged.json', None)
+        stop.set()
+        t.join()
+        self.assertEqual(1, len(returned[0]))
+        self.assertEqual([act.incremental.DEPENDENCIES_FNAME],
+                         os.listdir(outdir))
+
+    def test_own_files(self):
+        _, arg_v = self._setup()
+        # What a run writes in the input directory is not a change.
+        outdir = os.path.join(self._input_base_dir, 'out')
+        arg_v.extend([
+            '--outdir', outdir, '--manifest',
+            os.path.join(self._input_base_dir, 'manifest.json'), '--depgraph',
+            os.path.join(self._input_base_dir, 'graph.json')
+        ])
+        stop = threading.Event()
+        t = threading.Thread(
+            target=lambda: act.mergeall.main(arg_v, stop=stop))
+        with self.assertLogs(act.mergeall.logger, 'INFO') as cm:
+            t.start()
+            self.addCleanup(t.join)
+            self.addCleanup(stop.set)
+            self._wait_for(outdir, 'a.merged.json', {'p': 1})
+            time.sleep(0.3)
+            stop.set()
+            t.join()
+        self.assertEqual(
+            1, len([r for r in cm.records if r.msg.startswith('Watch run')]))
+
+
+class TestMergeallArchive(tact.sub4t.TestMergeallBase):
+    """Outputs in an archive. Extracted, they must be as in the directory."""
+
+    _td = {k: _TD[k] for k in ['fancy', 'symset_subdir_override_topdown_d4s']}
+    _td['preinterpolate_error_d4s'] = {
+        # Preinterpolated merge conflict while writing DIR mode outputs.
+        'n': [
+            'a.json', 'b.json', 'd.json', 'symbols.json', 'a.mergelist.json',
+            'c.mergelist.json'
+        ],
+        'i': [
+            '{"p":"${x}"}', '{"p":{"q":1}}', '{"r":1}',
+            '{"S":{"x":"1"},"x":"0"}', '["a.json", "b.json", "symbols.json"]',
+            '["a.json", "d.json", "symbols.json"]'
+        ],
+        'A': ['--preinterpolate'],
+    }
+
+    def _extract(self, archive, to_dir):
+        if archive.endswith('.zip'):
+            with zipfile.ZipFile(archive) as z:
+                z.extractall(to_dir)
+        elif archive.endswith('.jsonl'):
+            with open(archive, encoding='utf-8') as fp:
+                for line in fp:
+                    member = json.loads(line)
+                    p = os.path.join(to_dir, member['path'])
+                    os.makedirs(os.path.dirname(p), exist_ok=True)
+                    with open(p, 'w', encoding='utf-8') as fp_member:
+                        json.dump(member['json'], fp_member)
+        else:
+            with tarfile.open(archive) as t:
+                t.extractall(to_dir, filter='data')
+
+    def _doit(self):
+        outdir, arg_v = self._setup()
+        for ext in act.sub.ARCHIVE_EXTS:
+            archive = os.path.join(self._root_dir, 'archive' + ext)
+            a_actual_outdir = []
+            act.mergeall.main(arg_v + ['--archive', archive], a_actual_outdir)
+            self.assertFalse(os.path.exists(a_actual_outdir[0]))
+            extracted = os.path.join(self._root_dir, 'extracted' + ext)
+            self._extract(archive, extracted)
+            self._validate(outdir, extracted)
+
+    def test_fancy(self):
+        self._doit()
+
+    def test_symset_subdir_override_topdown_d4s(self):
+        self._doit()
+
+    def _doit_error(self):
+        # Members written before the failure stay in the archive.
+        _, arg_v = self._setup()
+        archive = os.path.join(self._root_dir, 'archive.zip')
+        self.assertEqual(
+            1, len(act.mergeall.main(arg_v + ['--archive', archive])))
+        with zipfile.ZipFile(archive) as z:
+            names = z.namelist()
+        self.assertIn('c.merged.json', names)
+        self.assertIn('S/c.merged.json', names)
+
+    def test_preinterpolate_error_d4s(self):
+        self._doit_error()
+
 
 class TestMergeallM4S(tact.sub4t.TestMergeallBase):
     """Test merge all with mode for symbols overridden in json files.
@@ -632,6 +1123,32 @@ class TestMergeallM4S(tact.sub4t.TestMergeallBase):
                 '{"p":"4"}',
             ],
         },
+        # Symbol set selector with glob pattern, no global symbols file.
+        'dir_selector': {
+            'M': 'DIR',
+            'S': 'S*,U',
+            'A': ['--no_globals'],
+            'n': ['a.json', 'mergelist.json', 'symbols.json'],
+            'i': [
+                '{"p":"${x}"}',
+                '["a.json", "symbols.json"]',
+                '{"S1":{"x":"1"},"S2":{"x":"2"},"T":{"x":"3"},"U":{"x":"4"}}',
+            ],
+            'N': ['S1/merged.json', 'S2/merged.json', 'U/merged.json'],
+            'I': ['{"p":"1"}', '{"p":"2"}', '{"p":"4"}'],
+        },
+        # NAMED mode with a list of symbol sets, from mergeall.args.json.
+        'named_selector': {
+            'n': ['a.json', 'mergelist.json', 'symbols.json', _MAJ_FNAME],
+            'i': [
+                '{"p":"${x}"}',
+                '["a.json", "symbols.json"]',
+                '{"S1":{"x":"1"},"S2":{"x":"2"},"T":{"x":"3"},"U":{"x":"4"}}',
+                '{"--mode4symbols":"NAMED", "--symset":"T,U"}',
+            ],
+            'N': ['T/merged.json', 'U/merged.json'],
+            'I': ['{"p":"3"}', '{"p":"4"}'],
+        },
     }
 
     _CALL_STACK_FNAME_INDEX = 3
@@ -664,6 +1181,292 @@ class TestMergeallM4S(tact.sub4t.TestMergeallBase):
     def test_d3_various(self):
         self._doit()
 
+    def test_dir_selector(self):
+        self._doit()
+
+    def test_named_selector(self):
+        self._doit()
+
+
+class TestMergeallM4SJobs(TestMergeallM4S):
+    """Same tests, merge lists merged by a pool of processes."""
+
+    _CALL_STACK_FNAME_INDEX = 4
+
+    def _setup(self):
+        outdir, arg_v = super()._setup()
+        arg_v.extend(['--jobs', '2'])
+        return (outdir, arg_v)
+
+
+class TestSymbolUsage(tact.sub4t.TestMergeallBase):
+    """Test --symbol_usage and --symbols_changed."""
+
+    _td = {
+        'targeted': {
+            'n': [
+                'a/x.json', 'a/symbols.json', 'a/mergelist.json', 'b/y.json',
+                'b/symbols.json', 'b/mergelist.json'
+            ],
+            'i': [
+                '{"p":"${v}"}',
+                '{"S":{"v":"1"},"T":{"v":"2"}}',
+                '["x.json", "symbols.json"]',
+                '{"q":"${w}"}',
+                '{"U":{"w":"3"}}',
+                '["y.json", "symbols.json"]',
+            ],
+            'A': ['--mode4symbols', 'DIR', '--symbol_usage'],
+        },
+        'write_options': {
+            'n': ['x.json', 'symbols.json', 'mergelist.json'],
+            'i': ['{"p":"${v}"}', '{"S":{"v":"1"}}', '["x.json", "symbols.json"]'],
+            'A': ['--mode4symbols', 'DIR', '--symbol_usage'],
+        },
+        'no_previous': {
+            'n': ['mergelist.json', 'z.json'],
+            'i': ['["z.json"]', '{"b":1}'],
+            'A': ['--symbols_changed'],
+        },
+    }
+
+    _CALL_STACK_FNAME_INDEX = 1
+
+    def _read(self, outdir, rel_path):
+        with open(os.path.join(outdir, rel_path), encoding='utf-8') as fp:
+            return fp.read()
+
+    def test_targeted(self):
+        _, arg_v = self._setup()
+        a_actual_outdir = []
+        act.mergeall.main(arg_v, a_actual_outdir)
+        outdir = a_actual_outdir[0]
+        before = {
+            p: os.stat(os.path.join(outdir, p)).st_mtime_ns
+            for p in ['a/T/merged.json', 'b/U/merged.json']
+        }
+        # Change a used symbol in a, add an unused one in b.
+        for p, v in [('a/symbols.json', '{"S":{"v":"1"},"T":{"v":"22"}}'),
+                     ('b/symbols.json', '{"U":{"w":"3","z":"4"}}')]:
+            with open(os.path.join(self._input_base_dir, p),
+                      'w',
+                      encoding='utf-8') as fp:
+                fp.write(v)
+        act.mergeall.main(arg_v + ['--symbols_changed'])
+        self.assertIn('"22"', self._read(outdir, 'a/T/merged.json'))
+        self.assertIn('"1"', self._read(outdir, 'a/S/merged.json'))
+        self.assertEqual(
+            before['b/U/merged.json'],
+            os.stat(os.path.join(outdir, 'b/U/merged.json')).st_mtime_ns)
+        usage = act.sub.read_json(
+            os.path.join(outdir, act.incremental.SYMBOL_USAGE_FNAME))
+        # Globals only output a/merged.json has v missing.
+        self.assertEqual(
+            ['a/S/merged.json', 'a/T/merged.json', 'a/merged.json'], [
+                os.path.normcase(p).replace(os.sep, '/')
+                for o in usage['symbols'].values()
+                for p in o.get('v', [])
+            ])
+
+    def test_write_options(self):
+        _, arg_v = self._setup()
+        a_actual_outdir = []
+        act.mergeall.main(arg_v, a_actual_outdir)
+        outdir = a_actual_outdir[0]
+        # No symbol changed, but outputs need sidecars now.
+        act.mergeall.main(arg_v + ['--symbols_changed', '--sidecar'])
+        for p in ['merged.json', 'S/merged.json']:
+            self.assertTrue(
+                os.path.isfile(os.path.join(outdir, p + act.sub.SIDECAR_EXT)))
+
+    def test_no_previous(self):
+        _, arg_v = self._setup()
+        with self.assertRaisesRegex(act.mergeall.Error, 'No mergeall.symbol'):
+            act.mergeall.main(arg_v)
+
+
+class TestKeepUnchanged(tact.sub4t.TestMergeallBase):
+    """Test --keep_unchanged and --manifest."""
+
+    _td = {
+        'delta': {
+            'n': [
+                'a.json', 'a.mergelist.json', 'b.mergelist.json',
+                'd/c.mergelist.json'
+            ],
+            'i': ['{"p":1}', '["a.json"]', '["a.json"]', '["../a.json"]'],
+            'A': ['--keep_unchanged'],
+        },
+        'bookkeeping': {
+            'n': ['a.json', 'a.mergelist.json'],
+            'i': ['{"p":1}', '["a.json"]'],
+            'A': ['--incremental', '--sidecar', '--index', '1'],
+        },
+        'staging': {
+            'n': ['a.json', 'a.mergelist.json', 'b.mergelist.json'],
+            'i': ['{"p":1}', '["a.json"]', '["a.json", "b.json"]'],
+        },
+    }
+
+    _CALL_STACK_FNAME_INDEX = 1
+
+    def test_bookkeeping(self):
+        _, arg_v = self._setup()
+        outdir = os.path.join(self._root_dir, 'out')
+        manifest = os.path.join(outdir, 'manifest.json')
+        arg_v.extend(['--outdir', outdir, '--manifest', manifest])
+        for _ in range(2):
+            act.mergeall.main(arg_v)
+        # Sidecars and indexes are for outputs only.
+        self.assertEqual(
+            sorted([
+                'a.merged.json', 'a.merged.json' + act.sub.SIDECAR_EXT,
+                'a.merged.json' + act.sub.INDEX_EXT, 'manifest.json',
+                act.incremental.DEPENDENCIES_FNAME
+            ]), sorted(os.listdir(outdir)))
+        self.assertEqual(
+            {
+                'added': [],
+                'changed': [],
+                'unchanged': ['a.merged.json'],
+                'removed': []
+            }, act.sub.read_json(manifest))
+
+    def test_staging(self):
+        _, arg_v = self._setup()
+        outdir = os.path.join(self._root_dir, 'out')
+        manifest = os.path.join(self._root_dir, 'manifest.json')
+        arg_v.extend(['--outdir', outdir, '--manifest', manifest])
+        b_json = os.path.join(self._input_base_dir, 'b.json')
+        for q in ['1', '1', '2']:
+            with open(b_json, 'w', encoding='utf-8') as fp:
+                fp.write(f'{{"q":{q}}}')
+            self.assertEqual([], act.mergeall.main(arg_v))
+        # Compared with the replaced output directory.
+        self.assertEqual(
+            {
+                'added': [],
+                'changed': ['b.merged.json'],
+                'unchanged': ['a.merged.json'],
+                'removed': []
+            }, act.sub.read_json(manifest))
+        os.remove(b_json)
+        act.mergeall.main(arg_v)
+        self.assertEqual(
+            {
+                'added': [],
+                'changed': [],
+                'unchanged': ['a.merged.json'],
+                'removed': ['b.merged.json']
+            }, act.sub.read_json(manifest))
+
+    def test_delta(self):
+        _, arg_v = self._setup()
+        manifest = os.path.join(self._root_dir, 'manifest.json')
+        arg_v.extend(['--manifest', manifest])
+        a_actual_outdir = []
+        act.mergeall.main(arg_v, a_actual_outdir)
+        outdir = a_actual_outdir[0]
+        self.assertEqual(
+            ['a.merged.json', 'b.merged.json', 'd/c.merged.json'],
+            act.sub.read_json(manifest)['added'])
+        a_out = os.path.join(outdir, 'a.merged.json')
+        mtime_ns = os.stat(a_out).st_mtime_ns - 10**9
+        os.utime(a_out, ns=(mtime_ns, mtime_ns))
+        # b changes, d/c is gone.
+        for p, v in [('b.mergelist.json', '["a.json", "b.json"]'),
+                     ('b.json', '{"q":2}')]:
+            with open(os.path.join(self._input_base_dir, p),
+                      'w',
+                      encoding='utf-8') as fp:
+                fp.write(v)
+        os.remove(os.path.join(self._input_base_dir, 'd/c.mergelist.json'))
+        act.mergeall.main(arg_v)
+        self.assertEqual(
+            {
+                'added': [],
+                'changed': ['b.merged.json'],
+                'unchanged': ['a.merged.json'],
+                'removed': ['d/c.merged.json']
+            }, act.sub.read_json(manifest))
+        self.assertEqual(mtime_ns, os.stat(a_out).st_mtime_ns)
+        self.assertEqual(['a.merged.json', 'b.merged.json'],
+                         sorted(os.listdir(outdir)))
+
+
+class TestStaging(tact.sub4t.TestMergeallBase):
+    """Output built in a staging directory swapped into place."""
+
+    _td = {
+        'replaced': {
+            'n': ['a.json', 'a.mergelist.json'],
+            'i': ['{"p":1}', '["a.json"]'],
+        },
+    }
+
+    _CALL_STACK_FNAME_INDEX = 1
+
+    def test_replaced(self):
+        _, arg_v = self._setup()
+        parent = os.path.join(self._root_dir, 'parent')
+        arg_v.extend(['--outdir', os.path.join(parent, 'out')])
+        for _ in range(2):
+            self.assertEqual([], act.mergeall.main(arg_v))
+            # The previous output directory is removed before main() returns.
+            self.assertEqual(['out'], os.listdir(parent))
+            self.assertEqual(['a.merged.json'],
+                             os.listdir(os.path.join(parent, 'out')))
+
+
+class TestContentStore(tact.sub4t.TestMergeallBase):
+    """Test --store."""
+
+    _td = {
+        'links': {
+            'n': [
+                'a.json', 'a.mergelist.json', 'b.mergelist.json',
+                'd/c.mergelist.json'
+            ],
+            'i': ['{"p":1}', '["a.json"]', '["a.json"]', '["../a.json"]'],
+            'A': ['--keep_unchanged'],
+        },
+    }
+
+    _CALL_STACK_FNAME_INDEX = 1
+
+    def test_links(self):
+        self.addCleanup(act.sub.use_store, None)
+        _, arg_v = self._setup()
+        for symlinks in [False, True]:
+            store = os.path.join(self._root_dir, f'store{symlinks}')
+            manifest = os.path.join(self._root_dir, 'manifest.json')
+            args = arg_v + ['--store', store, '--manifest', manifest]
+            if symlinks:
+                args.append('--symlinks')
+            a_actual_outdir = []
+            self.assertEqual([], act.mergeall.main(args, a_actual_outdir))
+            outdir = a_actual_outdir[0]
+            outputs = [
+                os.path.join(outdir, p)
+                for p in ['a.merged.json', 'b.merged.json', 'd/c.merged.json']
+            ]
+            self.assertEqual(
+                {
+                    'outputs': 3,
+                    'stored': 1,
+                    'writes_saved': 2,
+                    'bytes': 42,
+                    'bytes_stored': 14,
+                    'bytes_saved': 28
+                }, act.writers.ContentStore.report(outputs))
+            for p in outputs:
+                self.assertEqual(symlinks, os.path.islink(p))
+                self.assertEqual({'p': 1}, act.sub.read_json(p))
+            act.mergeall.main(args)
+            self.assertEqual(
+                ['a.merged.json', 'b.merged.json', 'd/c.merged.json'],
+                act.sub.read_json(manifest)['unchanged'])
+
 
 class TestMergeallExclude(tact.sub4t.TestMergeallBase):
 
@@ -2,13 +2,17 @@
 
 """
 import unittest
+import copy
 import os
 import json
 import inspect
 import logging
+import zipfile
 # own imports
 import act.mergejson
+import act.pointer
 import act.sub
+import act.writers
 import tact.sub4t
 
 _LOG_LEVEL = logging.CRITICAL
@@ -557,6 +561,368 @@ class TestMergelistInMergelist(tact.sub4t.TestMergelistBase):
         self._doit()
 
 
+class TestDirModeJobs(tact.sub4t.JsonArrayIn):
+
+    _td = {
+        'same_outputs': {
+            'n': ['a.json', 'symbols.json'],
+            'i': [
+                '{"p":"${x}","q":{"r":["${y}","${x}${y}"]},"s":1}',
+                '{"S":{"x":"1"},"T":{"x":"2","y":"3"},"U":{},"y":"0"}'
+            ],
+        },
+        'memo_in_workers': {
+            'n': ['a.json', 'symbols.json'],
+            'i': [
+                '{"p":"${x}","q":["${x}","${y}"]}',
+                '{"S":{"x":"1"},"T":{"x":"2","y":"3"},"y":"0"}'
+            ],
+        },
+        'all_or_nothing': {
+            'n': ['a.json', 'symbols.json'],
+            'i': ['{"p":"${x}"}', '{"S":{"x":"1"},"T":{"x":"2"},"U":{}}'],
+        },
+    }
+
+    def _outputs(self, infile, outdir, jobs):
+        os.makedirs(outdir)
+        outpaths = act.mergejson.merge(infile, os.path.join(outdir, 'm.json'),
+                                       act.sub.M4S_DIR, None,
+                                       act.mergejson.MergeOptions(jobs=jobs))
+        result = []
+        for p in outpaths:
+            with open(p, 'rb') as fp:
+                result.append((os.path.relpath(p, outdir), fp.read()))
+        return result
+
+    def test_same_outputs(self):
+        infile = self._set_up_Ddni_mergelist('same_outputs')
+        serial = self._outputs(infile, os.path.join(self._root_dir, 'j1'), 1)
+        parallel = self._outputs(infile, os.path.join(self._root_dir, 'j3'),
+                                 3)
+        self.assertEqual(4, len(serial))
+        self.assertEqual(serial, parallel)
+
+    def test_memo_in_workers(self):
+        infile = self._set_up_Ddni_mergelist('memo_in_workers')
+        act.symbols.use_memo(10)
+        self.addCleanup(act.symbols.use_memo, None)
+        self._outputs(infile, os.path.join(self._root_dir, 'j3'), 3)
+        with self.assertLogs(act.symbols.logger) as cm:
+            act.symbols.log_memo_stats()
+        worker_stats = [
+            r.args for r in cm.records if 'worker' in r.getMessage()
+        ]
+        # Globals, S and T render "${x}" twice: the second time is a hit.
+        self.assertEqual([{'hits': 3, 'misses': 6}], worker_stats)
+
+    def test_all_or_nothing(self):
+        infile = self._set_up_Ddni_mergelist('all_or_nothing')
+        for jobs in [1, 2]:
+            outdir = os.path.join(self._root_dir, f'j{jobs}')
+            # A directory where set T's output goes makes writing it fail.
+            os.makedirs(os.path.join(outdir, 'T', 'm.json'))
+            with self.assertRaises(OSError):
+                act.mergejson.merge(infile, os.path.join(outdir, 'm.json'),
+                                    act.sub.M4S_DIR, None,
+                                    act.mergejson.MergeOptions(jobs=jobs))
+            for p in ['m.json', 'S/m.json', 'U/m.json']:
+                self.assertFalse(os.path.exists(os.path.join(outdir, p)), p)
+
+    def test_background_write_error(self):
+        infile = self._set_up_Ddni_mergelist('all_or_nothing')
+        outdir = os.path.join(self._root_dir, 'w')
+        # Writing set T's output fails in a writer thread, then set U fails.
+        os.makedirs(os.path.join(outdir, 'T', 'm.json'))
+        writer = _FailingWriter(2, 100)
+        self.addCleanup(writer.close)
+        with self.assertLogs(act.mergejson.logger, 'ERROR'):
+            with self.assertRaises(act.sub.Error) as cm:
+                act.mergejson.merge(infile,
+                                    os.path.join(outdir, 'm.json'),
+                                    act.sub.M4S_DIR,
+                                    options=act.mergejson.MergeOptions(
+                                        writer=writer))
+        self.assertIn(os.path.join('T', 'm.json'), str(cm.exception))
+        self.assertIsInstance(cm.exception.__cause__, OSError)
+        for p in ['m.json', 'S/m.json']:
+            self.assertFalse(os.path.exists(os.path.join(outdir, p)), p)
+
+    def test_archive_error(self):
+        infile = self._set_up_Ddni_mergelist('all_or_nothing')
+        outdir = os.path.join(self._root_dir, 'a')
+        os.makedirs(outdir)
+        # Not written by the merge, so not removed when it fails.
+        with open(os.path.join(outdir, 'm.json'), 'w', encoding='utf-8'):
+            pass
+        archive_dir = os.path.join(self._root_dir, 'archive')
+        os.makedirs(archive_dir)
+        archive = os.path.join(archive_dir, 'a.zip')
+        writer = _FailingArchiveWriter(archive, outdir)
+        with self.assertRaises(act.sub.Error):
+            act.mergejson.merge(
+                infile, os.path.join(outdir, 'm.json'), act.sub.M4S_DIR,
+                options=act.mergejson.MergeOptions(writer=writer))
+        self.assertEqual(['m.json'], os.listdir(outdir))
+        # Later merges still write to the archive.
+        writer.write({}, os.path.join(outdir, 'n.json'))
+        writer.close()
+        with zipfile.ZipFile(archive) as z:
+            self.assertEqual(['S/m.json', 'T/m.json', 'm.json', 'n.json'],
+                             sorted(z.namelist()))
+
+
+class _FailingWriter(act.writers.BackgroundWriter):
+    """Fails requests to write set U's output."""
+
+    def write(self, o, fname, size=0):
+        if os.path.join('U', 'm.json') in fname:
+            raise act.sub.Error(f'Can not write {fname}.')
+        return super().write(o, fname, size)
+
+
+class _FailingArchiveWriter(act.writers.ArchiveWriter):
+    """Fails requests to write set U's output."""
+
+    def write(self, o, fname, size=0):
+        if os.path.join('U', 'm.json') in fname:
+            raise act.sub.Error(f'Can not write {fname}.')
+        return super().write(o, fname, size)
+
+
+class TestDependencies(tact.sub4t.JsonArrayIn):
+
+    _td = {
+        'outputs': {
+            'n': ['a.json', 'symbols.json'],
+            'i': ['{"p":"${x}"}', '{"S":{"x":"1"},"T":{"x":"2"},"x":"0"}'],
+        },
+        'depfile': {
+            'n': ['m.json', 'n.json', 'a b.json', 'symbols.json'],
+            'i': [
+                '["n.json", "a b.json", "symbols.json"]', '["a b.json"]',
+                '{"p":"${x}"}', '{"x":"1"}'
+            ],
+        },
+    }
+
+    def test_depfile(self):
+        m, n, ab, symbols = self._set_up_Ddni('depfile')
+        deps = act.mergejson.dependencies(m)
+        self.assertEqual([act.sub.canonical(p) for p in [m, n, ab, symbols]],
+                         deps)
+        depfile = os.path.join(self._root_dir, 'out.d')
+        self.assertEqual(act.sub.WRITE_ADDED,
+                         act.writers.write_depfile(depfile, ['out.json'], deps))
+        with open(depfile, encoding='utf-8') as fp:
+            lines = fp.read().splitlines()
+        self.assertEqual(['out.json: \\', ' ' + deps[0] + ' \\'], lines[:2])
+        self.assertEqual(' ' + deps[2].replace(' ', '\\ ') + ' \\', lines[3])
+        self.assertEqual(act.sub.WRITE_UNCHANGED,
+                         act.writers.write_depfile(depfile, ['out.json'], deps))
+
+    def test_depfile_targets(self):
+        self.assertEqual(['a.json', 'b.json'],
+                         act.mergejson.depfile_targets(['a.json', 'b.json']))
+        act.sub.use_sidecars(True)
+        act.sub.use_index(2)
+        try:
+            self.assertEqual([
+                'a.json', 'a.json' + act.sub.SIDECAR_EXT,
+                'a.json' + act.sub.INDEX_EXT
+            ], act.mergejson.depfile_targets({'a.json': None}))
+        finally:
+            act.sub.use_sidecars(False)
+            act.sub.use_index(0)
+
+    def test_outputs(self):
+        infile = self._set_up_Ddni_mergelist('outputs')
+        outdir = os.path.join(self._root_dir, 'out')
+        os.makedirs(outdir)
+        outfile = os.path.join(outdir, 'm.json')
+        for mode, symset, no_globals, delta in [
+            (act.sub.M4S_DIR, None, False, None),
+            (act.sub.M4S_DIR, 'T', True, None),
+            (act.sub.M4S_DIR, None, False, act.sub.DELTA_WITH_FULL),
+            (act.sub.M4S_DIR, None, False, act.sub.DELTA_ONLY),
+            (act.sub.M4S_NAMED, 'S,T', False, None),
+            (act.sub.M4S_NAMED, 'S', False, None),
+        ]:
+            written = {}
+            act.mergejson.merge(
+                infile, outfile, mode, symset,
+                act.mergejson.MergeOptions(no_globals=no_globals,
+                                           written=written,
+                                           delta=delta))
+            self.assertEqual(
+                list(written),
+                act.mergejson.outputs(
+                    infile, outfile, mode, symset,
+                    act.mergejson.MergeOptions(no_globals=no_globals,
+                                               delta=delta)))
+
+
+class TestDelta(tact.sub4t.JsonArrayIn):
+
+    _td = {
+        'apply': {
+            'n': ['a.json', 'symbols.json'],
+            'i': [
+                '{"p":"${x}","q":{"r":["${y}","${x}${y}"],"/~":"${y}"},"s":1}',
+                '{"S":{"x":"1"},"T":{"x":"2","y":"3"},"U":{},"y":"0"}'
+            ],
+        },
+    }
+
+    def test_apply(self):
+        infile = self._set_up_Ddni_mergelist('apply')
+        full_dir = os.path.join(self._root_dir, 'full')
+        os.makedirs(full_dir)
+        full = act.mergejson.merge(infile, os.path.join(full_dir, 'm.json'),
+                                   act.sub.M4S_DIR)
+        for delta, jobs in [(act.sub.DELTA_ONLY, 1), (act.sub.DELTA_ONLY, 2),
+                            (act.sub.DELTA_WITH_FULL, 1)]:
+            d = os.path.join(self._root_dir, f'{delta}{jobs}')
+            os.makedirs(d)
+            written = {}
+            outpaths = act.mergejson.merge(
+                infile, os.path.join(d, 'm.json'), act.sub.M4S_DIR,
+                options=act.mergejson.MergeOptions(
+                    jobs=jobs, written=written, delta=delta))
+            self.assertEqual(sorted(outpaths), sorted(written))
+            base = act.sub.read_json(os.path.join(d, 'm.json'))
+            self.assertEqual(act.sub.read_json(full[0]), base)
+            for f in full[1:]:
+                rel = os.path.relpath(f, full_dir)
+                patch = act.sub.read_json(
+                    os.path.join(d, rel + act.sub.DELTA_EXT))
+                self.assertEqual(
+                    act.sub.read_json(f),
+                    act.pointer.apply_patch(copy.deepcopy(base), patch))
+                self.assertEqual(delta == act.sub.DELTA_WITH_FULL,
+                                 os.path.exists(os.path.join(d, rel)))
+        # Set U interpolates as globals do.
+        self.assertEqual([],
+                         act.sub.read_json(
+                             os.path.join(d, 'U', 'm.json' +
+                                          act.sub.DELTA_EXT)))
+        with self.assertRaisesRegex(act.mergejson.Error, 'no_globals'):
+            act.mergejson.merge(
+                infile, os.path.join(d, 'm.json'), act.sub.M4S_DIR,
+                options=act.mergejson.MergeOptions(
+                    no_globals=True, delta=act.sub.DELTA_ONLY))
+
+    def test_worker_error(self):
+        infile = self._set_up_Ddni_mergelist('apply')
+        # Set T's worker writes its full output, then fails writing the patch.
+        os.makedirs(os.path.join(self._root_dir, 'T',
+                                 'm.json' + act.sub.DELTA_EXT))
+        with self.assertRaises(OSError):
+            act.mergejson.merge(
+                infile, os.path.join(self._root_dir, 'm.json'),
+                act.sub.M4S_DIR,
+                options=act.mergejson.MergeOptions(
+                    jobs=2, delta=act.sub.DELTA_WITH_FULL))
+        for p in ['m.json', 'S/m.json', 'T/m.json', 'U/m.json']:
+            self.assertFalse(os.path.exists(os.path.join(self._root_dir, p)),
+                             p)
+
+    def test_apply_patch(self):
+        o = {'a': [1, {'b': 2}], 'c': 'd'}
+        self.assertEqual({
+            'a': [1, {
+                'b': 3
+            }],
+            'c': 'e'
+        },
+                         act.pointer.apply_patch(o, [{
+                             'op': 'replace',
+                             'path': '/a/1/b',
+                             'value': 3
+                         }, {
+                             'op': 'replace',
+                             'path': '/c',
+                             'value': 'e'
+                         }]))
+        for op in [{
+                'op': 'replace',
+                'path': '/a/2',
+                'value': 0
+        }, {
+                'op': 'replace',
+                'path': '/x',
+                'value': 0
+        }, {
+                'op': 'add',
+                'path': '/x',
+                'value': 0
+        }]:
+            with self.assertRaises(act.sub.Error):
+                act.pointer.apply_patch(o, [op])
+
+
+class TestPreinterpolate(tact.sub4t.JsonArrayIn):
+
+    _td = {
+        'same_outputs': {
+            'n': ['a.json', 'b.json', 'symbols.json'],
+            'i': [
+                '{"p":"${x}","q":{"r":["${y}"],"s":"${x}"},"t":{"u":1}}',
+                '{"q":{"r":"${x}","v":"${y}"},"t":{"u":"${y}"}}',
+                '{"S":{"x":"1"},"T":{"x":"2","y":"3"},"y":"0"}'
+            ],
+        },
+    }
+    _td['cache_bound'] = _td['same_outputs']
+
+    def _outputs(self, infile, outdir, preinterpolate):
+        result = []
+        for args in [(act.sub.M4S_NAMED, 'T'), (act.sub.M4S_DIR, None)]:
+            d = os.path.join(outdir, args[0])
+            os.makedirs(d)
+            outpaths = act.mergejson.merge(
+                infile, os.path.join(d, 'm.json'), *args,
+                act.mergejson.MergeOptions(preinterpolate=preinterpolate))
+            if isinstance(outpaths, str):
+                outpaths = [outpaths]
+            for p in outpaths:
+                with open(p, 'rb') as fp:
+                    result.append((os.path.relpath(p, outdir), fp.read()))
+        return result
+
+    def test_same_outputs(self):
+        infile = self._set_up_Ddni_mergelist('same_outputs')
+        post = self._outputs(infile, os.path.join(self._root_dir, 'post'),
+                             False)
+        pre = self._outputs(infile, os.path.join(self._root_dir, 'pre'), True)
+        self.assertEqual(4, len(post))
+        self.assertEqual(post, pre)
+        # Cached files are not modified by merge, and are read again if
+        # changed.
+        again = self._outputs(infile, os.path.join(self._root_dir, 'again'),
+                              True)
+        self.assertEqual(pre, again)
+        with open(os.path.join(self._root_dir, 'a.json'), 'w',
+                  encoding='utf-8') as fp:
+            fp.write('{"p":"${x}${x}"}')
+        changed = self._outputs(infile, os.path.join(self._root_dir, 'changed'),
+                                True)
+        self.assertEqual('22', json.loads(changed[0][1])['p'])
+
+    def test_cache_bound(self):
+        infile = self._set_up_Ddni_mergelist('cache_bound')
+        size = act.mergejson._PREINTERPOLATED_CACHE_SIZE
+        self.addCleanup(setattr, act.mergejson, '_PREINTERPOLATED_CACHE_SIZE',
+                        size)
+        act.mergejson._PREINTERPOLATED_CACHE_SIZE = 2
+        act.mergejson._preinterpolated_cache.clear()
+        post = self._outputs(infile, os.path.join(self._root_dir, 'post'),
+                             False)
+        pre = self._outputs(infile, os.path.join(self._root_dir, 'pre'), True)
+        self.assertEqual(post, pre)
+        self.assertEqual(2, len(act.mergejson._preinterpolated_cache))
+
+
 if __name__ == '__main__':
     tact.sub4t.set_up_root_logging(_LOG_LEVEL)
     act.mergejson.logger.setLevel(_LOG_LEVEL)
@@ -0,0 +1,97 @@
+"""Unit tests for pointer.py.
+"""
+import unittest
+import os
+import logging
+# own imports
+import act.jsontext
+import act.pointer
+import act.sub
+import tact.sub4t
+
+_LOG_LEVEL = logging.CRITICAL
+
+
+class TestJsonPointerIndex(tact.sub4t.DirPerTest):
+
+    def setUp(self):
+        super().setUp()
+        act.sub.use_index(2)
+
+    def tearDown(self):
+        act.sub.use_index(0)
+        super().tearDown()
+
+    def test_read_json_pointer(self):
+        self._testname_root_dir('read_json_pointer')
+        o = {'a': {'b': [1, {'c': 'é'}], 'x~/': 2}, 'e': [], 'é': 'ü'}
+        pointers = ['', '/a', '/a/b', '/a/x~0~1', '/e', '/é']
+        p = os.path.join(self._root_dir, 'index.json')
+        for compact in [True, False]:
+            for ensure_ascii in [True, False]:
+                act.sub.write_as_json(o, p, compact, ensure_ascii, output=True)
+                index = act.sub.read_json(p + act.sub.INDEX_EXT)
+                self.assertEqual(pointers, list(index['pointers']))
+                for ptr, v in [('', o), ('/a/b', o['a']['b']),
+                               ('/a/b/1/c', 'é'), ('/a/x~0~1', 2),
+                               ('/e', []), ('/é', 'ü')]:
+                    self.assertEqual(
+                        v, act.pointer.read_json_pointer(p, ptr, True))
+                for ptr in ['/z', '/a/b/2', '/a/b/01', '/a/b/0/c']:
+                    with self.assertRaisesRegex(act.sub.Error, 'No value'):
+                        act.pointer.read_json_pointer(p, ptr)
+
+    def test_out_of_date(self):
+        self._testname_root_dir('out_of_date')
+        p = os.path.join(self._root_dir, 'index.json')
+        act.sub.write_as_json({'a': [1, 2], 'b': 3}, p, output=True)
+        with open(p, 'w', encoding='utf-8') as fp:
+            fp.write('{"a": 1}')
+        self.assertEqual(1, act.pointer.read_json_pointer(p, '/a'))
+        with self.assertRaisesRegex(act.sub.Error, 'No value'):
+            act.pointer.read_json_pointer(p, '/b')
+
+    def test_same_size(self):
+        self._testname_root_dir('same_size')
+        p = os.path.join(self._root_dir, 'index.json')
+        act.sub.write_as_json({'a': 10, 'b': 2}, p, output=True)
+        st = os.stat(p)
+        with open(p, 'w', encoding='utf-8') as fp:
+            act.jsontext.dump_indented({'b': 10, 'a': 2}, fp)
+        self.assertEqual(st.st_size, os.path.getsize(p))
+        os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertEqual(2, act.pointer.read_json_pointer(p, '/a'))
+
+    def test_span_mismatch(self):
+        self._testname_root_dir('span_mismatch')
+        p = os.path.join(self._root_dir, 'index.json')
+        act.sub.write_as_json({'a': [1, 2]}, p, output=True)
+        index = act.sub.read_json(p + act.sub.INDEX_EXT)
+        index['pointers']['/a'] = [0, 3]
+        act.sub.write_as_json(index, p + act.sub.INDEX_EXT)
+        self.assertEqual([1, 2], act.pointer.read_json_pointer(p, '/a'))
+        with open(p, 'w', encoding='utf-8') as fp:
+            fp.write('{"a": ')
+        with self.assertRaisesRegex(act.sub.Error, 'Exception reading'):
+            act.pointer.read_json_pointer(p, '/a')
+
+    def test_stale_companions(self):
+        self._testname_root_dir('stale_companions')
+        p = os.path.join(self._root_dir, 'index.json')
+        act.sub.use_sidecars(True)
+        try:
+            act.sub.write_as_json({'a': 1}, p, output=True)
+        finally:
+            act.sub.use_sidecars(False)
+        self.assertEqual(
+            sorted(['index.json', 'index.json' + act.sub.SIDECAR_EXT,
+                    'index.json' + act.sub.INDEX_EXT]),
+            sorted(os.listdir(self._root_dir)))
+        act.sub.use_index(0)
+        act.sub.write_as_json({'a': 1}, p, output=True)
+        self.assertEqual(['index.json'], os.listdir(self._root_dir))
+
+
+if __name__ == '__main__':
+    tact.sub4t.set_up_root_logging(_LOG_LEVEL)
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Unit tests for sidecar.py.
+"""
+import unittest
+import os
+import json
+import logging
+# own imports
+import act.sidecar
+import act.sub
+import tact.sub4t
+
+_LOG_LEVEL = logging.CRITICAL
+
+
+class TestSidecar(tact.sub4t.DirPerTest):
+
+    def setUp(self):
+        super().setUp()
+        act.sub.use_sidecars(True)
+
+    def tearDown(self):
+        act.sub.use_sidecars(False)
+        super().tearDown()
+
+    def _write(self, name, o):
+        self._testname_root_dir(name)
+        p = os.path.join(self._root_dir, name + '.json')
+        act.sub.write_as_json(o, p, output=True)
+        return p
+
+    def test_load(self):
+        o = json.loads(tact.sub4t.J45_DE)
+        p = self._write('load', o)
+        self.assertEqual(['load.json', 'load.json' + act.sub.SIDECAR_EXT],
+                         sorted(os.listdir(self._root_dir)))
+        digest, from_sidecar = act.sidecar.read(p + act.sub.SIDECAR_EXT)
+        self.assertEqual(act.sub.file_digest(p), digest)
+        self.assertEqual(o, from_sidecar)
+        self.assertEqual(o, act.sidecar.load(p))
+
+    def test_out_of_date(self):
+        p = self._write('out_of_date', {'a': 1})
+        with open(p, 'w', encoding='utf-8') as fp:
+            fp.write('{"a": 2}')
+        self.assertEqual({'a': 2}, act.sidecar.load(p))
+        self.assertEqual({'a': 1}, act.sidecar.load(p, verify=False))
+        os.remove(p + act.sub.SIDECAR_EXT)
+        self.assertEqual({'a': 2}, act.sidecar.load(p))
+
+    def test_unchanged(self):
+        p = self._write('unchanged', [1])
+        sidecar = p + act.sub.SIDECAR_EXT
+        mtime_ns = os.stat(sidecar).st_mtime_ns - 10**9
+        os.utime(sidecar, ns=(mtime_ns, mtime_ns))
+        act.sub.write_as_json([1], p, output=True)
+        self.assertEqual(mtime_ns, os.stat(sidecar).st_mtime_ns)
+        act.sub.write_as_json([2], p, output=True)
+        self.assertEqual([2], act.sidecar.read(sidecar)[1])
+
+    def test_not_a_sidecar(self):
+        p = self._write('not_a_sidecar', [1])
+        with open(p + act.sub.SIDECAR_EXT, 'wb') as fp:
+            fp.write(b'{"a": 1}' * 8)
+        with self.assertRaisesRegex(act.sidecar.Error, 'Not a sidecar'):
+            act.sidecar.read(p + act.sub.SIDECAR_EXT)
+        self.assertEqual([1], act.sidecar.load(p))
+
+
+if __name__ == '__main__':
+    tact.sub4t.set_up_root_logging(_LOG_LEVEL)
+    unittest.main()
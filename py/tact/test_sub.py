@@ -0,0 +1,116 @@
+"""Unit tests for sub.py.
+"""
+import unittest
+import concurrent.futures
+import multiprocessing
+import os
+import logging
+import stat
+# own imports
+import act.sub
+import act.writers
+import tact.sub4t
+
+_LOG_LEVEL = logging.CRITICAL
+
+
+class TestWriteAsJson(tact.sub4t.DirPerTest):
+
+    def test_compact(self):
+        self._testname_root_dir('compact')
+        p = os.path.join(self._root_dir, 'compact.json')
+        act.sub.write_as_json({'a': [1, 'é']},
+                              p,
+                              compact=True,
+                              ensure_ascii=False)
+        with open(p, encoding='utf-8') as fp:
+            self.assertEqual('{"a":[1,"é"]}', fp.read())
+
+    def test_unchanged(self):
+        self._testname_root_dir('unchanged')
+        p = os.path.join(self._root_dir, 'unchanged.json')
+        self.assertEqual(act.sub.WRITE_ADDED, act.sub.write_as_json([1], p))
+        mtime_ns = os.stat(p).st_mtime_ns
+        os.utime(p, ns=(mtime_ns - 10**9, mtime_ns - 10**9))
+        self.assertEqual(act.sub.WRITE_UNCHANGED,
+                         act.sub.write_as_json([1], p))
+        self.assertEqual(mtime_ns - 10**9, os.stat(p).st_mtime_ns)
+        self.assertEqual(act.sub.WRITE_CHANGED, act.sub.write_as_json([2], p))
+        self.assertEqual(['unchanged.json'], os.listdir(self._root_dir))
+
+    def test_mode(self):
+        self._testname_root_dir('mode')
+        p = os.path.join(self._root_dir, 'mode.json')
+        act.sub.write_as_json([1], p)
+        os.chmod(p, 0o640)
+        self.assertEqual(act.sub.WRITE_CHANGED, act.sub.write_as_json([2], p))
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(p).st_mode))
+
+    def test_manifest(self):
+        self._testname_root_dir('manifest')
+        p = os.path.join(self._root_dir, 'manifest.json')
+        act.writers.write_manifest(
+            p, {
+                os.path.join(self._root_dir, 'b', 'x.json'):
+                    act.sub.WRITE_ADDED,
+                os.path.join(self._root_dir, 'a.json'): act.sub.WRITE_ADDED,
+                os.path.join(self._root_dir, 'c.json'): act.sub.WRITE_UNCHANGED
+            }, [os.path.join(self._root_dir, 'd.json')])
+        self.assertEqual(
+            {
+                'added': ['a.json', 'b/x.json'],
+                'changed': [],
+                'unchanged': ['c.json'],
+                'removed': ['d.json']
+            }, act.sub.read_json(p))
+
+    def test_error_leaves_file_as_was(self):
+        self._testname_root_dir('error_leaves_file_as_was')
+        p = os.path.join(self._root_dir, 'error.json')
+        act.sub.write_as_json({'a': 1}, p)
+        with self.assertRaisesRegex(act.sub.Error, 'Exception writing json'):
+            act.sub.write_as_json({'a': 2, 'b': object()}, p)
+        self.assertEqual(['error.json'], os.listdir(self._root_dir))
+        self.assertEqual({'a': 1}, act.sub.read_json(p))
+
+    def test_fsync(self):
+        self._testname_root_dir('fsync')
+        act.sub.use_fsync(True)
+        try:
+            for d in ['a', 'b']:
+                os.makedirs(os.path.join(self._root_dir, d))
+                act.sub.write_as_json(
+                    [d], os.path.join(self._root_dir, d, 'fsync.json'))
+            self.assertEqual(2, len(act.sub._dirs_to_sync))
+            act.sub.sync_dirs()
+            self.assertFalse(act.sub._dirs_to_sync)
+        finally:
+            act.sub.use_fsync(False)
+        self.assertEqual(['b'],
+                         act.sub.read_json(
+                             os.path.join(self._root_dir, 'b', 'fsync.json')))
+
+
+def _log_in_worker():
+    logging.getLogger('act.worker').warning('Logged in worker %d.', os.getpid())
+    return os.getpid()
+
+
+class TestLoggingOptions(tact.sub4t.DirPerTest):
+
+    def test_spawned_worker(self):
+        self._testname_root_dir('spawned_worker')
+        log_file = os.path.join(self._root_dir, 'log.txt')
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=act.sub.use_logging_options,
+                initargs=((logging.WARNING, log_file),)) as pool:
+            pid = pool.submit(_log_in_worker).result()
+        with open(log_file, encoding='utf-8') as fp:
+            self.assertIn(f'Logged in worker {pid}.', fp.read())
+
+
+if __name__ == '__main__':
+    tact.sub4t.set_up_root_logging(_LOG_LEVEL)
+    unittest.main()
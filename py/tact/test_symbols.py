@@ -120,6 +120,7 @@ import inspect
 import logging
 # own imports
 import act.mergejson
+import act.symbols
 import tact.sub4t
 
 _LOG_LEVEL = logging.DEBUG
@@ -257,6 +258,28 @@ _MERGE_W_SYMBOLS = {
         'o': '["Kaa has scales and says hiss."]',
         'f': 'snake.mergelist.json',
     },
+    'scope_exclude': {
+        'n': ['f.json', 'symbols.json'],
+        'i': [
+            '{"a":"${x}","b":{"c":"${x}","d":["${x}","${x}"]},"e/f":"${x}"}',
+            '{"$interpolate":{"exclude":["/b/c","/b/d/1","/e~1f"]},"x":"X"}'
+        ],
+        'o': '{"a":"X","b":{"c":"${x}","d":["X","${x}"]},"e/f":"${x}"}'
+    },
+    'scope_include': {
+        'n': ['f.json', 'symbols.json'],
+        'i': [
+            '{"a":"${x}","b":{"c":"${x}","d":["${x}","${x}"]},"e":"${x}"}',
+            ('{"$interpolate":{"include":["/b","/e"],"exclude":["/b/d/0"]},'
+             '"x":"X"}')
+        ],
+        'o': '{"a":"${x}","b":{"c":"X","d":["${x}","X"]},"e":"X"}'
+    },
+    'scope_exclude_all': {
+        'n': ['f.json', 'symbols.json'],
+        'i': ['["${x}"]', '{"$interpolate":{"exclude":[""]},"x":"X"}'],
+        'o': '["${x}"]'
+    },
     # Test error detection starts here
     'more_than_one_symbol_set_files_in_mergelist': {
         'n': [
@@ -293,6 +316,16 @@ _MERGE_W_SYMBOLS = {
         'f': 'fish.mergelist.json',
         'x': ['fish', 'No symbol set']
     },
+    'scope_invalid_pointer': {
+        'n': ['f.json', 'symbols.json'],
+        'i': ['["${x}"]', '{"$interpolate":{"exclude":["a"]},"x":"X"}'],
+        'x': ['Invalid JSON pointer "a"', '$interpolate']
+    },
+    'scope_invalid_key': {
+        'n': ['f.json', 'symbols.json'],
+        'i': ['["${x}"]', '{"$interpolate":{"only":["/a"]},"x":"X"}'],
+        'x': ['$interpolate', 'include', 'exclude']
+    },
 }
 
 logger = logging.getLogger(__name__)
@@ -387,6 +420,154 @@ class TestSymbols(tact.sub4t.JsonArrayIn):
     def test_symbol_set_from_fname_no_set_in_file(self):
         self._doit()
 
+    def test_scope_exclude(self):
+        self._doit()
+
+    def test_scope_include(self):
+        self._doit()
+
+    def test_scope_exclude_all(self):
+        self._doit()
+
+    def test_scope_invalid_pointer(self):
+        self._doit()
+
+    def test_scope_invalid_key(self):
+        self._doit()
+
+
+class CatSymbolsFile(tact.sub4t.DirPerTest):
+    """Abstract class for tests of one symbols.json file per test."""
+
+    def _symbols_file(self):
+        self._testname_root_dir(inspect.stack()[1].function[len('test_'):])
+        p = os.path.join(self._root_dir, 'symbols.json')
+        with open(p, 'w', encoding='utf-8') as fp:
+            fp.write(_CAT_SYMBOLS_JSON)
+        return p
+
+
+class TestSymbolIndex(CatSymbolsFile):
+
+    def test_index_shared(self):
+        p = self._symbols_file()
+        dog = act.symbols.Symbols(p, 'dog')
+        cat = act.symbols.Symbols(p, 'cat')
+        self.assertIs(act.symbols.SymbolIndex.get(p),
+                      act.symbols.SymbolIndex.get(dog.source_file))
+        self.assertIs(dog.set_names, cat.set_names)
+        self.assertEqual({'cat', 'dog', 'mouse', 'snake'}, dog.set_names)
+
+    def test_resolve(self):
+        p = self._symbols_file()
+        index = act.symbols.SymbolIndex.get(p)
+        self.assertEqual({'skin': 'fur'}, index.resolve())
+        self.assertEqual({
+            'name': 'Kaa',
+            'noise': 'hiss',
+            'skin': 'scales'
+        }, index.resolve('snake'))
+        self.assertIs(index.resolve('snake'), index.resolve('snake'))
+        with self.assertRaisesRegex(act.symbols.Error, 'No symbol set "fish"'):
+            index.resolve('fish')
+
+    def test_select(self):
+        p = self._symbols_file()
+        index = act.symbols.SymbolIndex.get(p)
+        self.assertEqual(['dog', 'mouse'], index.select('mouse,dog'))
+        self.assertEqual(['cat', 'snake'], index.select('*a*'))
+        self.assertEqual(['cat', 'dog'], index.select('?og,cat,dog'))
+        with self.assertRaisesRegex(act.symbols.Error, r'No symbol set "f\*"'):
+            index.select('cat,f*')
+
+    def test_counts_not_shared(self):
+        p = self._symbols_file()
+        a = act.symbols.Symbols(p, 'dog')
+        b = act.symbols.Symbols(p, 'dog')
+        a.interpolate(['${name}'])
+        self.assertEqual(1, a.replacement_counts['name'])
+        self.assertEqual(0, b.replacement_counts['name'])
+
+
+class TestSubstitution(CatSymbolsFile):
+
+    def test_counts_and_unknown_names(self):
+        p = self._symbols_file()
+        mouse = act.symbols.Symbols(p, 'mouse')
+        jo = ['${name}${skin}${name}', '${noise} ${name}', 'x', '${noise}']
+        mouse.interpolate(jo)
+        self.assertEqual(
+            ['MickeyfurMickey', '${noise} Mickey', 'x', '${noise}'], jo)
+        self.assertEqual({'name': 3, 'skin': 1}, mouse.replacement_counts)
+        self.assertEqual({'noise'}, mouse.names_not_in_dict)
+
+    def test_memo(self):
+        p = self._symbols_file()
+        memo = act.symbols.use_memo(10)
+        try:
+            jo = ['${name} ${noise}', '${name} ${noise}']
+            snake = act.symbols.Symbols(p, 'snake')
+            snake.interpolate(jo)
+            self.assertEqual(['Kaa hiss', 'Kaa hiss'], jo)
+            self.assertEqual({'hits': 1, 'misses': 1}, {
+                k: memo.stats()[k] for k in ['hits', 'misses']
+            })
+            self.assertEqual(2, snake.replacement_counts['noise'])
+            mouse = act.symbols.Symbols(p, 'mouse')
+            jo = ['${name} ${noise}', '${name} ${noise}']
+            mouse.interpolate(jo)
+            self.assertEqual(['Mickey ${noise}', 'Mickey ${noise}'], jo)
+            self.assertEqual(2, mouse.replacement_counts['name'])
+            self.assertEqual({'noise'}, mouse.names_not_in_dict)
+            self.assertEqual(2, memo.stats()['hits'])
+        finally:
+            act.symbols.use_memo(None)
+
+
+class TestTemplate(CatSymbolsFile):
+
+    _JO = {
+        'a': '${name} says ${noise}.',
+        'b': {
+            'c': ['no symbol', '${skin}', 1, None],
+            'd': {
+                'e': 'x'
+            }
+        },
+        'f': 'costs $1 {2}',
+    }
+
+    def test_slots(self):
+        template = act.symbols.Template(self._JO)
+        self.assertEqual(2, template.slot_count)
+
+    def test_render(self):
+        p = self._symbols_file()
+        template = act.symbols.Template(self._JO)
+        mouse = act.symbols.Symbols(p, 'mouse')
+        snake = act.symbols.Symbols(p, 'snake')
+        r = template.render(mouse)
+        self.assertEqual('Mickey says ${noise}.', r['a'])
+        self.assertEqual(['no symbol', 'fur', 1, None], r['b']['c'])
+        self.assertEqual({'name': 1, 'skin': 1}, mouse.replacement_counts)
+        self.assertEqual({'noise'}, mouse.names_not_in_dict)
+        self.assertEqual('Kaa says hiss.', template.render(snake)['a'])
+        # Template unchanged, subtrees without slots shared.
+        self.assertEqual('${name} says ${noise}.', self._JO['a'])
+        self.assertEqual('${skin}', self._JO['b']['c'][1])
+        self.assertIs(self._JO['b']['d'], r['b']['d'])
+        self.assertIsNot(self._JO['b'], r['b'])
+
+    def test_same_as_interpolate(self):
+        p = self._symbols_file()
+        jo = {'x': ['${name}${name}', {'y': '${${name}}'}], 'z': '${}'}
+        a = act.symbols.Symbols(p, 'cat')
+        b = act.symbols.Symbols(p, 'cat')
+        r = act.symbols.Template(jo).render(a)
+        b.interpolate(jo)
+        self.assertEqual(jo, r)
+        self.assertEqual(b.replacement_counts, a.replacement_counts)
+
 
 if __name__ == '__main__':
     tact.sub4t.set_up_root_logging(_LOG_LEVEL)
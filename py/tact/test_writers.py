@@ -0,0 +1,101 @@
+"""Unit tests for writers.py.
+"""
+import unittest
+import os
+import logging
+import time
+# own imports
+import act.sub
+import act.writers
+import tact.sub4t
+
+_LOG_LEVEL = logging.CRITICAL
+
+
+class TestContentStore(tact.sub4t.DirPerTest):
+
+    def test_link(self):
+        self._testname_root_dir('link')
+        self.addCleanup(act.sub.use_store, None)
+        store = act.writers.ContentStore(os.path.join(self._root_dir, 'store'))
+        act.sub.use_store(store)
+        a, b = [os.path.join(self._root_dir, f) for f in ['a.json', 'b.json']]
+        for p in [a, b]:
+            self.assertEqual(act.sub.WRITE_ADDED,
+                             act.sub.write_as_json([1], p, output=True))
+        self.assertEqual(act.sub.WRITE_UNCHANGED,
+                         act.sub.write_as_json([1], b, output=True))
+        self.assertTrue(os.path.samefile(a, b))
+        self.assertEqual(3, os.stat(a).st_nlink)
+        self.assertEqual(act.sub.WRITE_CHANGED,
+                         act.sub.write_as_json([2], b, output=True))
+        # Not an output, not linked.
+        c = os.path.join(self._root_dir, 'c.json')
+        act.sub.write_as_json([1], c)
+        self.assertEqual(1, os.stat(c).st_nlink)
+        self.assertEqual([1], act.sub.read_json(a))
+        self.assertEqual([2], act.sub.read_json(b))
+        self.assertTrue(os.path.samefile(b, store.path(act.sub.file_digest(
+            b).hex())))
+        self.assertEqual(2, act.writers.ContentStore.report([a, b])['stored'])
+
+
+class TestStagingDir(tact.sub4t.DirPerTest):
+
+    def _build(self, target, o):
+        staging = act.writers.StagingDir(target)
+        p = os.path.join(staging.path, 'a.json')
+        act.sub.write_as_json(o, p)
+        self.assertEqual(os.path.join(target, 'a.json'),
+                         staging.target_path(p))
+        return staging
+
+    def test_commit(self):
+        self._testname_root_dir('commit')
+        target = os.path.join(self._root_dir, 'out')
+        self._build(target, [1]).commit()
+        staging = self._build(target, [2])
+        self.assertEqual([1], act.sub.read_json(os.path.join(target, 'a.json')))
+        staging.commit()
+        act.writers.wait_for_removals()
+        self.assertEqual([2], act.sub.read_json(os.path.join(target, 'a.json')))
+        self.assertEqual(['out'], os.listdir(self._root_dir))
+        self._build(target, [3]).discard()
+        self.assertEqual(['out'], os.listdir(self._root_dir))
+
+    def test_detached_removal(self):
+        self._testname_root_dir('detached_removal')
+        self.addCleanup(act.writers.use_detached_removals, False)
+        act.writers.use_detached_removals(True)
+        target = os.path.join(self._root_dir, 'out')
+        self._build(target, [1]).commit()
+        self._build(target, [2]).commit()
+        self.assertEqual([2], act.sub.read_json(os.path.join(target, 'a.json')))
+        # Nothing to wait for in this process.
+        act.writers.wait_for_removals()
+        deadline = time.monotonic() + 10
+        while (len(os.listdir(self._root_dir)) > 1 and
+               time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(['out'], os.listdir(self._root_dir))
+
+
+class TestBackgroundWriter(tact.sub4t.DirPerTest):
+
+    def test_order_and_errors(self):
+        self._testname_root_dir('order_and_errors')
+        p = os.path.join(self._root_dir, 'a.json')
+        writer = act.writers.BackgroundWriter(4, 100)
+        futures = [writer.write([i] * 50, p, 60) for i in range(20)]
+        failed = writer.write({'a': object()}, p + '.x')
+        writer.close()
+        self.assertEqual([act.sub.WRITE_ADDED] + [act.sub.WRITE_CHANGED] * 19,
+                         [f.result() for f in futures])
+        self.assertEqual([19] * 50, act.sub.read_json(p))
+        self.assertIsInstance(failed.exception(), act.sub.Error)
+        self.assertEqual(['a.json'], os.listdir(self._root_dir))
+
+
+if __name__ == '__main__':
+    tact.sub4t.set_up_root_logging(_LOG_LEVEL)
+    unittest.main()